@@ -0,0 +1,137 @@
+import contextlib
+import io
+import os
+import sys
+import time
+
+from .lexer import Lexer
+from .parser import Parser
+from .optimizer import optimize
+from .compiler import Compiler
+from .bytecode import CodeObject
+from .vm import VM
+from .register_vm import RegisterVM, register_code
+
+# Best-of runs per program and VM unless --runs=N is given
+DEFAULT_RUNS = 5
+
+
+def compile_program(source):
+    return Compiler().compile_code(optimize(Parser(Lexer(source).generate_tokens()).parse()))
+
+
+def code_objects(code_obj):
+    """A code object and every function code object nested in its constants"""
+    found = [code_obj]
+    for constant in code_obj.constants:
+        if isinstance(constant, CodeObject):
+            found.extend(code_objects(constant))
+    return found
+
+
+def static_counts(code_obj):
+    """(stack instructions, register instructions) over a program's code objects"""
+    stack = register = 0
+    for code in code_objects(code_obj):
+        stack += len(code.instructions())
+        register += len(register_code(code))
+    return stack, register
+
+
+def counted(handler):
+    def count(vm, *args):
+        vm.dispatches += 1
+        return handler(vm, *args)
+    return count
+
+
+class CountingVM(VM):
+    """Stack VM that counts the instructions it dispatches"""
+
+    def __init__(self):
+        super().__init__()
+        self.dispatches = 0
+
+    def thread_code(self, code_obj):
+        threaded = super().thread_code(code_obj)
+        code_obj.threaded = [(counted(handler), operand) for handler, operand in threaded]
+        return code_obj.threaded
+
+
+class CountingRegisterVM(RegisterVM):
+    """Register VM that counts the instructions it dispatches"""
+
+    def __init__(self):
+        super().__init__()
+        self.dispatches = 0
+
+    def thread_registers(self, code_obj):
+        threaded = super().thread_registers(code_obj)
+        code_obj.registers.threaded = [(counted(handler), operand) for handler, operand in threaded]
+        return code_obj.registers.threaded
+
+
+def run_quietly(vm, code_obj):
+    with contextlib.redirect_stdout(io.StringIO()):
+        vm.run(code_obj)
+
+
+def benchmark(source, runs=DEFAULT_RUNS):
+    """Instruction counts and best run time of a program on the stack and register VMs"""
+    results = {}
+    results['stack_static'], results['register_static'] = static_counts(compile_program(source))
+
+    for name, vm_class in (('stack', CountingVM), ('register', CountingRegisterVM)):
+        vm = vm_class()
+        run_quietly(vm, compile_program(source))
+        results[f'{name}_dispatches'] = vm.dispatches
+
+    # Alternate the two VMs so that machine noise hits both alike
+    best = {'stack': None, 'register': None}
+    for _ in range(runs):
+        for name, vm_class in (('stack', VM), ('register', RegisterVM)):
+            code_obj = compile_program(source)
+            start = time.perf_counter()
+            run_quietly(vm_class(), code_obj)
+            elapsed = time.perf_counter() - start
+            if best[name] is None or elapsed < best[name]:
+                best[name] = elapsed
+    results['stack_time'] = best['stack']
+    results['register_time'] = best['register']
+    return results
+
+
+def reduction(before, after):
+    return f"{100 * (before - after) / before:5.1f}%" if before else "    -"
+
+
+def main(args):
+    runs = DEFAULT_RUNS
+    for arg in list(args):
+        if arg.startswith("--runs="):
+            runs = int(arg.split("=", 1)[1])
+            args.remove(arg)
+    if not args:
+        print("Usage: python -m flow.benchmark [--runs=N] <file.flow>...")
+        sys.exit(1)
+
+    print(f"{'program':<20} {'static':>16} {'saved':>6}  {'dispatched':>20} {'saved':>6}  "
+          f"{'stack s':>8} {'register s':>10} {'speedup':>7}")
+    for path in args:
+        name = os.path.basename(path)
+        with open(path, 'r') as f:
+            source = f.read()
+        try:
+            r = benchmark(source, runs)
+        except Exception as e:
+            print(f"{name:<20} failed: {e}")
+            continue
+        print(f"{name:<20} "
+              f"{r['stack_static']:>7} -> {r['register_static']:<6} {reduction(r['stack_static'], r['register_static'])}  "
+              f"{r['stack_dispatches']:>9} -> {r['register_dispatches']:<8} "
+              f"{reduction(r['stack_dispatches'], r['register_dispatches'])}  "
+              f"{r['stack_time']:>8.4f} {r['register_time']:>10.4f} {r['stack_time'] / r['register_time']:>6.2f}x")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
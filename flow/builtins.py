@@ -17,6 +17,16 @@ BUILTINS = [
     'map', 'filter', 'reduce'
 ]
 
+# Builtins without side effects whose result depends only on their arguments' values
+PURE_BUILTINS = frozenset([
+    'abs', 'sqrt', 'pow', 'log', 'sin', 'cos', 'tan', 'floor', 'ceil', 'round',
+    'int', 'float', 'type', 'ord', 'chr', 'hex', 'bin',
+])
+
+# Builtins without side effects that read the contents of a list or string argument,
+# so their result only stays the same while nothing is modified
+READ_ONLY_BUILTINS = frozenset(['len', 'str', 'min', 'max', 'sum', 'contains'])
+
 # Cache for file operations to avoid repeated file system calls
 _file_cache = {}
 
@@ -303,4 +313,8 @@ def reduce(func, iterable, initial=None):
         # If func is not callable, it might be a Flow function
         # In a full implementation, we would handle Flow functions properly
         # For now, we'll return a placeholder
-        return result
\ No newline at end of file
+        return result
+
+# Builtin functions in BUILTINS order; CALL_BUILTIN operands index into this
+BUILTIN_TABLE = tuple(globals()[name] for name in BUILTINS)
+BUILTIN_INDEX = {name: index for index, name in enumerate(BUILTINS)}
@@ -1,3 +1,4 @@
+from array import array
 from enum import IntEnum
 
 class OpCode(IntEnum):
@@ -13,7 +14,7 @@ class OpCode(IntEnum):
     JUMP = 9
     RETURN_VALUE = 10
     CALL_FUNCTION = 11
-    CALL_BUILTIN = 22
+    CALL_BUILTIN = 22  # Operands: index into builtins.BUILTIN_TABLE, argument count
     POP_TOP = 12
     COMPARE_OP = 13
     BINARY_MODULO = 14
@@ -36,6 +37,23 @@ class OpCode(IntEnum):
     BINARY_XOR = 32    # Bitwise XOR
     BINARY_LSHIFT = 33  # Left shift
     BINARY_RSHIFT = 34 # Right shift
+    MAP_FUNCTION = 35     # map(func, iterable)
+    FILTER_FUNCTION = 36  # filter(func, iterable)
+    REDUCE_FUNCTION = 37  # reduce(func, iterable[, initial])
+    BUILD_MAP = 38        # Create a dictionary from key/value pairs
+    # Superinstructions produced by peephole.fuse
+    BINARY_ADD_FAST_FAST = 39        # LOAD_FAST a; LOAD_FAST b; BINARY_ADD
+    BINARY_ADD_FAST_CONST = 40       # LOAD_FAST a; LOAD_CONST c; BINARY_ADD
+    BINARY_SUBTRACT_FAST_CONST = 41  # LOAD_FAST a; LOAD_CONST c; BINARY_SUBTRACT
+    COMPARE_JUMP_IF_FALSE = 42       # COMPARE_OP op; JUMP_IF_FALSE target
+    LOAD_CONST_STORE_FAST = 43       # LOAD_CONST c; STORE_FAST a
+    TAIL_CALL = 44  # return f(...): run f in the caller's frame
+    MATCH = 45      # Operands: constant index of a patterns.MatchTable, case count + 1; see below
+    LOAD_DEREF = 46    # Operands: depth, slot of a local of an enclosing function
+    STORE_DEREF = 47   # Operands: depth, slot
+    MAKE_CLOSURE = 48  # Constant index of a nested function's code object
+    SAVE_NAME = 49     # Constant index of a name: push its global value, or None if it has none
+    RESTORE_NAME = 50  # Constant index of a name: pop a SAVE_NAME value back into it, deleting it if None
 
 class CompareOp(IntEnum):
     LESS_THAN = 0
@@ -50,3 +68,142 @@ class CompareOp(IntEnum):
 # Cache for frequently used opcodes
 OPCODE_CACHE = {opcode: opcode for opcode in OpCode}
 COMPARE_CACHE = {opcode: opcode for opcode in CompareOp}
+
+
+# Number of operand words following each opcode in encoded bytecode; the rest take one
+OPERAND_COUNTS = [1] * (max(OpCode) + 1)
+for _opcode in (OpCode.BINARY_ADD, OpCode.BINARY_SUBTRACT, OpCode.BINARY_MULTIPLY,
+                OpCode.BINARY_DIVIDE, OpCode.BINARY_MODULO, OpCode.BINARY_POWER,
+                OpCode.BINARY_AND, OpCode.BINARY_OR, OpCode.BINARY_XOR, OpCode.BINARY_LSHIFT,
+                OpCode.BINARY_RSHIFT, OpCode.UNARY_NEGATIVE, OpCode.UNARY_NOT,
+                OpCode.RETURN_VALUE, OpCode.POP_TOP, OpCode.DUP_TOP, OpCode.SUBSCR,
+                OpCode.STORE_SUBSCR, OpCode.GET_ITER, OpCode.MAP_FUNCTION, OpCode.FILTER_FUNCTION):
+    OPERAND_COUNTS[_opcode] = 0
+for _opcode in (OpCode.CALL_BUILTIN, OpCode.BINARY_ADD_FAST_FAST, OpCode.BINARY_ADD_FAST_CONST,
+                OpCode.BINARY_SUBTRACT_FAST_CONST, OpCode.COMPARE_JUMP_IF_FALSE,
+                OpCode.LOAD_CONST_STORE_FAST, OpCode.MATCH, OpCode.LOAD_DEREF, OpCode.STORE_DEREF):
+    OPERAND_COUNTS[_opcode] = 2
+OPERAND_COUNTS = tuple(OPERAND_COUNTS)
+
+# Opcodes that jump, and which of their operands is the target
+JUMP_OPERANDS = {
+    OpCode.JUMP: 0,
+    OpCode.JUMP_IF_FALSE: 0,
+    OpCode.FOR_ITER: 0,
+    OpCode.COMPARE_JUMP_IF_FALSE: 1,
+}
+
+# MATCH pops the subject and is followed by a branch table of one JUMP per
+# case plus one for the default, which it indexes with the case the table
+# finds. The entries are ordinary jumps, so they are remapped like any
+# other; the VMs read their targets once and jump straight to the case.
+
+
+def instruction_operands(instruction):
+    """Operands of an (opcode, operand) instruction as a tuple of ints"""
+    if len(instruction) == 1 or instruction[1] is None:
+        return ()
+    operand = instruction[1]
+    return tuple(operand) if isinstance(operand, tuple) else (operand,)
+
+
+def encode(instructions):
+    """Pack (opcode, operand) instructions into a flat array of words.
+
+    Jump targets are instruction indices before encoding and word offsets
+    after it.
+    """
+    offsets = []
+    offset = 0
+    for instruction in instructions:
+        offsets.append(offset)
+        offset += 1 + OPERAND_COUNTS[instruction[0]]
+    offsets.append(offset)
+
+    code = array('i')
+    for instruction in instructions:
+        opcode = instruction[0]
+        operands = instruction_operands(instruction)
+        if len(operands) != OPERAND_COUNTS[opcode]:
+            raise ValueError(f"{OpCode(opcode).name} takes {OPERAND_COUNTS[opcode]} operand(s), got {len(operands)}")
+        jump_operand = JUMP_OPERANDS.get(opcode)
+        if jump_operand is not None:
+            operands = list(operands)
+            operands[jump_operand] = offsets[operands[jump_operand]]
+        code.append(opcode)
+        code.extend(operands)
+    return code
+
+
+def decode(code):
+    """Unpack encoded bytecode into (offset, opcode, operand) triples.
+
+    The operand is None, an int, or a tuple for multi-operand instructions;
+    jump targets stay word offsets.
+    """
+    instructions = []
+    offset = 0
+    length = len(code)
+    while offset < length:
+        opcode = code[offset]
+        count = OPERAND_COUNTS[opcode]
+        if count == 0:
+            operand = None
+        elif count == 1:
+            operand = code[offset + 1]
+        else:
+            operand = tuple(code[offset + 1:offset + 1 + count])
+        instructions.append((offset, opcode, operand))
+        offset += 1 + count
+    return instructions
+
+
+class CodeObject:
+    """Compiled Flow code: packed bytecode plus what a frame needs to run it"""
+    __slots__ = ['name', 'code', 'constants', 'params', 'num_locals', 'local_names', 'type_params',
+                 'memo', 'threaded', 'registers']
+
+    def __init__(self, name, code, constants, params=(), num_locals=0, local_names=(), type_params=None,
+                 memo=None):
+        self.name = name
+        self.code = code              # array('i') of opcode and operand words
+        self.constants = constants
+        self.params = params
+        self.num_locals = num_locals  # Parameters occupy the first local slots
+        self.local_names = local_names
+        self.type_params = type_params
+        self.memo = memo              # MemoCache of a @memo function
+        # (handler, operand) pairs built by VM.thread_code on first execution
+        self.threaded = None
+        # RegisterCode built by RegisterVM on first execution
+        self.registers = None
+
+    @classmethod
+    def from_instructions(cls, name, instructions, constants, **kwargs):
+        return cls(name, encode(instructions), constants, **kwargs)
+
+    def instructions(self):
+        return decode(self.code)
+
+    def __repr__(self):
+        return f"<code object {self.name}>"
+
+
+class Closure:
+    """A nested function paired with the locals of the call that declared it.
+
+    ``function`` is a CodeObject, or the declaration node in the AST walker.
+    Every frame's locals end with those of the frame enclosing it, so a name
+    resolved at depth d is found by following that link d times. A @memo
+    function's results depend on those locals too, so each closure of it
+    gets its own empty cache.
+    """
+    __slots__ = ['function', 'parent', 'memo']
+
+    def __init__(self, function, parent):
+        self.function = function
+        self.parent = parent
+        self.memo = None if function.memo is None else function.memo.fresh()
+
+    def __repr__(self):
+        return f"<closure {self.function.name}>"
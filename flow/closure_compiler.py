@@ -0,0 +1,687 @@
+import copy
+
+from . import builtins
+from .resolver import Resolver
+from .compiler import EXPRESSION_NODES
+from .memo import memo_cache
+from .patterns import MatchTable, pattern_value
+from .parser import (
+    ExternFunctionDeclarationNode, VariableAccessNode, FunctionCallNode, BuiltinFunctionCallNode,
+    IntegerNode, FloatNode, StringNode, BooleanNode
+)
+from .lexer import TokenType
+
+# Returned by statement closures when a 'return' ran; the value is in the frame's last slot
+_RETURN = object()
+
+# Frame layout: parameters, other locals, the enclosing function's frame, then the return value slot
+_PARENT = -2
+
+LITERAL_NODES = (IntegerNode, FloatNode, StringNode, BooleanNode)
+
+
+class _TailCall:
+    """Return value of 'return f(...)': ClosureFunction.__call__ runs f in place"""
+    __slots__ = ['function', 'args']
+
+    def __init__(self, function, args):
+        self.function = function
+        self.args = args
+
+
+class ClosureFunction:
+    """A Flow function whose body has been compiled to a closure.
+
+    ``parent`` is the frame of the call that declared a nested function, and
+    None for top-level ones; ``bind`` makes the copy a declaration stores.
+    """
+    __slots__ = ['name', 'params', 'num_locals', 'body', 'parent']
+
+    def __init__(self, name, params, num_locals, body):
+        self.name = name
+        self.params = params
+        self.num_locals = num_locals
+        self.body = body
+        self.parent = None
+
+    def bind(self, parent):
+        function = copy.copy(self)
+        function.parent = parent
+        return function
+
+    def __call__(self, *args):
+        function = self
+        while True:
+            frame = [None] * (function.num_locals + 2)
+            frame[_PARENT] = function.parent
+            count = min(len(args), len(function.params))
+            frame[:count] = args[:count]
+            if function.body(frame) is not _RETURN:
+                return None
+            result = frame[-1]
+            if type(result) is not _TailCall:
+                return result
+            # Loop instead of recursing so tail calls run in constant stack depth
+            function = result.function
+            args = result.args
+
+    def __repr__(self):
+        return f"<function {self.name}>"
+
+
+class MemoizedClosureFunction(ClosureFunction):
+    """A ClosureFunction declared with @memo; repeated arguments are answered from its cache"""
+    __slots__ = ['memo']
+
+    def __init__(self, name, params, num_locals, body, memo):
+        super().__init__(name, params, num_locals, body)
+        self.memo = memo
+
+    def bind(self, parent):
+        # Results depend on the enclosing frame's locals, so every closure gets its own cache
+        function = super().bind(parent)
+        function.memo = self.memo.fresh()
+        return function
+
+    def __call__(self, *args):
+        return self.memo.call(self._call_uncached, args)
+
+    def _call_uncached(self, args):
+        return ClosureFunction.__call__(self, *args)
+
+
+def _enclosing_frame(f, depth):
+    """The frame of the function depth levels out from the one running in f"""
+    for _ in range(depth):
+        f = f[_PARENT]
+    return f
+
+
+def _binary_closure(op, left, right):
+    """Specialized closure for one binary operator applied to two child closures"""
+    if op == TokenType.PLUS:
+        return lambda f: left(f) + right(f)
+    elif op == TokenType.MINUS:
+        return lambda f: left(f) - right(f)
+    elif op == TokenType.MULTIPLY:
+        return lambda f: left(f) * right(f)
+    elif op == TokenType.DIVIDE:
+        return lambda f: left(f) / right(f)
+    elif op == TokenType.MODULO:
+        return lambda f: left(f) % right(f)
+    elif op == TokenType.LESS_THAN:
+        return lambda f: left(f) < right(f)
+    elif op == TokenType.GREATER_THAN:
+        return lambda f: left(f) > right(f)
+    elif op == TokenType.EQUAL_EQUAL:
+        return lambda f: left(f) == right(f)
+    elif op == TokenType.NOT_EQUALS:
+        return lambda f: left(f) != right(f)
+    elif op == TokenType.LESS_EQUAL:
+        return lambda f: left(f) <= right(f)
+    elif op == TokenType.GREATER_EQUAL:
+        return lambda f: left(f) >= right(f)
+    # For booleans '&' and '|' give the same results as 'and' and 'or'
+    elif op == TokenType.AND:
+        return lambda f: left(f) & right(f)
+    elif op == TokenType.OR:
+        return lambda f: left(f) | right(f)
+    elif op == TokenType.XOR:
+        return lambda f: left(f) ^ right(f)
+    raise Exception(f"Unsupported binary operation: {op}")
+
+
+def _binary_const_closure(op, left, constant):
+    """Variant of _binary_closure for a literal right operand, e.g. 'n - 1'"""
+    if op == TokenType.PLUS:
+        return lambda f: left(f) + constant
+    elif op == TokenType.MINUS:
+        return lambda f: left(f) - constant
+    elif op == TokenType.MULTIPLY:
+        return lambda f: left(f) * constant
+    elif op == TokenType.MODULO:
+        return lambda f: left(f) % constant
+    elif op == TokenType.LESS_THAN:
+        return lambda f: left(f) < constant
+    elif op == TokenType.GREATER_THAN:
+        return lambda f: left(f) > constant
+    elif op == TokenType.EQUAL_EQUAL:
+        return lambda f: left(f) == constant
+    elif op == TokenType.NOT_EQUALS:
+        return lambda f: left(f) != constant
+    elif op == TokenType.LESS_EQUAL:
+        return lambda f: left(f) <= constant
+    elif op == TokenType.GREATER_EQUAL:
+        return lambda f: left(f) >= constant
+    return None
+
+
+class ClosureCompiler:
+    """Execution engine that compiles the AST into nested Python closures once.
+
+    Every node becomes a closure taking the current frame (a list of
+    slot-indexed locals) and calling its children's closures directly, so no
+    visitor dispatch happens at run time. Expression closures return their
+    value; statement closures return None, or _RETURN after a 'return'.
+    """
+
+    def __init__(self):
+        self.globals = {}
+        self._method_cache = {}  # Cache for visitor methods
+        self._function_depth = 0  # Tail calls are only made inside function bodies
+
+    def run(self, node):
+        program = self.compile(node)
+        program()
+
+    def compile(self, node):
+        """Compile a ProgramNode into a callable that runs the whole program"""
+        Resolver().resolve(node)
+        body = self.visit(node)
+
+        def program():
+            body([None])  # The top level only has the return value slot
+        return program
+
+    def visit(self, node):
+        # Use cached method lookup for better performance
+        method_name = f'visit_{type(node).__name__}'
+        if method_name in self._method_cache:
+            method = self._method_cache[method_name]
+        else:
+            method = getattr(self, method_name, self.no_visit_method)
+            self._method_cache[method_name] = method
+        return method(node)
+
+    def no_visit_method(self, node):
+        raise Exception(f'No visit_{type(node).__name__} method defined')
+
+    def visit_statement(self, node):
+        closure = self.visit(node)
+        if isinstance(node, EXPRESSION_NODES):
+            # Discard the value so it isn't mistaken for a return status
+            def statement(f):
+                closure(f)
+            return statement
+        return closure
+
+    def visit_statements(self, statements):
+        closures = [self.visit_statement(statement) for statement in statements]
+        if len(closures) == 1:
+            return closures[0]
+
+        def block(f):
+            for closure in closures:
+                if closure(f) is not None:
+                    return _RETURN
+        return block
+
+    def visit_ProgramNode(self, node):
+        return self.visit_statements(node.statements)
+
+    def visit_BlockNode(self, node):
+        return self.visit_statements(node.statements)
+
+    def visit_PrintNode(self, node):
+        values = [self.visit(value) for value in node.values]
+
+        def print_statement(f):
+            print(' '.join([str(value(f)) for value in values]))
+        return print_statement
+
+    # --- Literals ---
+    def visit_StringNode(self, node):
+        value = node.value
+        return lambda f: value
+
+    def visit_IntegerNode(self, node):
+        value = node.value
+        return lambda f: value
+
+    def visit_FloatNode(self, node):
+        value = node.value
+        return lambda f: value
+
+    def visit_BooleanNode(self, node):
+        value = node.value
+        return lambda f: value
+
+    def visit_ListNode(self, node):
+        elements = [self.visit(element) for element in node.elements]
+        return lambda f: [element(f) for element in elements]
+
+    def visit_TupleNode(self, node):
+        elements = [self.visit(element) for element in node.elements]
+        return lambda f: tuple([element(f) for element in elements])
+
+    # --- Operators ---
+    def visit_BinOpNode(self, node):
+        left = self.visit(node.left)
+        if isinstance(node.right, LITERAL_NODES):
+            closure = _binary_const_closure(node.op, left, node.right.value)
+            if closure is not None:
+                return closure
+        return _binary_closure(node.op, left, self.visit(node.right))
+
+    def visit_UnaryOpNode(self, node):
+        operand = self.visit(node.operand)
+        if node.op == TokenType.MINUS:
+            return lambda f: -operand(f)
+        elif node.op == TokenType.NOT:
+            return lambda f: not operand(f)
+        raise Exception(f"Unsupported unary operation: {node.op}")
+
+    def visit_PipelineNode(self, node):
+        # 'x |> f' calls f(x); 'x |> f(a, b)' calls f(x, a, b)
+        right = node.right
+        if isinstance(right, VariableAccessNode):
+            call = FunctionCallNode(right.identifier, [node.left])
+            call.slot = right.slot
+            call.depth = right.depth
+            return self.visit(call)
+        elif isinstance(right, FunctionCallNode):
+            call = FunctionCallNode(right.name, [node.left] + right.args)
+            call.slot = right.slot
+            call.depth = right.depth
+            return self.visit(call)
+        elif isinstance(right, BuiltinFunctionCallNode):
+            return self.visit(BuiltinFunctionCallNode(right.name, [node.left] + right.args))
+        raise Exception(f"Cannot pipe into {type(right).__name__}")
+
+    def visit_IndexAccessNode(self, node):
+        obj = self.visit(node.obj)
+        index = self.visit(node.index)
+        return lambda f: obj(f)[index(f)]
+
+    def visit_IndexAssignmentNode(self, node):
+        obj = self.visit(node.obj)
+        index = self.visit(node.index)
+        value = self.visit(node.value)
+
+        def index_assignment(f):
+            target = obj(f)
+            key = index(f)
+            target[key] = value(f)
+        return index_assignment
+
+    # --- Variables ---
+    def visit_VariableAccessNode(self, node):
+        if node.slot is not None:
+            slot = node.slot
+            depth = node.depth
+            if depth:
+                return lambda f: _enclosing_frame(f, depth)[slot]
+            return lambda f: f[slot]
+
+        globals_ = self.globals
+        name = node.identifier
+
+        def load_global(f):
+            try:
+                return globals_[name]
+            except KeyError:
+                raise NameError(f"Name '{name}' is not defined") from None
+        return load_global
+
+    def store(self, node, name, value):
+        """Closure storing value() into the node's frame slot or a global"""
+        if node.slot is not None:
+            slot = node.slot
+            depth = node.depth
+            if depth:
+                def store_enclosing(f):
+                    _enclosing_frame(f, depth)[slot] = value(f)
+                return store_enclosing
+
+            def store_local(f):
+                f[slot] = value(f)
+            return store_local
+
+        globals_ = self.globals
+
+        def store_global(f):
+            globals_[name] = value(f)
+        return store_global
+
+    def visit_AssignmentNode(self, node):
+        return self.store(node, node.identifier, self.visit(node.value))
+
+    def visit_VariableDeclarationNode(self, node):
+        return self.store(node, node.identifier, self.visit(node.value))
+
+    def visit_MutableDeclarationNode(self, node):
+        return self.store(node, node.identifier, self.visit(node.value))
+
+    def visit_ImmutableDeclarationNode(self, node):
+        return self.store(node, node.identifier, self.visit(node.value))
+
+    def visit_AssignmentExpressionNode(self, node):
+        value = self.visit(node.value)
+        if node.slot is not None:
+            slot = node.slot
+
+            def walrus_local(f):
+                result = f[slot] = value(f)
+                return result
+            return walrus_local
+
+        globals_ = self.globals
+        name = node.identifier
+
+        def walrus_global(f):
+            result = globals_[name] = value(f)
+            return result
+        return walrus_global
+
+    # --- Control flow ---
+    def visit_IfNode(self, node):
+        condition = self.visit(node.condition)
+        if_block = self.visit(node.if_block)
+        if node.else_block:
+            else_block = self.visit(node.else_block)
+
+            def if_else(f):
+                if condition(f):
+                    return if_block(f)
+                return else_block(f)
+            return if_else
+
+        def if_only(f):
+            if condition(f):
+                return if_block(f)
+        return if_only
+
+    def visit_WhileNode(self, node):
+        condition = self.visit(node.condition)
+        block = self.visit(node.block)
+
+        def while_loop(f):
+            while condition(f):
+                if block(f) is not None:
+                    return _RETURN
+        return while_loop
+
+    def visit_ForNode(self, node):
+        iterable = self.visit(node.iterable)
+        block = self.visit(node.block)
+
+        if node.slot is not None:
+            slot = node.slot
+
+            def for_local(f):
+                items = iterable(f)
+                if not isinstance(items, list):
+                    raise Exception(f"Cannot iterate over {type(items).__name__}")
+                for item in items:
+                    f[slot] = item
+                    if block(f) is not None:
+                        return _RETURN
+            return for_local
+
+        globals_ = self.globals
+        target = node.target
+
+        def for_global(f):
+            items = iterable(f)
+            if not isinstance(items, list):
+                raise Exception(f"Cannot iterate over {type(items).__name__}")
+            # Like VM.visit_ForNode, the loop variable is restored afterwards
+            old_value = globals_.get(target, None)
+            status = None
+            for item in items:
+                globals_[target] = item
+                if block(f) is not None:
+                    status = _RETURN
+                    break
+            if old_value is not None:
+                globals_[target] = old_value
+            elif target in globals_:
+                del globals_[target]
+            return status
+        return for_global
+
+    def visit_MatchNode(self, node):
+        expression = self.visit(node.expression)
+        find = MatchTable([pattern_value(case.pattern) for case in node.cases]).find
+        # Indexed by MatchTable.find; the last block runs when no case matches
+        blocks = [self.visit(case.block) for case in node.cases]
+        blocks.append(self.visit(node.default_case) if node.default_case else None)
+
+        def match(f):
+            block = blocks[find(expression(f))]
+            if block is not None:
+                return block(f)
+        return match
+
+    def visit_ReturnNode(self, node):
+        if self._function_depth and type(node.value) is FunctionCallNode:
+            return self.tail_call(node.value)
+        value = self.visit(node.value)
+
+        def return_statement(f):
+            f[-1] = value(f)
+            return _RETURN
+        return return_statement
+
+    def tail_call(self, node):
+        """'return f(...)': hand the callee back to ClosureFunction.__call__"""
+        call = self.visit(node)  # Externs and errors go through the regular call
+        args = [self.visit(arg) for arg in node.args]
+        name = node.name
+
+        if node.slot is not None:
+            slot = node.slot
+            depth = node.depth
+
+            def tail_call_local(f):
+                function = _enclosing_frame(f, depth)[slot]
+                if not isinstance(function, ClosureFunction):
+                    raise TypeError(f"'{name}' is not a function")
+                if type(function) is ClosureFunction:
+                    f[-1] = _TailCall(function, [arg(f) for arg in args])
+                else:
+                    # Memoized functions must go through their cache
+                    f[-1] = function(*[arg(f) for arg in args])
+                return _RETURN
+            return tail_call_local
+
+        globals_ = self.globals
+
+        def tail_call(f):
+            function = globals_.get(name)
+            if type(function) is ClosureFunction:
+                f[-1] = _TailCall(function, [arg(f) for arg in args])
+            else:
+                f[-1] = call(f)
+            return _RETURN
+        return tail_call
+
+    # --- Functions ---
+    def declare_function(self, node, memo=None):
+        self._function_depth += 1
+        try:
+            body = self.visit(node.body)
+        finally:
+            self._function_depth -= 1
+        if memo is None:
+            function = ClosureFunction(node.name, node.params, node.num_locals, body)
+        else:
+            function = MemoizedClosureFunction(node.name, node.params, node.num_locals, body, memo)
+        globals_ = self.globals
+        name = node.name
+
+        if self._function_depth:
+            # A nested function is a local, and keeps the frame of the call declaring it
+            slot = node.slot
+
+            def declare_nested(f):
+                f[slot] = function.bind(f)
+            return declare_nested
+
+        def declare(f):
+            globals_[name] = function
+        return declare
+
+    def visit_FunctionDeclarationNode(self, node):
+        return self.declare_function(node)
+
+    def visit_AsyncFunctionDeclarationNode(self, node):
+        # Async functions run like regular functions for now
+        return self.declare_function(node)
+
+    def visit_GenericFunctionDeclarationNode(self, node):
+        return self.declare_function(node)
+
+    def visit_ExternFunctionDeclarationNode(self, node):
+        globals_ = self.globals
+        key = f"_extern_{node.name}"
+
+        def declare_extern(f):
+            globals_[key] = node
+        return declare_extern
+
+    def visit_FunctionCallNode(self, node):
+        args = [self.visit(arg) for arg in node.args]
+        name = node.name
+
+        if node.slot is not None:
+            # Functions passed as arguments or declared inside a function live in its frame
+            slot = node.slot
+            depth = node.depth
+
+            def call_local(f):
+                function = _enclosing_frame(f, depth)[slot]
+                if not isinstance(function, ClosureFunction):
+                    raise TypeError(f"'{name}' is not a function")
+                return function(*[arg(f) for arg in args])
+            return call_local
+
+        globals_ = self.globals
+        extern_key = f"_extern_{name}"
+
+        def call(f):
+            function = globals_.get(name)
+            if isinstance(function, ClosureFunction):
+                return function(*[arg(f) for arg in args])
+
+            # Check if this is an extern function call
+            if isinstance(globals_.get(extern_key), ExternFunctionDeclarationNode):
+                values = [arg(f) for arg in args]
+                # For now, we'll just return a placeholder
+                print(f"Calling extern function {name} with args {values}")
+                return 0
+            if name not in globals_:
+                raise NameError(f"Function '{name}' is not defined")
+            raise TypeError(f"'{name}' is not a function")
+        return call
+
+    def visit_BuiltinFunctionCallNode(self, node):
+        args = [self.visit(arg) for arg in node.args]
+        function = getattr(builtins, node.name, None)
+        name = node.name
+        if function is None:
+            def missing_builtin(f):
+                raise NameError(f"Built-in function '{name}' is not defined")
+            return missing_builtin
+
+        # Specialize the common arities to avoid building an argument list
+        if len(args) == 1:
+            arg0 = args[0]
+            return lambda f: function(arg0(f))
+        if len(args) == 2:
+            arg0, arg1 = args
+            return lambda f: function(arg0(f), arg1(f))
+        return lambda f: function(*[arg(f) for arg in args])
+
+    def visit_LambdaExpressionNode(self, node):
+        params = node.params
+
+        def lambda_placeholder(f):
+            # For now, we'll just return a placeholder like the AST walker
+            print(f"Creating lambda with params {params}")
+            return f"lambda({', '.join(params)})"
+        return lambda_placeholder
+
+    def visit_MapFunctionNode(self, node):
+        func = self.visit(node.func)
+        iterable = self.visit(node.iterable)
+
+        def map_function(f):
+            function = func(f)
+            items = iterable(f)
+            if isinstance(function, ClosureFunction):
+                return [function(item) for item in items]
+            print(f"Mapping {function} over {items}")
+            return [item for item in items] if isinstance(items, list) else []
+        return map_function
+
+    def visit_FilterFunctionNode(self, node):
+        func = self.visit(node.func)
+        iterable = self.visit(node.iterable)
+
+        def filter_function(f):
+            function = func(f)
+            items = iterable(f)
+            if isinstance(function, ClosureFunction):
+                return [item for item in items if function(item)]
+            print(f"Filtering {items} with {function}")
+            return [item for item in items] if isinstance(items, list) else []
+        return filter_function
+
+    def visit_ReduceFunctionNode(self, node):
+        func = self.visit(node.func)
+        iterable = self.visit(node.iterable)
+        initial = self.visit(node.initial) if node.initial else None
+
+        def reduce_function(f):
+            function = func(f)
+            items = iterable(f)
+            start = initial(f) if initial is not None else None
+            if not isinstance(function, ClosureFunction):
+                print(f"Reducing {items} with {function}")
+                return start if start is not None else (items[0] if isinstance(items, list) and items else None)
+            if not items:
+                return start
+            if start is None:
+                result = items[0]
+                rest = items[1:]
+            else:
+                result = start
+                rest = items
+            for item in rest:
+                result = function(result, item)
+            return result
+        return reduce_function
+
+    # --- Concurrency placeholders ---
+    def visit_AwaitExpressionNode(self, node):
+        return self.visit(node.expression)
+
+    def visit_SpawnExpressionNode(self, node):
+        return self.visit(node.expression)
+
+    def visit_ChannelDeclarationNode(self, node):
+        return self.store(node, node.identifier, lambda f: {"type": "channel", "data": []})
+
+    def visit_SendStatementNode(self, node):
+        value = self.visit(node.value)
+        channel_name = node.channel.identifier
+
+        def send(f):
+            print(f"Sending {value(f)} to channel {channel_name}")
+        return send
+
+    def visit_ReceiveStatementNode(self, node):
+        message = f"Receiving from channel {node.channel.identifier} into {node.variable}"
+        store = self.store(node, node.variable, lambda f: None)
+
+        def receive(f):
+            print(message)
+            store(f)
+        return receive
+
+    def visit_AnnotatedNode(self, node):
+        memo = memo_cache(node)
+        if memo is not None:
+            return self.declare_function(node.node, memo)
+        return self.visit_statement(node.node)
@@ -1,4 +1,3 @@
-
 from .parser import (ProgramNode, PrintNode, StringNode, IntegerNode, FloatNode, BooleanNode,
                      BinOpNode, VariableDeclarationNode, VariableAccessNode, AssignmentNode,
                      IfNode, WhileNode, ForNode, MatchNode, CaseNode, AssignmentExpressionNode,
@@ -9,23 +8,94 @@ from .parser import (ProgramNode, PrintNode, StringNode, IntegerNode, FloatNode,
                      TuplePatternNode, ConstructorPatternNode, TupleNode, MutableDeclarationNode,
                      ImmutableDeclarationNode, AllocNode, FreeNode, RefNode, DerefNode,
                      MacroDefinitionNode, MacroCallNode, CompileTimeEvalNode, AnnotatedNode,
-                     PatternNode)
+                     PatternNode, PipelineNode, LambdaExpressionNode, MapFunctionNode,
+                     FilterFunctionNode, ReduceFunctionNode, AsyncFunctionDeclarationNode,
+                     AwaitExpressionNode, SpawnExpressionNode, ChannelDeclarationNode,
+                     SendStatementNode, ReceiveStatementNode)
 from .lexer import TokenType
-from .bytecode import OpCode, CompareOp
+from .bytecode import OpCode, CompareOp, CodeObject
+from .peephole import DEFAULT_FUSIONS, eliminate_dead_code, fuse
+from .builtins import BUILTIN_INDEX
+from .memo import memo_cache
+from .patterns import MatchTable, pattern_value
+from .resolver import FUNCTION_NODES, Resolver
+from .optimizer import binding_counts, contains_node, count_nodes, walk
+
+# Nodes that leave a value on the stack; used as statements their result is discarded
+EXPRESSION_NODES = (StringNode, IntegerNode, FloatNode, BooleanNode, BinOpNode, VariableAccessNode,
+                    FunctionCallNode, BuiltinFunctionCallNode, ListNode, TupleNode, IndexAccessNode,
+                    UnaryOpNode, AssignmentExpressionNode, PipelineNode, LambdaExpressionNode,
+                    MapFunctionNode, FilterFunctionNode, ReduceFunctionNode, AwaitExpressionNode,
+                    SpawnExpressionNode)
+
+# Direct opcode mapping for binary operators
+BINARY_OPCODES = {
+    TokenType.PLUS: OpCode.BINARY_ADD,
+    TokenType.MINUS: OpCode.BINARY_SUBTRACT,
+    TokenType.MULTIPLY: OpCode.BINARY_MULTIPLY,
+    TokenType.DIVIDE: OpCode.BINARY_DIVIDE,
+    TokenType.MODULO: OpCode.BINARY_MODULO,
+    TokenType.AND: OpCode.BINARY_AND,
+    TokenType.OR: OpCode.BINARY_OR,
+    TokenType.XOR: OpCode.BINARY_XOR,
+}
+
+# Comparison operators all lower to COMPARE_OP with one of these operands
+COMPARE_OPS = {
+    TokenType.LESS_THAN: CompareOp.LESS_THAN,
+    TokenType.LESS_EQUAL: CompareOp.LESS_EQUAL,
+    TokenType.EQUAL_EQUAL: CompareOp.EQUAL,
+    TokenType.NOT_EQUALS: CompareOp.NOT_EQUAL,
+    TokenType.GREATER_THAN: CompareOp.GREATER_THAN,
+    TokenType.GREATER_EQUAL: CompareOp.GREATER_EQUAL,
+}
+
+UNARY_OPCODES = {
+    TokenType.MINUS: OpCode.UNARY_NEGATIVE,
+    TokenType.NOT: OpCode.UNARY_NOT,
+}
+
+# Largest function body, in AST nodes, that is inlined at its call sites
+DEFAULT_INLINE_THRESHOLD = 16
+
+# Bump whenever the bytecode a program compiles to changes, so stale .flowc files are never loaded
+COMPILER_VERSION = 7
 
 class Compiler:
-    def __init__(self):
+    def __init__(self, fusions=DEFAULT_FUSIONS, inline_threshold=DEFAULT_INLINE_THRESHOLD):
+        self.fusions = fusions # Names of peephole.SUPERINSTRUCTIONS to apply
+        self.inline_threshold = inline_threshold # 0 turns inlining off
         self.bytecode = []
         self.constants = []
         self._constant_cache = {}  # Cache for constant lookups
         self._method_cache = {}    # Cache for visitor methods
-        self._locals_stack = [{}] # Stack of dictionaries for local variables (name -> index)
-        self._local_count_stack = [0] # Stack of counts for local variables
+        # Frame slot of resolved slot 0: 0 in a function, the first slot of an inlined body, None at top level
+        self._slot_base = None
+        self._num_locals = 0 # Local slots of the frame being compiled, including inlined bodies
+        self._in_function = False
+        self._extern_functions = set() # Names declared with 'extern func'
+        self._function_name = '<program>' # Name of the code being compiled, for inlined_calls
+        self._bindings = None # How often each name is bound in the program
+        self._inline_candidates = {} # Function name -> declaration that may be inlined
+        self._inlining = [] # Names of the functions whose bodies are being inlined
+        self.inlined_calls = [] # (caller, callee) for every inlined call site
 
     def compile(self, node):
+        if isinstance(node, ProgramNode):
+            # Give every name its slot, or mark it global, once for the whole program
+            Resolver().resolve(node)
+            self._bindings = binding_counts(node)
         self.visit(node)
+        # Drop dead code and needless jumps, then fuse common opcode sequences into superinstructions
+        self.bytecode = eliminate_dead_code(self.bytecode, self.constants)
+        self.bytecode = fuse(self.bytecode, self.fusions)
         return self.bytecode, self.constants
 
+    def compile_code(self, node, name='<program>'):
+        """Compile a whole program into a top-level CodeObject"""
+        bytecode, constants = self.compile(node)
+        return CodeObject.from_instructions(name, bytecode, constants, num_locals=self._num_locals)
+
     def visit(self, node):
         # Use cached method lookup for better performance
         method_name = f'visit_{type(node).__name__}'
@@ -39,13 +109,22 @@ class Compiler:
     def no_visit_method(self, node):
         raise Exception(f'No visit_{type(node).__name__} method defined')
 
+    def visit_statement(self, node):
+        self.visit(node)
+        if isinstance(node, EXPRESSION_NODES):
+            self.emit(OpCode.POP_TOP)
+
     def visit_ProgramNode(self, node):
         for statement in node.statements:
-            self.visit(statement)
+            self.visit_statement(statement)
+            # Only unconditional top-level declarations are known to exist at later call sites
+            if isinstance(statement, FunctionDeclarationNode) and self.is_inlinable(statement):
+                self._inline_candidates[statement.name] = statement
 
     def visit_PrintNode(self, node):
-        self.visit(node.value)
-        self.emit(OpCode.PRINT)
+        for value in node.values:
+            self.visit(value)
+        self.emit(OpCode.PRINT, len(node.values))
 
     def visit_StringNode(self, node):
         self.emit(OpCode.LOAD_CONST, self.add_constant(node.value))
@@ -73,95 +152,114 @@ class Compiler:
         # Create tuple with specified size
         self.emit(OpCode.BUILD_TUPLE, len(node.elements))
 
+    def emit_store(self, node, identifier):
+        """Store the top of the stack into the node's resolved (depth, slot), or a global"""
+        if node.slot is None or self._slot_base is None:
+            self.emit(OpCode.STORE_NAME, self.add_constant(identifier))
+        elif node.depth:
+            # Enclosing functions are never inlined, so their slots have no base
+            self.emit(OpCode.STORE_DEREF, (node.depth, node.slot))
+        else:
+            self.emit(OpCode.STORE_FAST, self._slot_base + node.slot)
+
+    def emit_load(self, node, identifier):
+        """Load a name from its resolved (depth, slot), or from globals"""
+        if node.slot is None or self._slot_base is None:
+            self.emit(OpCode.LOAD_NAME, self.add_constant(identifier))
+        elif node.depth:
+            self.emit(OpCode.LOAD_DEREF, (node.depth, node.slot))
+        else:
+            self.emit(OpCode.LOAD_FAST, self._slot_base + node.slot)
+
     def visit_AssignmentNode(self, node):
         self.visit(node.value)
-        if len(self._locals_stack) > 1: # Inside a function
-            current_locals = self._locals_stack[-1]
-            current_local_count = self._local_count_stack[-1]
-            if node.identifier not in current_locals:
-                current_locals[node.identifier] = current_local_count
-                self._local_count_stack[-1] += 1
-            self.emit(OpCode.STORE_FAST, current_locals[node.identifier])
-        else: # Global scope
-            self.emit(OpCode.STORE_NAME, self.add_constant(node.identifier))
+        self.emit_store(node, node.identifier)
 
     def visit_MutableDeclarationNode(self, node):
         # Treat mutable declarations the same as regular assignments for now
         self.visit(node.value)
-        if len(self._locals_stack) > 1: # Inside a function
-            current_locals = self._locals_stack[-1]
-            current_local_count = self._local_count_stack[-1]
-            if node.identifier not in current_locals:
-                current_locals[node.identifier] = current_local_count
-                self._local_count_stack[-1] += 1
-            self.emit(OpCode.STORE_FAST, current_locals[node.identifier])
-        else: # Global scope
-            self.emit(OpCode.STORE_NAME, self.add_constant(node.identifier))
+        self.emit_store(node, node.identifier)
 
     def visit_ImmutableDeclarationNode(self, node):
         # Treat immutable declarations the same as regular assignments for now
         self.visit(node.value)
-        if len(self._locals_stack) > 1: # Inside a function
-            current_locals = self._locals_stack[-1]
-            current_local_count = self._local_count_stack[-1]
-            if node.identifier not in current_locals:
-                current_locals[node.identifier] = current_local_count
-                self._local_count_stack[-1] += 1
-            self.emit(OpCode.STORE_FAST, current_locals[node.identifier])
-        else: # Global scope
-            self.emit(OpCode.STORE_NAME, self.add_constant(node.identifier))
+        self.emit_store(node, node.identifier)
+
+    def visit_AssignmentExpressionNode(self, node):
+        # The walrus operator stores the value and also leaves it on the stack
+        self.visit(node.value)
+        self.emit(OpCode.DUP_TOP)
+        self.emit_store(node, node.identifier)
 
     def visit_BinOpNode(self, node):
         self.visit(node.left)
         self.visit(node.right)
-        
-        # Use direct opcode mapping for better performance
-        opcode_map = {
-            TokenType.PLUS: OpCode.BINARY_ADD,
-            TokenType.MINUS: OpCode.BINARY_SUBTRACT,
-            TokenType.MULTIPLY: OpCode.BINARY_MULTIPLY,
-            TokenType.DIVIDE: OpCode.BINARY_DIVIDE,
-            TokenType.LESS_THAN: OpCode.COMPARE_OP,
-        }
-        
-        opcode = opcode_map.get(node.op)
-        if opcode == OpCode.COMPARE_OP:
-            self.emit(opcode, CompareOp.LESS_THAN)
+
+        compare_op = COMPARE_OPS.get(node.op)
+        if compare_op is not None:
+            self.emit(OpCode.COMPARE_OP, compare_op)
+            return
+        opcode = BINARY_OPCODES.get(node.op)
+        if opcode is None:
+            raise Exception(f"Unsupported binary operation: {node.op}")
+        self.emit(opcode)
+
+    def visit_UnaryOpNode(self, node):
+        self.visit(node.operand)
+        opcode = UNARY_OPCODES.get(node.op)
+        if opcode is None:
+            raise Exception(f"Unsupported unary operation: {node.op}")
+        self.emit(opcode)
+
+    def visit_PipelineNode(self, node):
+        # 'x |> f' calls f(x); 'x |> f(a, b)' calls f(x, a, b)
+        right = node.right
+        if isinstance(right, VariableAccessNode):
+            call = FunctionCallNode(right.identifier, [node.left])
+        elif isinstance(right, FunctionCallNode):
+            call = FunctionCallNode(right.name, [node.left] + right.args)
+        elif isinstance(right, BuiltinFunctionCallNode):
+            self.visit(BuiltinFunctionCallNode(right.name, [node.left] + right.args))
+            return
         else:
-            self.emit(opcode)
+            raise Exception(f"Cannot pipe into {type(right).__name__}")
+        # The new call refers to the same variable as the piped-into name
+        call.slot = right.slot
+        call.depth = right.depth
+        self.visit(call)
 
     def visit_VariableDeclarationNode(self, node):
         self.visit(node.value)
-        if len(self._locals_stack) > 1: # Inside a function
-            current_locals = self._locals_stack[-1]
-            current_local_count = self._local_count_stack[-1]
-            if node.identifier not in current_locals:
-                current_locals[node.identifier] = current_local_count
-                self._local_count_stack[-1] += 1
-            self.emit(OpCode.STORE_FAST, current_locals[node.identifier])
-        else: # Global scope
-            self.emit(OpCode.STORE_NAME, self.add_constant(node.identifier))
+        self.emit_store(node, node.identifier)
 
     def visit_VariableAccessNode(self, node):
-        # Check if it's a local variable in the current scope or any enclosing scope
-        for locals_scope in reversed(self._locals_stack):
-            if node.identifier in locals_scope:
-                self.emit(OpCode.LOAD_FAST, locals_scope[node.identifier])
-                return
-        # If not found in local scopes, assume it's a global
-        self.emit(OpCode.LOAD_NAME, self.add_constant(node.identifier))
+        # Only top-level functions are inlined, so an inlined body never reaches its caller's locals
+        self.emit_load(node, node.identifier)
+
+    def visit_IndexAccessNode(self, node):
+        self.visit(node.obj)
+        self.visit(node.index)
+        self.emit(OpCode.SUBSCR)
+
+    def visit_IndexAssignmentNode(self, node):
+        self.visit(node.obj)
+        self.visit(node.index)
+        self.visit(node.value)
+        self.emit(OpCode.STORE_SUBSCR)
 
     def visit_IfNode(self, node):
         self.visit(node.condition)
         # Jump to else block if condition is false
-        jump_if_false_pos = self.emit(OpCode.JUMP_IF_FALSE, -1) 
+        jump_if_false_pos = self.emit(OpCode.JUMP_IF_FALSE, -1)
         self.visit(node.if_block)
+        if not node.else_block:
+            self.bytecode[jump_if_false_pos] = (OpCode.JUMP_IF_FALSE, len(self.bytecode))
+            return
         # Jump over else block
         jump_pos = self.emit(OpCode.JUMP, -1)
         # Set the jump target for the if statement
         self.bytecode[jump_if_false_pos] = (OpCode.JUMP_IF_FALSE, len(self.bytecode))
-        if node.else_block:
-            self.visit(node.else_block)
+        self.visit(node.else_block)
         # Set the jump target for the else statement
         self.bytecode[jump_pos] = (OpCode.JUMP, len(self.bytecode))
 
@@ -173,81 +271,284 @@ class Compiler:
         self.emit(OpCode.JUMP, loop_start_pos) # Jump back to the beginning of the loop
         self.bytecode[jump_if_false_pos] = (OpCode.JUMP_IF_FALSE, len(self.bytecode)) # Set jump target to after the loop
 
+    def visit_ForNode(self, node):
+        # Like VM.visit_ForNode, a global loop variable gets its old value back afterwards
+        restores_global = node.slot is None or self._slot_base is None
+        if restores_global:
+            self.emit(OpCode.SAVE_NAME, self.add_constant(node.target))
+        self.visit(node.iterable)
+        self.emit(OpCode.GET_ITER)
+        loop_start_pos = len(self.bytecode)
+        # FOR_ITER pushes the next item, or pops the iterator and jumps past the loop
+        for_iter_pos = self.emit(OpCode.FOR_ITER, -1)
+        self.emit_store(node, node.target)
+        self.visit(node.block)
+        self.emit(OpCode.JUMP, loop_start_pos)
+        self.bytecode[for_iter_pos] = (OpCode.FOR_ITER, len(self.bytecode))
+        if restores_global:
+            self.emit(OpCode.RESTORE_NAME, self.add_constant(node.target))
+
+    def visit_MatchNode(self, node):
+        # One table lookup of the subject picks the case; see OpCode.MATCH for the layout
+        self.visit(node.expression)
+        table = MatchTable([pattern_value(case.pattern) for case in node.cases])
+        self.emit(OpCode.MATCH, (self.add_constant(table), len(node.cases) + 1))
+        entries = [self.emit(OpCode.JUMP, -1) for _ in range(len(node.cases) + 1)]
+        end_jumps = []
+        for case, entry_pos in zip(node.cases, entries):
+            self.bytecode[entry_pos] = (OpCode.JUMP, len(self.bytecode))
+            self.visit(case.block)
+            end_jumps.append(self.emit(OpCode.JUMP, -1))
+        # The last entry is taken when no case matches
+        self.bytecode[entries[-1]] = (OpCode.JUMP, len(self.bytecode))
+        if node.default_case:
+            self.visit(node.default_case)
+        for jump_pos in end_jumps:
+            self.bytecode[jump_pos] = (OpCode.JUMP, len(self.bytecode))
+
+    def compile_function(self, node, **extra):
+        """Compile a function body into a code object whose first locals are its parameters"""
+        if not hasattr(node, 'num_locals'):
+            # Declarations compiled on their own haven't been resolved yet
+            Resolver().resolve(node)
+        compiler = Compiler(self.fusions, self.inline_threshold)
+        compiler._extern_functions = self._extern_functions
+        compiler._function_name = node.name
+        compiler._bindings = self._bindings
+        compiler._inline_candidates = self._inline_candidates
+        compiler.inlined_calls = self.inlined_calls
+        compiler._in_function = True
+        compiler._slot_base = 0
+        compiler._num_locals = node.num_locals
+        compiler.compile(node.body)
+
+        # Slots added for inlined bodies have no name of their own
+        local_names = list(node.local_names) + [None] * (compiler._num_locals - node.num_locals)
+
+        return CodeObject.from_instructions(
+            node.name, compiler.bytecode, compiler.constants,
+            params=node.params,
+            memo=node.memo,
+            num_locals=compiler._num_locals, # Number of local variables
+            local_names=local_names, # Names of local variables in order of indices
+            **extra)
+
+    def emit_function(self, node, code_obj):
+        # Bound like VM.declare_function: top-level functions in globals, nested ones in a local slot
+        if self._in_function:
+            # A nested function sees the locals of the call that declares it
+            self.emit(OpCode.MAKE_CLOSURE, self.add_constant(code_obj))
+        else:
+            self.emit(OpCode.LOAD_CONST, self.add_constant(code_obj))
+        self.emit_store(node, code_obj.name)
+
+    def visit_FunctionDeclarationNode(self, node):
+        self.emit_function(node, self.compile_function(node))
+
+    def visit_AsyncFunctionDeclarationNode(self, node):
+        # Async functions run like regular functions for now
+        self.emit_function(node, self.compile_function(node))
+
     def visit_GenericFunctionDeclarationNode(self, node):
         # Handle generic function declaration
         # For now, we'll treat it like a regular function but store type parameter info
-        # Push a new local scope
-        self._locals_stack.append({})
-        self._local_count_stack.append(0)
-
-        # Handle parameters as initial local variables
-        current_locals = self._locals_stack[-1]
-        current_local_count = self._local_count_stack[-1]
-        for param in node.params:
-            current_locals[param] = current_local_count
-            current_local_count += 1
-        self._local_count_stack[-1] = current_local_count
-
-        # Compile the function body
-        compiler = Compiler()
-        # Set up the same local scope for the new compiler
-        compiler._locals_stack = [current_locals.copy()]
-        compiler._local_count_stack = [current_local_count]
-        compiler.compile(node.body)
-        func_bytecode, func_constants = compiler.bytecode, compiler.constants
-
-        # Get local variable names in order of their indices
-        local_names = [None] * self._local_count_stack[-1]
-        for name, index in self._locals_stack[-1].items():
-            local_names[index] = name
-
-        # Create a code object for the function
-        code_obj = {
-            'bytecode': func_bytecode,
-            'constants': func_constants,
-            'params': node.params,
-            'num_locals': self._local_count_stack[-1], # Number of local variables
-            'local_names': local_names, # Names of local variables in order of indices
-            'type_params': node.type_params # Store type parameter info
-        }
-        # Store the code object as a constant
-        self.emit(OpCode.LOAD_CONST, self.add_constant(code_obj))
-        self.emit(OpCode.STORE_NAME, self.add_constant(node.name))
-
-        # Pop the local scope
-        self._locals_stack.pop()
-        self._local_count_stack.pop()
+        self.emit_function(node, self.compile_function(node, type_params=node.type_params))
+
+    def visit_ExternFunctionDeclarationNode(self, node):
+        # Store the declaration metadata, like VM.visit_ExternFunctionDeclarationNode
+        self._extern_functions.add(node.name)
+        self.emit(OpCode.LOAD_CONST, self.add_constant(node))
+        self.emit(OpCode.STORE_NAME, self.add_constant(f"_extern_{node.name}"))
 
     def visit_FunctionCallNode(self, node):
+        if node.name in self._extern_functions:
+            self.emit_extern_call(node)
+            return
+        if self.can_inline(node):
+            self.emit_inline_call(self._inline_candidates[node.name], node)
+            return
         # Load the function
-        self.emit(OpCode.LOAD_NAME, self.add_constant(node.name))
+        self.emit_load(node, node.name)
         # Load the arguments
         for arg in node.args:
             self.visit(arg)
         # Call the function
         self.emit(OpCode.CALL_FUNCTION, len(node.args))
 
+    def is_inlinable(self, node):
+        """Whether calls to a function declaration may be replaced by its body"""
+        if self.inline_threshold <= 0 or self._bindings is None or self._bindings[node.name] != 1:
+            return False
+        if count_nodes(node.body) > self.inline_threshold:
+            return False
+        # Nested declarations would be re-declared at every call site
+        if contains_node(node.body, FUNCTION_NODES + (ExternFunctionDeclarationNode,)):
+            return False
+        statements = node.body.statements if isinstance(node.body, BlockNode) else [node.body]
+        # The result has to be on the stack at the end: 'return' may only be the last statement
+        if any(contains_node(statement, ReturnNode) for statement in statements[:-1]):
+            return False
+        if statements and not isinstance(statements[-1], ReturnNode) and contains_node(statements[-1], ReturnNode):
+            return False
+        # Recursive functions can't be inlined into themselves
+        return not any(isinstance(call, FunctionCallNode) and call.name == node.name
+                       for call in walk(node.body))
+
+    def can_inline(self, node):
+        # A local of the same name (e.g. a function parameter) shadows the global function
+        return (node.slot is None and node.name in self._inline_candidates
+                and node.name not in self._inlining)
+
+    def emit_inline_call(self, func, node):
+        """Compile a call as the callee's body, its locals renamed to fresh slots of this frame"""
+        names = func.local_names
+        first_slot = self._num_locals
+        self._num_locals += len(names)
+
+        # Arguments are evaluated in the caller's scope, left to right
+        for arg in node.args:
+            self.visit(arg)
+        params = func.params
+        # Extra arguments are evaluated and dropped; missing ones are None, like in call_function
+        for _ in range(len(node.args) - len(params)):
+            self.emit(OpCode.POP_TOP)
+        # Parameters take the first of the callee's resolved slots
+        for index in reversed(range(min(len(node.args), len(params)))):
+            self.emit(OpCode.STORE_FAST, first_slot + index)
+        # Missing parameters and the other locals start out as None on every call
+        for index in range(min(len(node.args), len(params)), len(names)):
+            self.emit(OpCode.LOAD_CONST, self.add_constant(None))
+            self.emit(OpCode.STORE_FAST, first_slot + index)
+
+        # The callee's resolved slots are relative to first_slot in this frame
+        caller_base = self._slot_base
+        self._slot_base = first_slot
+        self._inlining.append(func.name)
+        try:
+            statements = func.body.statements if isinstance(func.body, BlockNode) else [func.body]
+            returns = bool(statements) and isinstance(statements[-1], ReturnNode)
+            for statement in (statements[:-1] if returns else statements):
+                self.visit_statement(statement)
+            # The return value stays on the stack as the value of the call
+            if returns:
+                self.visit(statements[-1].value)
+            else:
+                self.emit(OpCode.LOAD_CONST, self.add_constant(None))
+        finally:
+            self._inlining.pop()
+            self._slot_base = caller_base
+        self.inlined_calls.append((self._function_name, func.name))
+
+    def emit_extern_call(self, node):
+        # Extern calls are placeholders for now: report the call and produce 0
+        self.emit(OpCode.LOAD_CONST, self.add_constant(f"Calling extern function {node.name} with args"))
+        for arg in node.args:
+            self.visit(arg)
+        self.emit(OpCode.BUILD_LIST, len(node.args))
+        self.emit(OpCode.PRINT, 2)
+        self.emit(OpCode.LOAD_CONST, self.add_constant(0))
+
     def visit_ReturnNode(self, node):
-        self.visit(node.value)
+        value = node.value
+        # 'return f(...)' inside a function reuses the frame instead of nesting a call
+        if (self._in_function and isinstance(value, FunctionCallNode)
+                and value.name not in self._extern_functions and not self.can_inline(value)):
+            self.emit_load(value, value.name)
+            for arg in value.args:
+                self.visit(arg)
+            self.emit(OpCode.TAIL_CALL, len(value.args))
+            return
+        self.visit(value)
         self.emit(OpCode.RETURN_VALUE)
 
     def visit_BuiltinFunctionCallNode(self, node):
+        index = BUILTIN_INDEX.get(node.name)
+        if index is None:
+            raise NameError(f"Built-in function '{node.name}' is not defined")
         # Load the arguments
         for arg in node.args:
             self.visit(arg)
-        # Push the number of arguments
-        self.emit(OpCode.LOAD_CONST, self.add_constant(len(node.args)))
-        # Call the built-in function
-        self.emit(OpCode.CALL_BUILTIN, self.add_constant(node.name))
+        # Call the built-in function by table index; the arity is part of the operand
+        self.emit(OpCode.CALL_BUILTIN, (index, len(node.args)))
+
+    def visit_MapFunctionNode(self, node):
+        self.visit(node.func)
+        self.visit(node.iterable)
+        self.emit(OpCode.MAP_FUNCTION)
+
+    def visit_FilterFunctionNode(self, node):
+        self.visit(node.func)
+        self.visit(node.iterable)
+        self.emit(OpCode.FILTER_FUNCTION)
+
+    def visit_ReduceFunctionNode(self, node):
+        self.visit(node.func)
+        self.visit(node.iterable)
+        # Operand tells the VM whether an initial value was pushed
+        if node.initial:
+            self.visit(node.initial)
+            self.emit(OpCode.REDUCE_FUNCTION, 1)
+        else:
+            self.emit(OpCode.REDUCE_FUNCTION, 0)
+
+    def visit_LambdaExpressionNode(self, node):
+        # Lambdas are placeholders for now, like VM.visit_LambdaExpressionNode
+        self.emit(OpCode.LOAD_CONST, self.add_constant(f"Creating lambda with params {node.params}"))
+        self.emit(OpCode.PRINT, 1)
+        self.emit(OpCode.LOAD_CONST, self.add_constant(f"lambda({', '.join(node.params)})"))
+
+    def visit_AwaitExpressionNode(self, node):
+        # Awaited expressions are evaluated directly for now
+        self.visit(node.expression)
+
+    def visit_SpawnExpressionNode(self, node):
+        # Spawned expressions are evaluated directly for now
+        self.visit(node.expression)
+
+    def visit_ChannelDeclarationNode(self, node):
+        # Channels are placeholder dictionaries for now
+        self.emit(OpCode.LOAD_CONST, self.add_constant("type"))
+        self.emit(OpCode.LOAD_CONST, self.add_constant("channel"))
+        self.emit(OpCode.LOAD_CONST, self.add_constant("data"))
+        self.emit(OpCode.BUILD_LIST, 0)
+        self.emit(OpCode.BUILD_MAP, 2)
+        self.emit_store(node, node.identifier)
+
+    def visit_SendStatementNode(self, node):
+        self.emit(OpCode.LOAD_CONST, self.add_constant("Sending"))
+        self.visit(node.value)
+        self.emit(OpCode.LOAD_CONST, self.add_constant(f"to channel {node.channel.identifier}"))
+        self.emit(OpCode.PRINT, 3)
+
+    def visit_ReceiveStatementNode(self, node):
+        message = f"Receiving from channel {node.channel.identifier} into {node.variable}"
+        self.emit(OpCode.LOAD_CONST, self.add_constant(message))
+        self.emit(OpCode.PRINT, 1)
+        self.emit(OpCode.LOAD_CONST, self.add_constant(None))
+        self.emit_store(node, node.variable)
+
+    def visit_AnnotatedNode(self, node):
+        # @memo hangs a cache on the declaration for compile_function to pick up
+        memo = memo_cache(node)
+        if memo is not None:
+            node.node.memo = memo
+        self.visit_statement(node.node)
 
     def visit_BlockNode(self, node):
         for statement in node.statements:
-            self.visit(statement)
+            self.visit_statement(statement)
 
     def add_constant(self, value):
-        # Check if the value is already in the cache
-        if value in self._constant_cache:
-            return self._constant_cache[value]
+        # Key on the type too so that 1, 1.0 and True stay distinct constants
+        try:
+            key = (type(value), value)
+            index = self._constant_cache.get(key)
+        except TypeError:
+            # Unhashable constants (code objects, lists) are never shared
+            key = None
+            index = None
+        if index is not None:
+            return index
 
         # If not in cache, it's a new constant
         # Add it to the list of constants and get its index
@@ -255,7 +556,8 @@ class Compiler:
         self.constants.append(value)
 
         # Store the value and its index in the cache
-        self._constant_cache[value] = index
+        if key is not None:
+            self._constant_cache[key] = index
         return index
 
     def emit(self, opcode, operand=None):
@@ -263,6 +565,6 @@ class Compiler:
             instruction = (opcode, operand)
         else:
             instruction = (opcode,)
-        
+
         self.bytecode.append(instruction)
         return len(self.bytecode) - 1
@@ -5,26 +5,70 @@ import llvmlite.binding as llvm
 
 from .lexer import Lexer
 from .parser import Parser
+from .compiler import Compiler, DEFAULT_INLINE_THRESHOLD
+from .closure_compiler import ClosureCompiler
+from .optimizer import optimize
 from . import builtins
 from .vm import VM  # Use VM instead of LLVM compiler for testing new features
+from .register_vm import RegisterVM
+from .flowc import BytecodeCache
 from .profiler import global_profiler
 
 CACHE_DIR = Path(__file__).parent.parent / "cache"
 CACHE_DIR.mkdir(exist_ok=True)
 
-def run_code(code, file_path=None, profile=False):
+# Execution engines selectable with --engine=<name>
+ENGINES = ('bytecode', 'ast', 'closure', 'register')
+DEFAULT_ENGINE = 'bytecode'
+
+def parse_code(code):
+    # The parser pulls tokens from the lexer as it goes, so no token list is built
+    lexer = Lexer(code)
+    parser = Parser(lexer.generate_tokens())
+    ast = parser.parse()
+    # Fold constants and hoist loop invariants once for every engine
+    return optimize(ast)
+
+def compile_program(code, inline_threshold=DEFAULT_INLINE_THRESHOLD, use_cache=True):
+    """(code object, inlined calls) for a program, from its .flowc file when the source is unchanged"""
+    cache = BytecodeCache(CACHE_DIR) if use_cache else None
+    if cache is not None:
+        cached = cache.load(code, inline_threshold)
+        if cached is not None:
+            return cached
+    compiler = Compiler(inline_threshold=inline_threshold)
+    code_obj = compiler.compile_code(parse_code(code))
+    if cache is not None:
+        cache.store(code, inline_threshold, code_obj, compiler.inlined_calls)
+    return code_obj, compiler.inlined_calls
+
+def run_code(code, file_path=None, profile=False, engine=DEFAULT_ENGINE,
+             inline_threshold=DEFAULT_INLINE_THRESHOLD, inline_report=False, use_cache=True):
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine '{engine}' (expected one of: {', '.join(ENGINES)})")
+
     # Start profiling if requested
     if profile:
         global_profiler.start()
-    lexer = Lexer(code)
-    tokens = lexer.tokenize()
 
-    parser = Parser(tokens)
-    ast = parser.parse()
-
-    # Use VM for execution
-    vm = VM()
-    vm.run(ast.statements, [])  # Pass empty constants for now
+    if engine == 'ast':
+        # Walk the AST directly
+        VM().run(parse_code(code).statements, [])  # Pass empty constants for now
+    elif engine == 'closure':
+        # Compile the AST into nested closures once, then call the root closure
+        ClosureCompiler().run(parse_code(code))
+    else:
+        # Compile to bytecode, or load it from cache/, and execute it through execute_frame
+        code_obj, inlined_calls = compile_program(code, inline_threshold, use_cache)
+        if engine == 'register':
+            # Same bytecode, translated to register instructions as each code object first runs
+            RegisterVM().run(code_obj)
+        else:
+            VM().run(code_obj)
+        if inline_report:
+            print("\n=== Inlined Calls ===")
+            for caller, callee in inlined_calls:
+                print(f"  {callee} into {caller}")
         
     # Stop and report profiling if requested
     if profile:
@@ -45,7 +89,14 @@ def run_code(code, file_path=None, profile=False):
             for func, time_spent in sorted(results['function_times'].items(), key=lambda x: x[1], reverse=True):
                 print(f"  {func}: {time_spent:.4f} seconds")
 
-def repl():
+        if results['memo_caches']:
+            print("\nMemoized functions:")
+            for func, stats in results['memo_caches'].items():
+                maxsize = 'unbounded' if stats['maxsize'] is None else stats['maxsize']
+                print(f"  {func}: {stats['hits']} hits, {stats['misses']} misses, "
+                      f"{stats['bypasses']} uncached, {stats['size']}/{maxsize} entries")
+
+def repl(engine=DEFAULT_ENGINE):
     print("Flow REPL (LLVM JIT enabled)") # Update REPL message
     print("Type 'exit' to quit")
     
@@ -54,7 +105,8 @@ def repl():
             line = input(">>> ")
             if line.strip() == "exit":
                 break
-            run_code(line)
+            # Single lines aren't worth a .flowc file each
+            run_code(line, engine=engine, use_cache=False)
         except EOFError:
             break
         except Exception as e:
@@ -68,19 +120,47 @@ def main():
     if "--profile" in args:
         profile = True
         args.remove("--profile")
+
+    # Report which calls the bytecode compiler inlined
+    inline_report = False
+    if "--inline-report" in args:
+        inline_report = True
+        args.remove("--inline-report")
+
+    # Always lex, parse and compile instead of loading cached bytecode
+    use_cache = True
+    if "--no-cache" in args:
+        use_cache = False
+        args.remove("--no-cache")
+
+    # Check for engine selection (--engine=ast keeps the AST walker)
+    engine = DEFAULT_ENGINE
+    inline_threshold = DEFAULT_INLINE_THRESHOLD
+    for arg in list(args):
+        if arg.startswith("--engine="):
+            engine = arg.split("=", 1)[1]
+            args.remove(arg)
+        elif arg.startswith("--inline-threshold="):
+            # Largest function body, in AST nodes, to inline; 0 turns inlining off
+            inline_threshold = int(arg.split("=", 1)[1])
+            args.remove(arg)
+    if engine not in ENGINES:
+        print(f"Error: Unknown engine '{engine}' (expected one of: {', '.join(ENGINES)})")
+        return
     
     if len(args) > 0:
         file_path = args[0]
         try:
             with open(file_path, 'r') as f:
                 code = f.read()
-            run_code(code, file_path=file_path, profile=profile)
+            run_code(code, file_path=file_path, profile=profile, engine=engine,
+                     inline_threshold=inline_threshold, inline_report=inline_report, use_cache=use_cache)
         except FileNotFoundError:
             print(f"Error: File '{file_path}' not found")
         except Exception as e:
             print(f"Error: {e}")
     else:
-        repl()
+        repl(engine)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,163 @@
+import hashlib
+import marshal
+import os
+import sys
+from array import array
+from functools import lru_cache
+from pathlib import Path
+
+from . import bytecode, compiler, lexer, optimizer, parser, patterns, peephole, resolver
+from .bytecode import CodeObject
+from .compiler import COMPILER_VERSION
+from .memo import MemoCache
+from .parser import ExternFunctionDeclarationNode
+from .patterns import MatchTable
+
+# Every .flowc file starts with these bytes
+MAGIC = b'FLOWC\x00'
+
+# Tags of the constants that aren't marshalled as they are
+CODE, LIST, DICT, EXTERN, MATCH_TABLE = range(5)
+SCALAR_TYPES = (type(None), bool, int, float, str)
+
+
+# Modules whose code decides the bytecode a program compiles to
+CODEGEN_MODULES = (lexer, parser, optimizer, resolver, compiler, peephole, bytecode, patterns)
+
+
+class UnserializableConstant(Exception):
+    pass
+
+
+@lru_cache(maxsize=None)
+def codegen_fingerprint():
+    """Hash of the CODEGEN_MODULES sources, so editing any of them invalidates every .flowc file"""
+    digest = hashlib.sha256()
+    for module in CODEGEN_MODULES:
+        try:
+            digest.update(Path(module.__file__).read_bytes())
+        except (OSError, TypeError):
+            # No source to read (e.g. a frozen install); the version number still applies
+            digest.update(module.__name__.encode())
+    return digest.hexdigest()
+
+
+def dump_constant(value):
+    """Marshal-friendly form of a code object constant; anything but a scalar becomes a tagged tuple"""
+    kind = type(value)
+    if kind in SCALAR_TYPES:
+        return value
+    if kind is CodeObject:
+        return (CODE, dump_code(value))
+    if kind is list:
+        return (LIST, [dump_constant(item) for item in value])
+    if kind is dict:
+        return (DICT, [(dump_constant(key), dump_constant(item)) for key, item in value.items()])
+    if kind is ExternFunctionDeclarationNode:
+        return (EXTERN, (value.name, value.params, value.return_type, value.lib_path))
+    if kind is MatchTable:
+        return (MATCH_TABLE, [dump_constant(pattern) for pattern in value.patterns])
+    raise UnserializableConstant(kind.__name__)
+
+
+def load_constant(value):
+    if type(value) is not tuple:
+        return value
+    tag, data = value
+    if tag == CODE:
+        return load_code(data)
+    if tag == LIST:
+        return [load_constant(item) for item in data]
+    if tag == DICT:
+        return {load_constant(key): load_constant(item) for key, item in data}
+    if tag == MATCH_TABLE:
+        return MatchTable([load_constant(pattern) for pattern in data])
+    return ExternFunctionDeclarationNode(*data)
+
+
+def dump_code(code_obj):
+    """Tuple form of a code object and, through its constants, the functions nested in it.
+
+    Only a memoized function's maxsize is kept, never its cached results;
+    threaded and register code are rebuilt by the VMs on first execution.
+    """
+    memo = None if code_obj.memo is None else (code_obj.memo.maxsize,)
+    return (code_obj.name, code_obj.code.tobytes(), [dump_constant(constant) for constant in code_obj.constants],
+            code_obj.params, code_obj.num_locals, code_obj.local_names, code_obj.type_params, memo)
+
+
+def load_code(data):
+    name, code, constants, params, num_locals, local_names, type_params, memo = data
+    words = array('i')
+    words.frombytes(code)
+    if memo is not None:
+        memo = MemoCache(name, memo[0])
+    return CodeObject(name, words, [load_constant(constant) for constant in constants], params=params,
+                      num_locals=num_locals, local_names=local_names, type_params=type_params, memo=memo)
+
+
+class BytecodeCache:
+    """Compiled programs stored as .flowc files, keyed on a hash of their source.
+
+    The key also covers the compiler version, a fingerprint of the compiler's
+    own source, the Python version (marshal's format may change between
+    them) and the compiler options, so a file is only ever loaded for
+    exactly the code it was compiled from, even if nobody bumped
+    COMPILER_VERSION.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+
+    def key(self, source, inline_threshold):
+        digest = hashlib.sha256()
+        digest.update(f"{COMPILER_VERSION}:{codegen_fingerprint()}:"
+                      f"{sys.version_info[0]}.{sys.version_info[1]}:{inline_threshold}\n".encode())
+        digest.update(source.encode())
+        return digest.hexdigest()
+
+    def path(self, key):
+        return self.cache_dir / f"{key}.flowc"
+
+    def load(self, source, inline_threshold):
+        """(code object, inlined calls) compiled earlier from this source, or None"""
+        key = self.key(source, inline_threshold)
+        try:
+            with open(self.path(key), 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        if not data.startswith(MAGIC):
+            return None
+        try:
+            stored_key, code, inlined_calls = marshal.loads(data[len(MAGIC):])
+        except (EOFError, ValueError, TypeError):
+            # Truncated or corrupted; the next store overwrites it
+            return None
+        if stored_key != key:
+            return None
+        return load_code(code), [tuple(call) for call in inlined_calls]
+
+    def store(self, source, inline_threshold, code_obj, inlined_calls):
+        """Write a compiled program; returns False when it can't be cached"""
+        key = self.key(source, inline_threshold)
+        try:
+            data = MAGIC + marshal.dumps((key, dump_code(code_obj), list(inlined_calls)))
+        except (UnserializableConstant, ValueError):
+            return False
+        path = self.path(key)
+        temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            # Readers see either the old file or the complete new one
+            os.replace(temp_path, path)
+        except OSError:
+            # A read-only install still runs, just without caching
+            return False
+        return True
+
+    def clear(self):
+        for path in self.cache_dir.glob("*.flowc"):
+            path.unlink()
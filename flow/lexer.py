@@ -1,4 +1,5 @@
 import re
+from array import array
 from enum import Enum
 
 class TokenType(Enum):
@@ -93,126 +94,222 @@ class Token:
     def __repr__(self):
         return f'Token({self.type.name}, {self.value!r}, line={self.line}, column={self.column})'
 
+# Words that are keywords, looked up once a whole name has been matched; any
+# other name is an identifier, or a type name when it starts with a capital
+KEYWORDS = {
+    'print': TokenType.PRINT,
+    'if': TokenType.IF,
+    'else': TokenType.ELSE,
+    'while': TokenType.WHILE,
+    'for': TokenType.FOR,
+    'in': TokenType.IN,
+    'let': TokenType.LET,
+    'mut': TokenType.MUT,
+    'func': TokenType.FUNC,
+    'fn': TokenType.FN,
+    'return': TokenType.RETURN,
+    'extern': TokenType.EXTERN,
+    'match': TokenType.MATCH,
+    'case': TokenType.CASE,
+    'default': TokenType.DEFAULT,
+    'alloc': TokenType.ALLOC,
+    'free': TokenType.FREE,
+    'ref': TokenType.REF,
+    'deref': TokenType.DEREF,
+    'macro': TokenType.MACRO,
+    'const': TokenType.CONST,
+    'eval': TokenType.EVAL,
+    'async': TokenType.ASYNC,
+    'await': TokenType.AWAIT,
+    'spawn': TokenType.SPAWN,
+    'channel': TokenType.CHANNEL,
+    'send': TokenType.SEND,
+    'receive': TokenType.RECEIVE,
+    'lambda': TokenType.LAMBDA,
+    'map': TokenType.MAP,
+    'filter': TokenType.FILTER,
+    'reduce': TokenType.REDUCE,
+    'true': TokenType.BOOLEAN,
+    'false': TokenType.BOOLEAN,
+    'and': TokenType.AND,
+    'or': TokenType.OR,
+    'not': TokenType.NOT,
+}
+
+# All token patterns as one alternation of named groups. Alternatives are
+# tried in order, so longer operators come before their prefixes.
+TOKEN_PATTERN = re.compile('|'.join(f'(?P<{name}>{pattern})' for name, pattern in [
+    ('WHITESPACE', r'[ \t]+'),
+    ('NEWLINE', r'\n'),
+    ('COMMENT', r'#.*'),
+    ('NAME', r'[a-zA-Z_][a-zA-Z0-9_]*'),
+    ('FLOAT', r'\d+\.\d+'),
+    ('INTEGER', r'\d+'),
+    ('STRING', r'"(?:\\.|[^\\"])*"'),
+    ('NOT_EQUALS', r'!='),
+    ('EQUAL_EQUAL', r'=='),
+    ('LESS_EQUAL', r'<='),
+    ('GREATER_EQUAL', r'>='),
+    ('EQUALS', r'='),
+    ('PIPELINE', r'\|>'),
+    ('BAR', r'\|'),
+    ('AMPERSAND', r'&'),
+    ('TILDE', r'~'),
+    ('PLUS', r'\+'),
+    ('MINUS', r'-'),
+    ('MULTIPLY', r'\*'),
+    ('DIVIDE', r'/'),
+    ('MODULO', r'%'),
+    ('XOR', r'\^'),
+    ('LPAREN', r'\('),
+    ('RPAREN', r'\)'),
+    ('LBRACKET', r'\['),
+    ('RBRACKET', r'\]'),
+    ('LBRACE', r'\{'),
+    ('RBRACE', r'\}'),
+    ('WALRUS', r':='),
+    ('COLON', r':'),
+    ('SEMICOLON', r';'),
+    ('COMMA', r','),
+    ('DOT', r'\.'),
+    ('LESS_THAN', r'<'),
+    ('GREATER_THAN', r'>'),
+    ('AT', r'@'),
+    ('MISMATCH', r'.'),
+]))
+
+# Token type of each group that maps straight to one; the symbols share
+# the token type of their keyword
+GROUP_TYPES = {name: TokenType[name] for name in TOKEN_PATTERN.groupindex
+               if name in TokenType.__members__}
+GROUP_TYPES.update(BAR=TokenType.OR, AMPERSAND=TokenType.AND, TILDE=TokenType.NOT)
+
+# Small integer codes of the token types, as stored in a TokenBuffer
+TOKEN_TYPES = tuple(TokenType)
+TYPE_CODES = {token_type: code for code, token_type in enumerate(TOKEN_TYPES)}
+
+class TokenBuffer:
+    """Tokens of a text kept in parallel arrays instead of one Token object each.
+
+    Only the type code, start offset and line of a token are stored, about
+    10 bytes a token. Values and columns are recovered from the text when
+    asked for, and iterating yields Token objects one at a time, so a Parser
+    can consume the buffer directly.
+    """
+    __slots__ = ['text', 'types', 'starts', 'lines']
+
+    def __init__(self, text, types, starts, lines):
+        self.text = text
+        self.types = types    # array('H') of TYPE_CODES
+        self.starts = starts  # array('I') of offsets into text
+        self.lines = lines    # array('I') of line numbers
+
+    def __len__(self):
+        return len(self.types)
+
+    def type(self, index):
+        return TOKEN_TYPES[self.types[index]]
+
+    def value(self, index):
+        """Source text of a token, without the quotes of a string; None for EOF"""
+        token_type = TOKEN_TYPES[self.types[index]]
+        if token_type is TokenType.EOF:
+            return None
+        value = TOKEN_PATTERN.match(self.text, self.starts[index]).group()
+        return value[1:-1] if token_type is TokenType.STRING else value
+
+    def column(self, index):
+        start = self.starts[index]
+        return start - self.text.rfind('\n', 0, start)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.types)
+        return Token(self.type(index), self.value(index), self.lines[index], self.column(index))
+
+    def __iter__(self):
+        for index in range(len(self.types)):
+            yield self[index]
+
+    def nbytes(self):
+        """Bytes taken by the arrays, not counting the text"""
+        return sum(column.itemsize * len(column) for column in (self.types, self.starts, self.lines))
+
 class Lexer:
     def __init__(self, text):
         self.text = text
-        self.pos = 0
-        self.line = 1
-        self.column = 1
         self.tokens = []
-        
-        # Pre-compile regex patterns for better performance
-        self._compile_patterns()
-    
-    def _compile_patterns(self):
-        """Pre-compile all regex patterns for better performance"""
-        # Order matters! More specific patterns should come first
-        self.patterns = [
-            (TokenType.PRINT, re.compile(r'print')),
-            (TokenType.IF, re.compile(r'if')),
-            (TokenType.ELSE, re.compile(r'else')),
-            (TokenType.WHILE, re.compile(r'while')),
-            (TokenType.FOR, re.compile(r'for')),
-            (TokenType.IN, re.compile(r'in')),
-            (TokenType.LET, re.compile(r'let')),
-            (TokenType.MUT, re.compile(r'mut')),
-            (TokenType.FUNC, re.compile(r'func')),
-            (TokenType.FN, re.compile(r'fn')),
-            (TokenType.RETURN, re.compile(r'return')),
-            (TokenType.EXTERN, re.compile(r'extern')),
-            (TokenType.MATCH, re.compile(r'match')),
-            (TokenType.CASE, re.compile(r'case')),
-            (TokenType.DEFAULT, re.compile(r'default')),
-            (TokenType.ALLOC, re.compile(r'alloc')),
-            (TokenType.FREE, re.compile(r'free')),
-            (TokenType.REF, re.compile(r'ref')),
-            (TokenType.DEREF, re.compile(r'deref')),
-            (TokenType.MACRO, re.compile(r'macro')),
-            (TokenType.CONST, re.compile(r'const')),
-            (TokenType.EVAL, re.compile(r'eval')),
-            (TokenType.ASYNC, re.compile(r'async')),
-            (TokenType.AWAIT, re.compile(r'await')),
-            (TokenType.SPAWN, re.compile(r'spawn')),
-            (TokenType.CHANNEL, re.compile(r'channel')),
-            (TokenType.SEND, re.compile(r'send')),
-            (TokenType.RECEIVE, re.compile(r'receive')),
-            (TokenType.LAMBDA, re.compile(r'lambda')),
-            (TokenType.MAP, re.compile(r'map')),
-            (TokenType.FILTER, re.compile(r'filter')),
-            (TokenType.REDUCE, re.compile(r'reduce')),
-            (TokenType.BOOLEAN, re.compile(r'true|false')),
-            (TokenType.FLOAT, re.compile(r'\d+\.\d+')),
-            (TokenType.INTEGER, re.compile(r'\d+')),
-            (TokenType.STRING, re.compile(r'"(?:\\.|[^\\"])*"')),
-            (TokenType.NOT_EQUALS, re.compile(r'!=')),
-            (TokenType.EQUAL_EQUAL, re.compile(r'==')),
-            (TokenType.LESS_EQUAL, re.compile(r'<=')),
-            (TokenType.GREATER_EQUAL, re.compile(r'>=')),
-            (TokenType.EQUALS, re.compile(r'=')),
-            (TokenType.PIPELINE, re.compile(r'\|>')),
-            (TokenType.PLUS, re.compile(r'\+')),
-            (TokenType.MINUS, re.compile(r'-')),
-            (TokenType.MULTIPLY, re.compile(r'\*')),
-            (TokenType.DIVIDE, re.compile(r'/')),
-            (TokenType.MODULO, re.compile(r'%')),
-            (TokenType.AND, re.compile(r'and')),
-            (TokenType.OR, re.compile(r'or')),
-            (TokenType.XOR, re.compile(r'\^')),
-            (TokenType.NOT, re.compile(r'not')),
-            (TokenType.LPAREN, re.compile(r'\(')),
-            (TokenType.RPAREN, re.compile(r'\)')),
-            (TokenType.LBRACKET, re.compile(r'\[')),
-            (TokenType.RBRACKET, re.compile(r'\]')),
-            (TokenType.LBRACE, re.compile(r'\{')),
-            (TokenType.RBRACE, re.compile(r'\}')),
-            (TokenType.WALRUS, re.compile(r':=')),
-            (TokenType.COLON, re.compile(r':')),
-            (TokenType.SEMICOLON, re.compile(r';')),
-            (TokenType.COMMA, re.compile(r',')),
-            (TokenType.DOT, re.compile(r'\.')),
-            (TokenType.LESS_THAN, re.compile(r'<')),
-            (TokenType.GREATER_THAN, re.compile(r'>')),
-            (TokenType.AT, re.compile(r'@')),
-            (TokenType.TYPE_NAME, re.compile(r'[A-Z][a-zA-Z0-9_]*')),
-            (TokenType.IDENTIFIER, re.compile(r'[a-zA-Z_][a-zA-Z0-9_]*')),
-            (TokenType.NEWLINE, re.compile(r'\n')),
-            (TokenType.WHITESPACE, re.compile(r'[ \t]+')),
-            (TokenType.COMMENT, re.compile(r'#.*')),
-        ]
+        self.line = 1
+        self.line_start = 0  # Offset where the current line starts
 
     def tokenize(self):
-        """Optimized tokenization with pre-compiled patterns"""
-        text_len = len(self.text)
-        
-        while self.pos < text_len:
-            matched = False
-            
-            for token_type, pattern in self.patterns:
-                match = pattern.match(self.text, self.pos)
-                if match:
-                    value = match.group(0)
-                    value_len = len(value)
-                    
-                    # Skip whitespace, comments, and newlines
-                    if token_type not in [TokenType.WHITESPACE, TokenType.COMMENT, TokenType.NEWLINE]:
-                        if token_type == TokenType.STRING:
-                            value = value[1:-1]  # Remove quotes
-                        self.tokens.append(Token(token_type, value, self.line, self.column))
-                    
-                    self.pos += value_len
-                    
-                    # Update line and column tracking
-                    if token_type == TokenType.NEWLINE:
-                        self.line += 1
-                        self.column = 1
-                    else:
-                        self.column += value_len
-                    
-                    matched = True
-                    break
-            
-            if not matched:
-                raise Exception(f"Unexpected character: {self.text[self.pos]} at line {self.line}, column {self.column}")
-
-        self.tokens.append(Token(TokenType.EOF, None, self.line, self.column))
-        return self.tokens
\ No newline at end of file
+        """All of the text's tokens as a list"""
+        self.tokens.extend(self.generate_tokens())
+        return self.tokens
+
+    def generate_tokens(self):
+        """Yield the text's tokens one at a time, ending with EOF"""
+        string = TokenType.STRING
+        for token_type, match, line, line_start in self._scan():
+            value = match.group()
+            if token_type is string:
+                value = value[1:-1]  # Remove quotes
+            yield Token(token_type, value, line, match.start() - line_start + 1)
+        yield Token(TokenType.EOF, None, self.line, len(self.text) - self.line_start + 1)
+
+    def token_buffer(self):
+        """All of the text's tokens, ending with EOF, stored column-wise in a TokenBuffer"""
+        types = array('H')
+        starts = array('I')
+        lines = array('I')
+        codes = TYPE_CODES
+        add_type, add_start, add_line = types.append, starts.append, lines.append
+        for token_type, match, line, line_start in self._scan():
+            add_type(codes[token_type])
+            add_start(match.start())
+            add_line(line)
+        types.append(codes[TokenType.EOF])
+        starts.append(len(self.text))
+        lines.append(self.line)
+        return TokenBuffer(self.text, types, starts, lines)
+
+    def _scan(self):
+        """(type, match, line, offset of the line) of each token, from a single pass of TOKEN_PATTERN.
+
+        Leaves self.line and self.line_start on the last line, where EOF goes.
+        """
+        keywords = KEYWORDS
+        group_types = GROUP_TYPES
+        identifier = TokenType.IDENTIFIER
+        type_name = TokenType.TYPE_NAME
+        line = 1
+        line_start = 0
+
+        for match in TOKEN_PATTERN.finditer(self.text):
+            kind = match.lastgroup
+            if kind == 'WHITESPACE' or kind == 'COMMENT':
+                continue
+            if kind == 'NEWLINE':
+                line += 1
+                line_start = match.end()
+                continue
+            if kind == 'NAME':
+                value = match.group()
+                token_type = keywords.get(value)
+                if token_type is None:
+                    token_type = type_name if 'A' <= value[0] <= 'Z' else identifier
+            elif kind == 'MISMATCH':
+                column = match.start() - line_start + 1
+                raise Exception(f"Unexpected character: {match.group()} at line {line}, column {column}")
+            else:
+                token_type = group_types[kind]
+            yield token_type, match, line, line_start
+            if kind == 'STRING':
+                # Strings may span lines; later tokens count from the last newline inside
+                newlines = match.group().count('\n')
+                if newlines:
+                    line += newlines
+                    line_start = match.start() + match.group().rindex('\n') + 1
+
+        self.line = line
+        self.line_start = line_start
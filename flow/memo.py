@@ -0,0 +1,109 @@
+from collections import OrderedDict
+
+from .profiler import global_profiler
+from .resolver import FUNCTION_NODES
+
+# Number of results a @memo function keeps when no maxsize is given
+DEFAULT_MEMO_MAXSIZE = 128
+
+# Returned by MemoCache.get when the arguments aren't cached
+MISSING = object()
+
+
+class UnhashableArgument(Exception):
+    pass
+
+
+def freeze(value):
+    """Hashable stand-in for a Flow value.
+
+    Lists and dictionaries are turned into tuples, tagged with their type so
+    that [1, 2] and (1, 2) stay different keys; so are 1, 1.0 and true.
+    Raises UnhashableArgument for anything else that can't be hashed.
+    """
+    kind = type(value)
+    if kind is list:
+        return (list, tuple([freeze(item) for item in value]))
+    if kind is dict:
+        return (dict, frozenset([(freeze(key), freeze(item)) for key, item in value.items()]))
+    if kind is tuple:
+        return (tuple, tuple([freeze(item) for item in value]))
+    try:
+        hash(value)
+    except TypeError:
+        raise UnhashableArgument(kind.__name__)
+    return (kind, value)
+
+
+class MemoCache:
+    """Least-recently-used cache of a function's results, keyed on its arguments"""
+    __slots__ = ['name', 'maxsize', 'hits', 'misses', 'bypasses', 'results']
+
+    def __init__(self, name, maxsize=DEFAULT_MEMO_MAXSIZE):
+        self.name = name
+        self.maxsize = maxsize  # None keeps every result
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0       # Calls whose arguments couldn't be used as a key
+        self.results = OrderedDict()
+        global_profiler.register_memo_cache(self)
+
+    def call(self, run, args):
+        """Result of run(args), from the cache when these arguments were seen before"""
+        try:
+            key = tuple([freeze(arg) for arg in args])
+        except UnhashableArgument:
+            self.bypasses += 1
+            return run(args)
+        results = self.results
+        result = results.get(key, MISSING)
+        if result is not MISSING:
+            self.hits += 1
+            results.move_to_end(key)
+            return result
+        self.misses += 1
+        result = run(args)
+        results[key] = result
+        if self.maxsize is not None and len(results) > self.maxsize:
+            results.popitem(last=False)
+        return result
+
+    def clear(self):
+        self.results.clear()
+
+    def fresh(self):
+        """An empty cache of the same function and size, e.g. for another closure of it"""
+        return MemoCache(self.name, self.maxsize)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'bypasses': self.bypasses,
+                'size': len(self.results), 'maxsize': self.maxsize}
+
+    def __repr__(self):
+        return f"<memo cache {self.name}: {self.hits} hits, {self.misses} misses>"
+
+
+def memo_maxsize(node):
+    """Cache size requested by a @memo annotation on node.
+
+    Accepts @memo, @memo(64) and @memo(maxsize=64); a maxsize of 0 or less
+    means unbounded.
+    """
+    if not isinstance(node.node, FUNCTION_NODES):
+        raise TypeError("@memo can only annotate a function declaration")
+    args, kwargs = node.arguments.get('memo', ((), {}))
+    unknown = set(kwargs) - {'maxsize'}
+    if unknown or len(args) > 1 or (args and kwargs):
+        raise TypeError("@memo takes a single maxsize argument")
+    maxsize = kwargs.get('maxsize', args[0] if args else DEFAULT_MEMO_MAXSIZE)
+    if type(maxsize) is not int:
+        raise TypeError(f"@memo maxsize must be an integer, got {maxsize!r}")
+    return maxsize if maxsize > 0 else None
+
+
+def memo_cache(node):
+    """A fresh MemoCache for an AnnotatedNode carrying @memo, or None"""
+    if 'memo' not in node.annotations:
+        return None
+    maxsize = memo_maxsize(node)
+    return MemoCache(node.node.name, maxsize)
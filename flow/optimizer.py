@@ -0,0 +1,518 @@
+import copy
+import operator
+from collections import Counter
+
+from .lexer import TokenType
+from .parser import (ASTNode, BinOpNode, UnaryOpNode, IntegerNode, FloatNode, StringNode, BooleanNode,
+                     VariableAccessNode, PipelineNode, ExternFunctionDeclarationNode, IfNode, WhileNode,
+                     ForNode, MatchNode, BlockNode, ReturnNode, VariableDeclarationNode, AssignmentNode,
+                     BuiltinFunctionCallNode, IndexAccessNode, FunctionCallNode, IndexAssignmentNode,
+                     MapFunctionNode, FilterFunctionNode, ReduceFunctionNode, SendStatementNode,
+                     ReceiveStatementNode, SpawnExpressionNode, AwaitExpressionNode,
+                     LambdaExpressionNode, PrintNode)
+from .resolver import FUNCTION_NODES, BINDING_ATTRIBUTES, child_nodes
+from .builtins import PURE_BUILTINS, READ_ONLY_BUILTINS
+
+LITERAL_NODES = (IntegerNode, FloatNode, StringNode, BooleanNode)
+
+# Binary operators folded at compile time, with the semantics of VM.visit_BinOpNode.
+# On two booleans '&' and '|' give the same result as the VM's 'and'/'or'.
+FOLDABLE_BINARY_OPS = {
+    TokenType.PLUS: operator.add,
+    TokenType.MINUS: operator.sub,
+    TokenType.MULTIPLY: operator.mul,
+    TokenType.DIVIDE: operator.truediv,
+    TokenType.MODULO: operator.mod,
+    TokenType.LESS_THAN: operator.lt,
+    TokenType.GREATER_THAN: operator.gt,
+    TokenType.EQUAL_EQUAL: operator.eq,
+    TokenType.NOT_EQUALS: operator.ne,
+    TokenType.LESS_EQUAL: operator.le,
+    TokenType.GREATER_EQUAL: operator.ge,
+    TokenType.AND: operator.and_,
+    TokenType.OR: operator.or_,
+    TokenType.XOR: operator.xor,
+}
+
+FOLDABLE_UNARY_OPS = {
+    TokenType.MINUS: operator.neg,
+    TokenType.NOT: operator.not_,
+}
+
+# Longer strings and larger integers are left to be built at run time, so the tree stays small
+MAX_FOLDED_STRING = 4096
+MAX_FOLDED_INT_BITS = 4096
+
+
+def literal_node(value):
+    """Literal node holding value, or None if value has no literal form"""
+    if isinstance(value, bool):
+        return BooleanNode("true" if value else "false")
+    if isinstance(value, int) and value.bit_length() <= MAX_FOLDED_INT_BITS:
+        return IntegerNode(value)
+    if isinstance(value, float):
+        return FloatNode(value)
+    if isinstance(value, str) and len(value) <= MAX_FOLDED_STRING:
+        return StringNode(value)
+    return None
+
+
+def too_large_to_fold(op, left, right):
+    """Whether op on two literals may give a result over the folding limits.
+
+    Decided from the operand sizes, so an oversized value is never built.
+    """
+    if isinstance(left, str) or isinstance(right, str):
+        if op == TokenType.PLUS and isinstance(left, str) and isinstance(right, str):
+            return len(left) + len(right) > MAX_FOLDED_STRING
+        if op == TokenType.MULTIPLY:
+            string, count = (left, right) if isinstance(left, str) else (right, left)
+            return isinstance(count, int) and len(string) * count > MAX_FOLDED_STRING
+        # Formatting with '%' can pad to any width
+        return op == TokenType.MODULO
+    if isinstance(left, int) and isinstance(right, int):
+        if op == TokenType.MULTIPLY:
+            return left.bit_length() + right.bit_length() > MAX_FOLDED_INT_BITS
+        if op in (TokenType.PLUS, TokenType.MINUS):
+            return max(left.bit_length(), right.bit_length()) + 1 > MAX_FOLDED_INT_BITS
+    return False
+
+
+def binding_counts(node):
+    """How many times each name is bound anywhere in the tree"""
+    counts = Counter()
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, FUNCTION_NODES):
+            counts[node.name] += 1
+            counts.update(node.params)
+        elif isinstance(node, ExternFunctionDeclarationNode):
+            counts[node.name] += 1
+        else:
+            attribute = BINDING_ATTRIBUTES.get(type(node))
+            if attribute is not None:
+                counts[getattr(node, attribute)] += 1
+        pending.extend(child_nodes(node))
+    return counts
+
+
+class ConstantFolder:
+    """Folds literal arithmetic and propagates constant 'let' bindings.
+
+    A ``let`` whose value folds to a literal, and whose name is bound
+    nowhere else in the program, is substituted into the statements that
+    follow it in the same block. A top-level one is also substituted into
+    functions declared after it. The declaration itself is kept.
+    """
+
+    def __init__(self):
+        self._method_cache = {}  # Cache for visitor methods
+        self._bindings = Counter()
+        # Names known to hold a literal value at this point, and the value
+        self.constants = {}
+
+    def fold(self, node):
+        self._bindings = binding_counts(node)
+        return self.visit(node)
+
+    def visit(self, node):
+        # Use cached method lookup for better performance
+        method_name = f'visit_{type(node).__name__}'
+        if method_name in self._method_cache:
+            method = self._method_cache[method_name]
+        else:
+            method = getattr(self, method_name, self.generic_visit)
+            self._method_cache[method_name] = method
+        return method(node)
+
+    def generic_visit(self, node):
+        for attribute, value in vars(node).items():
+            if isinstance(value, ASTNode):
+                setattr(node, attribute, self.visit(value))
+            elif isinstance(value, list):
+                setattr(node, attribute, self.visit_list(value))
+        return node
+
+    def visit_list(self, nodes):
+        # Bindings made in a block are only known until the block ends
+        saved = self.constants
+        self.constants = dict(saved)
+        try:
+            return [self.visit(item) if isinstance(item, ASTNode) else item for item in nodes]
+        finally:
+            self.constants = saved
+
+    def visit_BinOpNode(self, node):
+        node.left = self.visit(node.left)
+        node.right = self.visit(node.right)
+        function = FOLDABLE_BINARY_OPS.get(node.op)
+        if function is None or not isinstance(node.left, LITERAL_NODES) or not isinstance(node.right, LITERAL_NODES):
+            return node
+        if too_large_to_fold(node.op, node.left.value, node.right.value):
+            return node
+        try:
+            value = function(node.left.value, node.right.value)
+        except Exception:
+            # e.g. division by zero: leave the error to run time
+            return node
+        return literal_node(value) or node
+
+    def visit_UnaryOpNode(self, node):
+        node.operand = self.visit(node.operand)
+        function = FOLDABLE_UNARY_OPS.get(node.op)
+        if function is None or not isinstance(node.operand, LITERAL_NODES):
+            return node
+        try:
+            value = function(node.operand.value)
+        except Exception:
+            return node
+        return literal_node(value) or node
+
+    def visit_VariableAccessNode(self, node):
+        if node.identifier in self.constants:
+            # A fresh node per use, so later passes can annotate each one
+            return literal_node(self.constants[node.identifier]) or node
+        return node
+
+    def visit_ImmutableDeclarationNode(self, node):
+        node.value = self.visit(node.value)
+        if isinstance(node.value, LITERAL_NODES) and self._bindings[node.identifier] == 1:
+            self.constants[node.identifier] = node.value.value
+        return node
+
+    def visit_PipelineNode(self, node):
+        node.left = self.visit(node.left)
+        # 'x |> f' names the function with a bare variable; keep it as a name
+        if not isinstance(node.right, VariableAccessNode):
+            node.right = self.visit(node.right)
+        return node
+
+    def visit_function(self, node):
+        # A function sees the constants of the scopes around it; each is bound only once,
+        # so none of them can be shadowed inside
+        saved = self.constants
+        self.constants = dict(saved)
+        try:
+            return self.generic_visit(node)
+        finally:
+            self.constants = saved
+
+    def visit_FunctionDeclarationNode(self, node):
+        return self.visit_function(node)
+
+    def visit_AsyncFunctionDeclarationNode(self, node):
+        return self.visit_function(node)
+
+    def visit_GenericFunctionDeclarationNode(self, node):
+        return self.visit_function(node)
+
+
+def fold_constants(node):
+    """Run the ConstantFolder over a parsed program and return the folded tree"""
+    return ConstantFolder().fold(node)
+
+
+# Nodes that may modify a list or call code that does
+MUTATING_NODES = (FunctionCallNode, IndexAssignmentNode, MapFunctionNode, FilterFunctionNode,
+                  ReduceFunctionNode, PipelineNode, SendStatementNode, ReceiveStatementNode,
+                  SpawnExpressionNode, AwaitExpressionNode)
+
+# Nodes whose evaluation may be observed, besides calls to builtins that aren't pure
+EFFECT_NODES = MUTATING_NODES + (PrintNode, LambdaExpressionNode)
+
+# Nodes that may run a Flow function's body
+CALLING_NODES = (FunctionCallNode, MapFunctionNode, FilterFunctionNode, ReduceFunctionNode, PipelineNode)
+
+# Invariant expressions worth a temporary; a bare variable or literal is not
+HOISTABLE_NODES = (BinOpNode, UnaryOpNode, BuiltinFunctionCallNode, IndexAccessNode)
+
+# Statements with conditionally executed blocks, and the parts of them evaluated every time
+ALWAYS_EVALUATED = {
+    BlockNode: (),
+    IfNode: ('condition',),
+    WhileNode: ('condition',),
+    ForNode: ('iterable',),
+    MatchNode: ('expression',),
+}
+
+
+def walk(node):
+    """Yield node and every AST node below it"""
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        yield node
+        pending.extend(child_nodes(node))
+
+
+def count_nodes(node):
+    """Number of AST nodes in the tree below and including node"""
+    return sum(1 for _ in walk(node))
+
+
+def names_assigned_in_functions(node):
+    """Names some function body assigns with plain '=', i.e. a global or an enclosing function's local"""
+    names = set()
+    for function in walk(node):
+        if isinstance(function, FUNCTION_NODES):
+            names.update(child.identifier for child in walk(function.body) if isinstance(child, AssignmentNode))
+    return names
+
+
+def has_side_effects(node):
+    """Whether evaluating node, outside nested functions, may do something observable"""
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, EFFECT_NODES):
+            return True
+        if isinstance(node, BuiltinFunctionCallNode) and node.name not in PURE_BUILTINS \
+                and node.name not in READ_ONLY_BUILTINS:
+            return True
+        if not isinstance(node, FUNCTION_NODES):
+            pending.extend(child_nodes(node))
+    return False
+
+
+def evaluated_parts(node, attributes=None):
+    """Nodes directly below node, only from the given attributes unless they are None"""
+    for attribute, value in vars(node).items():
+        if attributes is not None and attribute not in attributes:
+            continue
+        if isinstance(value, ASTNode):
+            yield value
+        elif isinstance(value, list):
+            yield from (item for item in value if isinstance(item, ASTNode))
+
+
+def contains_node(node, types):
+    """Whether node or anything below it, outside nested functions, is one of types"""
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, types):
+            return True
+        if not isinstance(node, FUNCTION_NODES):
+            pending.extend(child_nodes(node))
+    return False
+
+
+class LoopAnalysis:
+    """Names a loop rebinds and whether it can modify a list.
+
+    A call may run a function that assigns a global or an enclosing
+    function's local, so in a loop with calls every name in
+    ``assigned_in_functions`` counts as rebound.
+    """
+
+    def __init__(self, loop, assigned_in_functions=()):
+        self.bound = set()
+        self.mutates = False
+        if isinstance(loop, ForNode):
+            self.bound.add(loop.target)
+        pending = [loop]
+        while pending:
+            node = pending.pop()
+            if isinstance(node, FUNCTION_NODES):
+                # The declaration binds the name; the body only runs when called
+                self.bound.add(node.name)
+                continue
+            attribute = BINDING_ATTRIBUTES.get(type(node))
+            if attribute is not None:
+                self.bound.add(getattr(node, attribute))
+            if isinstance(node, CALLING_NODES):
+                self.bound.update(assigned_in_functions)
+            if isinstance(node, MUTATING_NODES):
+                self.mutates = True
+            elif isinstance(node, BuiltinFunctionCallNode) and node.name not in PURE_BUILTINS \
+                    and node.name not in READ_ONLY_BUILTINS:
+                self.mutates = True
+            pending.extend(child_nodes(node))
+
+    def is_pure(self, node):
+        """Whether evaluating node has no side effects"""
+        if isinstance(node, LITERAL_NODES) or isinstance(node, VariableAccessNode):
+            return True
+        if isinstance(node, BinOpNode):
+            return self.is_pure(node.left) and self.is_pure(node.right)
+        if isinstance(node, UnaryOpNode):
+            return self.is_pure(node.operand)
+        if isinstance(node, BuiltinFunctionCallNode):
+            return ((node.name in PURE_BUILTINS or node.name in READ_ONLY_BUILTINS)
+                    and all(self.is_pure(arg) for arg in node.args))
+        if isinstance(node, IndexAccessNode):
+            return self.is_pure(node.obj) and self.is_pure(node.index)
+        return False
+
+    def is_invariant(self, node):
+        """Whether node is pure and gives the same value on every iteration"""
+        if isinstance(node, LITERAL_NODES):
+            return True
+        if isinstance(node, VariableAccessNode):
+            # A variable may hold a list the loop modifies, which changes e.g. 'xs + ys' or 'a != b'
+            return not self.mutates and node.identifier not in self.bound
+        if isinstance(node, BinOpNode):
+            return self.is_invariant(node.left) and self.is_invariant(node.right)
+        if isinstance(node, UnaryOpNode):
+            return self.is_invariant(node.operand)
+        if isinstance(node, BuiltinFunctionCallNode):
+            if node.name in READ_ONLY_BUILTINS:
+                # Reads a list or string, which must not change under it
+                if self.mutates:
+                    return False
+            elif node.name not in PURE_BUILTINS:
+                return False
+            return all(self.is_invariant(arg) for arg in node.args)
+        if isinstance(node, IndexAccessNode):
+            return not self.mutates and self.is_invariant(node.obj) and self.is_invariant(node.index)
+        return False
+
+
+class LoopInvariantHoister:
+    """Moves pure, loop-invariant expressions out of while and for loops.
+
+    Invariants of a while condition are computed once before the loop,
+    since the condition always runs at least once. Invariants from the
+    body are only taken from parts that run on every iteration: statements
+    up to the first one that may return, and not the inside of their
+    nested blocks. An invariant can still raise (e.g. division by zero),
+    so it is only taken from code that runs before anything observable,
+    like a print or a call. Body invariants are computed behind a guard so
+    they only run if the loop runs: the (pure) condition for while, a
+    non-empty list for for. Each value goes into a temporary, named with a
+    '$' so it can't clash with a Flow identifier.
+    """
+
+    def __init__(self):
+        self._method_cache = {}  # Cache for visitor methods
+        self._temporaries = 0
+        self._assigned_in_functions = set()
+
+    def hoist(self, node):
+        self._assigned_in_functions = names_assigned_in_functions(node)
+        return self.visit(node)
+
+    def visit(self, node):
+        # Use cached method lookup for better performance
+        method_name = f'visit_{type(node).__name__}'
+        if method_name in self._method_cache:
+            method = self._method_cache[method_name]
+        else:
+            method = getattr(self, method_name, self.generic_visit)
+            self._method_cache[method_name] = method
+        return method(node)
+
+    def generic_visit(self, node):
+        for attribute, value in vars(node).items():
+            if isinstance(value, ASTNode):
+                value = self.visit(value)
+                # A loop that gained hoisted statements is a single statement here
+                setattr(node, attribute, BlockNode(value) if isinstance(value, list) else value)
+            elif isinstance(value, list):
+                setattr(node, attribute, self.visit_list(value))
+        return node
+
+    def visit_list(self, nodes):
+        result = []
+        for item in nodes:
+            item = self.visit(item) if isinstance(item, ASTNode) else item
+            if isinstance(item, list):
+                result.extend(item)
+            else:
+                result.append(item)
+        return result
+
+    def new_temporary(self):
+        name = f"$loop{self._temporaries}"
+        self._temporaries += 1
+        return name
+
+    def extract(self, node, analysis, hoisted):
+        """Replace the largest invariant subexpressions of node with temporaries"""
+        if isinstance(node, HOISTABLE_NODES) and analysis.is_invariant(node):
+            name = self.new_temporary()
+            hoisted.append(VariableDeclarationNode(name, node))
+            return VariableAccessNode(name)
+        self.extract_children(node, analysis, hoisted)
+        return node
+
+    def extract_children(self, node, analysis, hoisted, attributes=None):
+        # Lambda bodies and nested functions don't run where they appear
+        if isinstance(node, (LambdaExpressionNode,) + FUNCTION_NODES):
+            return
+        for attribute, value in list(vars(node).items()):
+            if attributes is not None and attribute not in attributes:
+                continue
+            if isinstance(value, ASTNode):
+                setattr(node, attribute, self.extract(value, analysis, hoisted))
+            elif isinstance(value, list):
+                setattr(node, attribute, [self.extract(item, analysis, hoisted) if isinstance(item, ASTNode)
+                                          else item for item in value])
+
+    def extract_from_body(self, block, analysis):
+        """Hoist invariants from the parts of a loop body that run on every iteration"""
+        hoisted = []
+        statements = block.statements if isinstance(block, BlockNode) else [block]
+        for statement in statements:
+            if isinstance(statement, FUNCTION_NODES):
+                # Declaring a function runs nothing
+                continue
+            attributes = ALWAYS_EVALUATED.get(type(statement))
+            # A hoisted value is computed first, so it may not skip an effect before it if it raises
+            if any(has_side_effects(part) for part in evaluated_parts(statement, attributes)):
+                break
+            self.extract_children(statement, analysis, hoisted, attributes)
+            # Later statements may not run once this one can return, nor skip its effects
+            if contains_node(statement, ReturnNode) or has_side_effects(statement):
+                break
+        return hoisted
+
+    def visit_WhileNode(self, node):
+        # Inner loops first, so their hoisted code can move further out
+        self.generic_visit(node)
+        analysis = LoopAnalysis(node, self._assigned_in_functions)
+
+        hoisted = []
+        if not has_side_effects(node.condition):
+            node.condition = self.extract(node.condition, analysis, hoisted)
+        # Running the condition an extra time as the guard is only safe when it is pure
+        if not analysis.is_pure(node.condition):
+            return hoisted + [node] if hoisted else node
+        body_hoisted = self.extract_from_body(node.block, analysis)
+        if not body_hoisted:
+            return hoisted + [node] if hoisted else node
+        guard = IfNode(copy.deepcopy(node.condition), BlockNode(body_hoisted + [node]))
+        return hoisted + [guard]
+
+    def visit_ForNode(self, node):
+        self.generic_visit(node)
+        analysis = LoopAnalysis(node, self._assigned_in_functions)
+
+        # Anything but a list runs the loop as written, so it fails or iterates as before
+        block = copy.deepcopy(node.block)
+        body_hoisted = self.extract_from_body(node.block, analysis)
+        if not body_hoisted:
+            return node
+        # Evaluate the iterable once, then enter the loop only if it is a list with items
+        iterable = self.new_temporary()
+        is_list = BinOpNode(BuiltinFunctionCallNode('type', [VariableAccessNode(iterable)]),
+                            TokenType.EQUAL_EQUAL, StringNode('list'))
+        length = BuiltinFunctionCallNode('len', [VariableAccessNode(iterable)])
+        has_items = IfNode(BinOpNode(length, TokenType.GREATER_THAN, IntegerNode(0)),
+                           BlockNode(body_hoisted + [node]))
+        unhoisted = ForNode(node.target, VariableAccessNode(iterable), block)
+        guard = IfNode(is_list, BlockNode([has_items]), BlockNode([unhoisted]))
+        statements = [VariableDeclarationNode(iterable, node.iterable), guard]
+        node.iterable = VariableAccessNode(iterable)
+        return statements
+
+
+def hoist_loop_invariants(node):
+    """Run the LoopInvariantHoister over a parsed program and return the new tree"""
+    return LoopInvariantHoister().hoist(node)
+
+
+def optimize(node):
+    """All AST optimizations, in the order they are meant to run"""
+    return hoist_loop_invariants(fold_constants(node))
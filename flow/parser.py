@@ -3,7 +3,10 @@ from .builtins import BUILTINS
 
 # --- AST Nodes ---
 class ASTNode:
-    pass
+    # Local variable slot assigned by resolver.Resolver; None means a global name
+    slot = None
+    # Functions out from the current one whose locals hold the slot, 0 for its own
+    depth = 0
 
 
 class ProgramNode(ASTNode):
@@ -66,6 +69,8 @@ class GenericTypeNode(ASTNode):
 
 
 class GenericFunctionDeclarationNode(ASTNode):
+    memo = None  # MemoCache set by a @memo annotation
+
     def __init__(self, name, type_params, params, body):
         self.name = name
         self.type_params = type_params  # List of type parameter names
@@ -73,6 +78,8 @@ class GenericFunctionDeclarationNode(ASTNode):
         self.body = body
 
 class AsyncFunctionDeclarationNode(ASTNode):
+    memo = None  # MemoCache set by a @memo annotation
+
     def __init__(self, name, params, body):
         self.name = name
         self.params = params
@@ -148,6 +155,9 @@ class ForNode(ASTNode):
         self.block = block
 
 class MatchNode(ASTNode):
+    # patterns.MatchTable of the cases, built by the tree walker on first execution
+    table = None
+
     def __init__(self, expression, cases, default_case=None):
         self.expression = expression
         self.cases = cases
@@ -191,6 +201,8 @@ class AssignmentExpressionNode(ASTNode):
         self.value = value
 
 class FunctionDeclarationNode(ASTNode):
+    memo = None  # MemoCache set by a @memo annotation
+
     def __init__(self, name, params, body):
         self.name = name
         self.params = params
@@ -217,6 +229,9 @@ class ExternFunctionDeclarationNode(ASTNode):
         self.lib_path = lib_path
 
 class BuiltinFunctionCallNode(ASTNode):
+    # Resolved builtin, cached by the tree walker on first call
+    function = None
+
     def __init__(self, name, args):
         self.name = name
         self.args = args
@@ -315,22 +330,67 @@ class CompileTimeEvalNode(ASTNode):
 
 # Attribute/annotation nodes
 class AnnotatedNode(ASTNode):
-    def __init__(self, annotations, node):
+    def __init__(self, annotations, node, arguments=None):
         self.annotations = annotations  # List of annotation strings
         self.node = node
+        # Annotation name -> (positional values, keyword values) for e.g. @memo(maxsize=64)
+        self.arguments = arguments if arguments is not None else {}
 
 # --- Parser ---
+# How tightly each binary operator binds; a higher number binds tighter. As in
+# C, the bitwise operators (which 'and' and 'or' share) are looser than the
+# comparisons, so a < b and c < d needs no parentheses. Prefix '-' binds
+# tighter than all of them; 'not' takes a whole comparison as its operand.
+BINARY_PRECEDENCE = {
+    TokenType.PIPELINE: 1,
+    TokenType.OR: 2,
+    TokenType.XOR: 3,
+    TokenType.AND: 4,
+    TokenType.EQUAL_EQUAL: 5,
+    TokenType.NOT_EQUALS: 5,
+    TokenType.LESS_THAN: 5,
+    TokenType.GREATER_THAN: 5,
+    TokenType.LESS_EQUAL: 5,
+    TokenType.GREATER_EQUAL: 5,
+    TokenType.PLUS: 6,
+    TokenType.MINUS: 6,
+    TokenType.MULTIPLY: 7,
+    TokenType.DIVIDE: 7,
+    TokenType.MODULO: 7,
+}
+
+# Marks Parser._next_token as not yet read from the token stream
+_UNREAD = object()
+
 class Parser:
-    def __init__(self, tokens):
-        self.tokens = tokens
-        self.pos = 0
+    # Literal tokens allowed as annotation arguments, and the nodes that convert them
+    ANNOTATION_LITERALS = {
+        TokenType.INTEGER: IntegerNode,
+        TokenType.FLOAT: FloatNode,
+        TokenType.STRING: StringNode,
+        TokenType.BOOLEAN: BooleanNode,
+    }
 
-    @property
-    def current_token(self):
-        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+    def __init__(self, tokens):
+        # Tokens are pulled from any iterable, such as Lexer.generate_tokens, as parsing needs them;
+        # only the current token and at most one after it are held at a time
+        self._tokens = iter(tokens)
+        self._next_token = _UNREAD
+        self.current_token = next(self._tokens, None)  # None once the tokens run out
 
     def advance(self):
-        self.pos += 1
+        next_token = self._next_token
+        if next_token is _UNREAD:
+            self.current_token = next(self._tokens, None)
+        else:
+            self.current_token = next_token
+            self._next_token = _UNREAD
+
+    def peek(self):
+        """The token after the current one, without consuming anything"""
+        if self._next_token is _UNREAD:
+            self._next_token = next(self._tokens, None)
+        return self._next_token
 
     def parse(self):
         statements = []
@@ -384,7 +444,7 @@ class Parser:
             return self.parse_annotated_statement()
         elif self.current_token.type == TokenType.IDENTIFIER: # Check for assignment
             # Peek ahead to see if it's an assignment
-            next_token = self.tokens[self.pos + 1] if self.pos + 1 < len(self.tokens) else None
+            next_token = self.peek()
             if next_token and next_token.type == TokenType.EQUALS:
                 identifier = self.current_token.value
                 self.advance() # Consume identifier
@@ -463,17 +523,50 @@ class Parser:
 
     def parse_annotated_statement(self):
         annotations = []
+        arguments = {}
         while self.current_token.type == TokenType.AT:
             self.advance() # Consume '@'
             if self.current_token.type == TokenType.IDENTIFIER:
-                annotations.append(self.current_token.value)
+                name = self.current_token.value
+                annotations.append(name)
                 self.advance()
+                if self.current_token.type == TokenType.LPAREN:
+                    arguments[name] = self.parse_annotation_arguments()
             else:
                 raise Exception("Expected identifier after @ for annotation")
         
         # Parse the actual statement
         statement = self.parse_statement()
-        return AnnotatedNode(annotations, statement)
+        return AnnotatedNode(annotations, statement, arguments)
+
+    def parse_annotation_arguments(self):
+        """Parse '(literal, name=literal, ...)' after an annotation name"""
+        self.advance() # Consume '('
+        args = []
+        kwargs = {}
+        while self.current_token.type != TokenType.RPAREN:
+            keyword = None
+            if self.current_token.type == TokenType.IDENTIFIER:
+                keyword = self.current_token.value
+                self.advance()
+                if self.current_token.type != TokenType.EQUALS:
+                    raise Exception(f"Expected '=' after annotation argument '{keyword}'")
+                self.advance() # Consume '='
+            literal = self.ANNOTATION_LITERALS.get(self.current_token.type)
+            if literal is None:
+                raise Exception(f"Annotation arguments must be literals, got {self.current_token.type}")
+            value = literal(self.current_token.value).value
+            self.advance()
+            if keyword is None:
+                args.append(value)
+            else:
+                kwargs[keyword] = value
+            if self.current_token.type == TokenType.COMMA:
+                self.advance()
+            elif self.current_token.type != TokenType.RPAREN:
+                raise Exception("Expected ',' or ')' in annotation arguments")
+        self.advance() # Consume ')'
+        return args, kwargs
 
     def parse_function_declaration(self):
         self.advance() # Consume 'func' or 'fn'
@@ -674,103 +767,67 @@ class Parser:
         return BlockNode(statements)
 
     def parse_expression(self):
+        token_type = self.current_token.type if self.current_token else None
         # Check for lambda expression
-        if self.current_token and self.current_token.type == TokenType.LAMBDA:
+        if token_type == TokenType.LAMBDA:
             return self.parse_lambda_expression()
-        
+
         # Check for map function
-        if self.current_token and self.current_token.type == TokenType.MAP:
+        if token_type == TokenType.MAP:
             return self.parse_map_function()
-        
+
         # Check for filter function
-        if self.current_token and self.current_token.type == TokenType.FILTER:
+        if token_type == TokenType.FILTER:
             return self.parse_filter_function()
-        
+
         # Check for reduce function
-        if self.current_token and self.current_token.type == TokenType.REDUCE:
+        if token_type == TokenType.REDUCE:
             return self.parse_reduce_function()
-        
+
         # Check for spawn expression
-        if self.current_token and self.current_token.type == TokenType.SPAWN:
+        if token_type == TokenType.SPAWN:
             return self.parse_spawn_expression()
-        
+
         # Check for await expression
-        if self.current_token and self.current_token.type == TokenType.AWAIT:
+        if token_type == TokenType.AWAIT:
             return self.parse_await_expression()
-        
+
         # Check for assignment expression (walrus operator)
         # Look ahead to see if we have an identifier followed by :=
-        if (self.current_token and self.current_token.type == TokenType.IDENTIFIER and
-            self.pos + 1 < len(self.tokens) and 
-            self.tokens[self.pos + 1].type == TokenType.WALRUS):
+        if (token_type == TokenType.IDENTIFIER and
+            self.peek() and self.peek().type == TokenType.WALRUS):
             # This is an assignment expression
             identifier = self.current_token.value
             self.advance()  # Consume identifier
             self.advance()  # Consume :=
             value = self.parse_expression()
             return AssignmentExpressionNode(identifier, value)
-        
-        # Parse pipeline expressions (lowest precedence)
-        node = self.parse_logical_or()
-        while self.current_token and self.current_token.type == TokenType.PIPELINE:
-            self.advance()
-            right = self.parse_logical_or()
-            node = PipelineNode(node, right)
-        return node
-
-    def parse_logical_or(self):
-        # Parse logical OR expressions
-        node = self.parse_logical_and()
-        while self.current_token and self.current_token.type == TokenType.OR:
-            op = self.current_token.type
-            self.advance()
-            right = self.parse_logical_and()
-            node = BinOpNode(node, op, right)
-        return node
-
-    def parse_logical_or(self):
-        # Parse logical OR expressions
-        node = self.parse_logical_and()
-        while self.current_token and self.current_token.type == TokenType.OR:
-            op = self.current_token.type
-            self.advance()
-            right = self.parse_logical_and()
-            node = BinOpNode(node, op, right)
-        return node
-
-    def parse_logical_and(self):
-        # Parse comparison expressions
-        node = self.parse_term()
-        while self.current_token and self.current_token.type in (TokenType.LESS_THAN, TokenType.GREATER_THAN, TokenType.EQUAL_EQUAL, TokenType.NOT_EQUALS, TokenType.LESS_EQUAL, TokenType.GREATER_EQUAL):
-            op = self.current_token.type
-            self.advance()
-            right = self.parse_term()
-            node = BinOpNode(node, op, right)
-        return node
-
-    def parse_term(self):
-        node = self.parse_factor()
-        while self.current_token and self.current_token.type in (TokenType.PLUS, TokenType.MINUS):
-            op = self.current_token.type
-            self.advance()
-            right = self.parse_factor()
-            node = BinOpNode(node, op, right)
-        return node
-
-    def parse_factor(self):
-        node = self.parse_power()
-        while self.current_token and self.current_token.type in (TokenType.MULTIPLY, TokenType.DIVIDE, TokenType.MODULO):
-            op = self.current_token.type
-            self.advance()
-            right = self.parse_power()
-            node = BinOpNode(node, op, right)
-        return node
 
-    def parse_power(self):
-        # Handle exponentiation (highest precedence)
+        # Binary operators, down to the pipeline at the lowest precedence
+        return self.parse_binary()
+
+    def parse_binary(self, min_precedence=1):
+        """Parse binary operators by precedence climbing over BINARY_PRECEDENCE.
+
+        Every operator is left-associative: its right operand may only
+        contain operators that bind tighter.
+        """
         node = self.parse_unary()
-        # Note: We're not implementing power operator in this version
-        return node
+        precedences = BINARY_PRECEDENCE
+        while True:
+            token = self.current_token
+            if token is None:
+                return node
+            precedence = precedences.get(token.type)
+            if precedence is None or precedence < min_precedence:
+                return node
+            op = token.type
+            self.advance()
+            right = self.parse_binary(precedence + 1)
+            if op is TokenType.PIPELINE:
+                node = PipelineNode(node, right)
+            else:
+                node = BinOpNode(node, op, right)
 
     def parse_unary(self):
         token = self.current_token
@@ -778,6 +835,11 @@ class Parser:
             self.advance()
             factor = self.parse_unary()
             return UnaryOpNode(TokenType.MINUS, factor)
+        elif token.type == TokenType.NOT:
+            # As in Python, 'not' applies to a whole comparison: not a == b is not (a == b)
+            self.advance()
+            operand = self.parse_binary(BINARY_PRECEDENCE[TokenType.EQUAL_EQUAL])
+            return UnaryOpNode(TokenType.NOT, operand)
         elif token.type == TokenType.INTEGER:
             self.advance()
             return IntegerNode(token.value)
@@ -802,15 +864,18 @@ class Parser:
                 obj = VariableAccessNode(token.value)
                 return self.parse_index_access(obj)
             return VariableAccessNode(token.value)
-        elif token.type == TokenType.LBRACKET or token.type == TokenType.LPAREN:  # List or tuple literal
+        elif token.type == TokenType.LBRACKET:  # List literal
             return self.parse_list_literal()
         elif token.type == TokenType.LPAREN:
+            # A parenthesized expression, or a tuple when a comma follows the first element
+            next_token = self.peek()
+            if next_token and next_token.type == TokenType.RPAREN:
+                return self.parse_list_literal()  # Empty tuple
             self.advance()
             # Check if this is an assignment expression
             # Look ahead to see if we have an identifier followed by :=
             if (self.current_token and self.current_token.type == TokenType.IDENTIFIER and
-                self.pos + 1 < len(self.tokens) and 
-                self.tokens[self.pos + 1].type == TokenType.WALRUS):
+                self.peek() and self.peek().type == TokenType.WALRUS):
                 # This is an assignment expression within parentheses
                 node = self.parse_expression()
                 if self.current_token.type != TokenType.RPAREN:
@@ -820,6 +885,14 @@ class Parser:
             else:
                 # Normal parenthesized expression
                 node = self.parse_expression()
+                if self.current_token and self.current_token.type == TokenType.COMMA:
+                    # Tuple literal like (1, 2, 3)
+                    elements = [node]
+                    while self.current_token and self.current_token.type == TokenType.COMMA:
+                        self.advance()
+                        elements.append(self.parse_expression())
+                    self.advance() # Consume RPAREN
+                    return TupleNode(elements)
                 if self.current_token.type != TokenType.RPAREN:
                     raise Exception("Expected ')' after expression")
                 self.advance() # Consume RPAREN
@@ -0,0 +1,70 @@
+from .parser import LiteralPatternNode, VariablePatternNode, TuplePatternNode, ConstructorPatternNode
+
+
+def pattern_value(pattern):
+    """Value a case pattern compares equal against, matching VM.visit_*PatternNode"""
+    if isinstance(pattern, LiteralPatternNode):
+        return pattern.value
+    if isinstance(pattern, VariablePatternNode):
+        return pattern.name
+    if isinstance(pattern, TuplePatternNode):
+        return [pattern_value(element) for element in pattern.elements]
+    if isinstance(pattern, ConstructorPatternNode):
+        return {
+            'constructor': pattern.constructor,
+            'args': [pattern_value(arg) for arg in pattern.args]
+        }
+    raise Exception(f"Unsupported pattern: {type(pattern).__name__}")
+
+
+def match_key(value):
+    """Hashable stand-in for a value that is equal to another's exactly when the values are.
+
+    Unlike memo.freeze it keeps Python's equality, so 1, 1.0 and true share a
+    key just as they compare equal. Raises TypeError for unhashable values.
+    """
+    kind = type(value)
+    if kind is list:
+        return (list, tuple([match_key(item) for item in value]))
+    if kind is tuple:
+        return (tuple, tuple([match_key(item) for item in value]))
+    if kind is dict:
+        return (dict, frozenset([(key, match_key(item)) for key, item in value.items()]))
+    hash(value)
+    return value
+
+
+class MatchTable:
+    """Decision table of a match statement, built once from its case patterns.
+
+    Every pattern is an equality test against a constant, so all the cases
+    share a single test: one hash lookup of the subject picks the first case
+    whose pattern equals it. Subjects that can't be hashed fall back to
+    comparing against each pattern in order.
+    """
+    __slots__ = ['patterns', 'cases', 'default']
+
+    def __init__(self, patterns):
+        self.patterns = patterns
+        self.default = len(patterns)  # Index returned when no case matches
+        self.cases = {}
+        for index, pattern in enumerate(patterns):
+            # An earlier case with an equal pattern wins, as in a chain of ==
+            self.cases.setdefault(match_key(pattern), index)
+
+    def find(self, value):
+        """Index of the first case whose pattern equals value, or self.default"""
+        kind = type(value)
+        if kind is str or kind is int:
+            return self.cases.get(value, self.default)
+        try:
+            key = match_key(value)
+        except TypeError:
+            for index, pattern in enumerate(self.patterns):
+                if value == pattern:
+                    return index
+            return self.default
+        return self.cases.get(key, self.default)
+
+    def __repr__(self):
+        return f"<match table of {len(self.patterns)} cases>"
@@ -0,0 +1,249 @@
+from collections import Counter
+
+from .bytecode import OpCode, JUMP_OPERANDS
+
+
+class Superinstruction:
+    """A run of opcodes the peephole pass replaces with one fused instruction.
+
+    ``combine`` receives the operands of the matched instructions, in order,
+    and returns the operand of the fused instruction.
+    """
+    __slots__ = ['name', 'pattern', 'opcode', 'combine']
+
+    def __init__(self, name, pattern, opcode, combine):
+        self.name = name
+        self.pattern = tuple(pattern)
+        self.opcode = opcode
+        self.combine = combine
+
+
+SUPERINSTRUCTIONS = {
+    superinstruction.name: superinstruction for superinstruction in [
+        # a + b on two locals
+        Superinstruction('load_fast_load_fast_add',
+                         (OpCode.LOAD_FAST, OpCode.LOAD_FAST, OpCode.BINARY_ADD),
+                         OpCode.BINARY_ADD_FAST_FAST, lambda a, b, _: (a, b)),
+        # i + 1 on a local
+        Superinstruction('load_fast_load_const_add',
+                         (OpCode.LOAD_FAST, OpCode.LOAD_CONST, OpCode.BINARY_ADD),
+                         OpCode.BINARY_ADD_FAST_CONST, lambda slot, const, _: (slot, const)),
+        # n - 1 on a local
+        Superinstruction('load_fast_load_const_subtract',
+                         (OpCode.LOAD_FAST, OpCode.LOAD_CONST, OpCode.BINARY_SUBTRACT),
+                         OpCode.BINARY_SUBTRACT_FAST_CONST, lambda slot, const, _: (slot, const)),
+        # Conditions of if and while
+        Superinstruction('compare_jump_if_false',
+                         (OpCode.COMPARE_OP, OpCode.JUMP_IF_FALSE),
+                         OpCode.COMPARE_JUMP_IF_FALSE, lambda op, target: (op, target)),
+        # Local initialised with a literal
+        Superinstruction('load_const_store_fast',
+                         (OpCode.LOAD_CONST, OpCode.STORE_FAST),
+                         OpCode.LOAD_CONST_STORE_FAST, lambda const, slot: (const, slot)),
+    ]
+}
+
+# Fusions the compiler applies unless told otherwise
+DEFAULT_FUSIONS = tuple(SUPERINSTRUCTIONS)
+
+
+def jump_target(instruction):
+    """Jump target of an instruction, or None if it doesn't jump"""
+    jump_operand = JUMP_OPERANDS.get(instruction[0])
+    if jump_operand is None:
+        return None
+    operand = instruction[1]
+    return operand[jump_operand] if isinstance(operand, tuple) else operand
+
+
+def with_jump_target(instruction, target):
+    """Copy of a jumping instruction with a new target"""
+    opcode, operand = instruction
+    if isinstance(operand, tuple):
+        operand = list(operand)
+        operand[JUMP_OPERANDS[opcode]] = target
+        return (opcode, tuple(operand))
+    return (opcode, target)
+
+
+def jump_targets(bytecode):
+    targets = set()
+    for instruction in bytecode:
+        target = jump_target(instruction)
+        if target is not None:
+            targets.add(target)
+    return targets
+
+
+def remap_jumps(bytecode, index_map):
+    """Rewrite jump targets through index_map (old instruction index -> new index)"""
+    for i, instruction in enumerate(bytecode):
+        target = jump_target(instruction)
+        if target is not None:
+            bytecode[i] = with_jump_target(instruction, index_map[target])
+    return bytecode
+
+
+# Instructions after which execution never falls through to the next one
+TERMINATORS = frozenset([OpCode.JUMP, OpCode.RETURN_VALUE, OpCode.TAIL_CALL])
+
+
+def compact(bytecode, keep):
+    """Drop the instructions whose keep flag is false and remap jumps.
+
+    A jump to a dropped instruction lands on the next kept one.
+    """
+    compacted = []
+    index_map = {}
+    for i, instruction in enumerate(bytecode):
+        index_map[i] = len(compacted)
+        if keep[i]:
+            compacted.append(instruction)
+    index_map[len(bytecode)] = len(compacted)
+    return remap_jumps(compacted, index_map)
+
+
+def fold_constant_conditions(bytecode, constants):
+    """Resolve 'LOAD_CONST c; JUMP_IF_FALSE t' at compile time"""
+    keep = [True] * len(bytecode)
+    targets = jump_targets(bytecode)
+    for i in range(len(bytecode) - 1):
+        if (bytecode[i][0] != OpCode.LOAD_CONST or bytecode[i + 1][0] != OpCode.JUMP_IF_FALSE
+                or not keep[i] or i + 1 in targets):
+            continue
+        if constants[bytecode[i][1]]:
+            # Never jumps: drop both
+            keep[i] = keep[i + 1] = False
+        else:
+            # Always jumps
+            bytecode[i] = (OpCode.JUMP, bytecode[i + 1][1])
+            keep[i + 1] = False
+    return compact(bytecode, keep)
+
+
+def thread_jumps(bytecode):
+    """Point every jump that lands on a JUMP straight at that JUMP's target"""
+    length = len(bytecode)
+    for i, instruction in enumerate(bytecode):
+        target = jump_target(instruction)
+        if target is None:
+            continue
+        final = target
+        seen = set()
+        while final < length and bytecode[final][0] == OpCode.JUMP and final not in seen:
+            seen.add(final)
+            final = bytecode[final][1]
+        if final != target:
+            bytecode[i] = with_jump_target(instruction, final)
+    return bytecode
+
+
+def match_entries(bytecode):
+    """Indices of the JUMPs making up the branch tables that follow MATCH instructions"""
+    entries = set()
+    for i, instruction in enumerate(bytecode):
+        if instruction[0] == OpCode.MATCH:
+            entries.update(range(i + 1, i + 1 + instruction[1][1]))
+    return entries
+
+
+def reachable(bytecode):
+    """Flags telling which instructions can run, following jumps from the entry"""
+    length = len(bytecode)
+    seen = [False] * length
+    pending = [0]
+    while pending:
+        i = pending.pop()
+        if i >= length or seen[i]:
+            continue
+        seen[i] = True
+        target = jump_target(bytecode[i])
+        if target is not None:
+            pending.append(target)
+        if bytecode[i][0] == OpCode.MATCH:
+            # Each branch table entry can be taken
+            pending.extend(range(i + 1, i + 1 + bytecode[i][1][1]))
+        elif bytecode[i][0] not in TERMINATORS:
+            pending.append(i + 1)
+    return seen
+
+
+def drop_redundant_jumps(bytecode):
+    """Remove jumps to the very next instruction"""
+    keep = [True] * len(bytecode)
+    entries = match_entries(bytecode)
+    for i, instruction in enumerate(bytecode):
+        if jump_target(instruction) != i + 1 or i in entries:
+            # Branch table entries must stay in place, even those jumping to the next instruction
+            continue
+        if instruction[0] == OpCode.JUMP:
+            keep[i] = False
+        elif instruction[0] == OpCode.JUMP_IF_FALSE:
+            # The condition still has to come off the stack
+            bytecode[i] = (OpCode.POP_TOP,)
+    return compact(bytecode, keep)
+
+
+def eliminate_dead_code(bytecode, constants):
+    """Fold constant conditions, thread jumps and drop unreachable or redundant code.
+
+    Runs to a fixed point, since each step can expose work for the others.
+    """
+    while True:
+        size = len(bytecode)
+        bytecode = fold_constant_conditions(bytecode, constants)
+        bytecode = thread_jumps(bytecode)
+        bytecode = compact(bytecode, reachable(bytecode))
+        bytecode = drop_redundant_jumps(bytecode)
+        if len(bytecode) == size:
+            return bytecode
+
+
+def fuse(bytecode, fusions=DEFAULT_FUSIONS):
+    """Replace opcode runs listed in fusions with superinstructions.
+
+    A run is only fused when no jump lands inside it, and every jump target
+    is remapped to the new instruction positions.
+    """
+    candidates = [SUPERINSTRUCTIONS[name] for name in fusions]
+    if not candidates:
+        return bytecode
+    # Try longer patterns first so that they win over their prefixes
+    candidates.sort(key=lambda superinstruction: -len(superinstruction.pattern))
+    targets = jump_targets(bytecode)
+
+    fused = []
+    index_map = {}
+    i = 0
+    length = len(bytecode)
+    while i < length:
+        index_map[i] = len(fused)
+        for superinstruction in candidates:
+            pattern = superinstruction.pattern
+            end = i + len(pattern)
+            if end > length:
+                continue
+            if any(bytecode[i + k][0] != pattern[k] for k in range(len(pattern))):
+                continue
+            if any(k in targets for k in range(i + 1, end)):
+                continue
+            operands = [bytecode[k][1] if len(bytecode[k]) > 1 else None for k in range(i, end)]
+            fused.append((superinstruction.opcode, superinstruction.combine(*operands)))
+            for k in range(i + 1, end):
+                index_map[k] = len(fused) - 1
+            i = end
+            break
+        else:
+            fused.append(bytecode[i])
+            i += 1
+    index_map[length] = len(fused)
+    return remap_jumps(fused, index_map)
+
+
+def opcode_pair_counts(bytecode, counts=None):
+    """Count adjacent opcode pairs, e.g. to pick which fusions are worth enabling"""
+    if counts is None:
+        counts = Counter()
+    for first, second in zip(bytecode, bytecode[1:]):
+        counts[(OpCode(first[0]).name, OpCode(second[0]).name)] += 1
+    return counts
@@ -10,12 +10,14 @@ class FlowProfiler:
         self.function_times = defaultdict(float)
         self.line_times = defaultdict(float)
         self.memory_usage = []
+        self.memo_caches = []
         self.start_time = None
         self.process = psutil.Process(os.getpid())
         
     def start(self):
         """Start profiling"""
         self.start_time = time.time()
+        self.memo_caches = []
         self.initial_memory = self.process.memory_info().rss / 1024 / 1024  # MB
         
     def stop(self):
@@ -31,6 +33,7 @@ class FlowProfiler:
             'function_calls': dict(self.function_calls),
             'function_times': dict(self.function_times),
             'line_times': dict(self.line_times),
+            'memo_caches': {cache.name: cache.stats() for cache in self.memo_caches},
             'initial_memory_mb': self.initial_memory,
             'final_memory_mb': final_memory,
             'memory_delta_mb': final_memory - self.initial_memory
@@ -48,6 +51,11 @@ class FlowProfiler:
         """Record time spent on a line"""
         self.line_times[line_info] += elapsed_time
         
+    def register_memo_cache(self, cache):
+        """Track a @memo function's cache so its hit rate shows up in the results"""
+        if self.start_time is not None:
+            self.memo_caches.append(cache)
+
     def record_memory_usage(self, description=""):
         """Record current memory usage"""
         memory_mb = self.process.memory_info().rss / 1024 / 1024  # MB
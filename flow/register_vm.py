@@ -0,0 +1,418 @@
+import time
+
+from . import builtins
+from .bytecode import CodeObject, Closure
+from .registers import RegOp, to_register_code
+from .vm import VM, COMPARE_FUNCTIONS, _EXHAUSTED, _globals_versions
+
+
+class RegisterFrame:
+    __slots__ = ['code_obj', 'ip', 'registers', 'globals', 'return_value']
+
+    def __init__(self, code_obj, registers, globals):
+        self.code_obj = code_obj
+        self.ip = 0
+        self.registers = registers  # Locals, stack temporaries, then constants
+        self.globals = globals
+        self.return_value = None
+
+
+def register_code(code_obj):
+    """Register form of a code object, translated on first use"""
+    registers = code_obj.registers
+    if registers is None:
+        registers = code_obj.registers = to_register_code(code_obj)
+    return registers
+
+
+def frame_registers(func, args, parent=None):
+    """Register file for a call: the arguments in the parameter slots, then the rest"""
+    num_params = len(func.params)
+    if len(args) != num_params:
+        args = args[:num_params] + [None] * (num_params - len(args))
+    registers = args + register_code(func).frame_tail
+    if parent is not None:
+        registers[-1] = parent
+    return registers
+
+
+class RegisterVM(VM):
+    """Runs compiled code as register instructions instead of on an operand stack.
+
+    The code objects come from the same Compiler as for the stack VM; each
+    one is translated by registers.to_register_code the first time it runs.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._register_handlers = self._build_register_handlers()
+
+    def _build_register_handlers(self):
+        return {
+            RegOp.MOVE: self._reg_move,
+            RegOp.ADD: self._reg_add,
+            RegOp.SUBTRACT: self._reg_subtract,
+            RegOp.MULTIPLY: self._reg_multiply,
+            RegOp.DIVIDE: self._reg_divide,
+            RegOp.MODULO: self._reg_modulo,
+            RegOp.POWER: self._reg_power,
+            RegOp.AND: self._reg_and,
+            RegOp.OR: self._reg_or,
+            RegOp.XOR: self._reg_xor,
+            RegOp.LSHIFT: self._reg_lshift,
+            RegOp.RSHIFT: self._reg_rshift,
+            RegOp.NEGATIVE: self._reg_negative,
+            RegOp.NOT: self._reg_not,
+            RegOp.COMPARE: self._reg_compare,
+            RegOp.SUBSCR: self._reg_subscr,
+            RegOp.STORE_SUBSCR: self._reg_store_subscr,
+            RegOp.LOAD_GLOBAL: self._reg_load_global,
+            RegOp.STORE_GLOBAL: self._reg_store_global,
+            RegOp.PRINT: self._reg_print,
+            RegOp.JUMP: self._reg_jump,
+            RegOp.JUMP_IF_FALSE: self._reg_jump_if_false,
+            RegOp.COMPARE_JUMP_IF_FALSE: self._reg_compare_jump_if_false,
+            RegOp.GET_ITER: self._reg_get_iter,
+            RegOp.FOR_ITER: self._reg_for_iter,
+            RegOp.RETURN: self._reg_return,
+            RegOp.CALL: self._reg_call,
+            RegOp.TAIL_CALL: self._reg_tail_call,
+            RegOp.CALL_BUILTIN: self._reg_call_builtin,
+            RegOp.BUILD_LIST: self._reg_build_list,
+            RegOp.BUILD_TUPLE: self._reg_build_tuple,
+            RegOp.BUILD_MAP: self._reg_build_map,
+            RegOp.MAP_FUNCTION: self._reg_map_function,
+            RegOp.FILTER_FUNCTION: self._reg_filter_function,
+            RegOp.REDUCE_FUNCTION: self._reg_reduce_function,
+            RegOp.MATCH: self._reg_match,
+            RegOp.LOAD_DEREF: self._reg_load_deref,
+            RegOp.STORE_DEREF: self._reg_store_deref,
+            RegOp.MAKE_CLOSURE: self._reg_make_closure,
+            RegOp.SAVE_GLOBAL: self._reg_save_global,
+            RegOp.RESTORE_GLOBAL: self._reg_restore_global,
+        }
+
+    def run(self, code_obj):
+        """Execute a compiled top-level program"""
+        frame = RegisterFrame(code_obj, frame_registers(code_obj, []), self.globals)
+        self.frames.append(frame)
+        try:
+            return self.execute_frame(frame)
+        finally:
+            self.frames.pop()
+
+    def thread_registers(self, code_obj):
+        """Pair each register instruction of a code object with its handler.
+
+        Like VM.thread_code, names and builtins are resolved here, and global
+        loads and calls get a mutable inline cache in their operand.
+        """
+        registers = register_code(code_obj)
+        constants = code_obj.constants
+        threaded = []
+        for op, operand in registers.instructions:
+            if op == RegOp.LOAD_GLOBAL:
+                dst, name = operand
+                # [name, globals version, value]
+                operand = (dst, [constants[name], None, None])
+            elif op in (RegOp.STORE_GLOBAL, RegOp.RESTORE_GLOBAL):
+                operand = (constants[operand[0]], operand[1])
+            elif op == RegOp.SAVE_GLOBAL:
+                operand = (operand[0], constants[operand[1]])
+            elif op == RegOp.COMPARE:
+                dst, compare_op, left, right = operand
+                operand = (dst, COMPARE_FUNCTIONS[compare_op], left, right)
+            elif op == RegOp.COMPARE_JUMP_IF_FALSE:
+                compare_op, left, right, target = operand
+                operand = (COMPARE_FUNCTIONS[compare_op], left, right, target)
+            elif op == RegOp.CALL_BUILTIN:
+                dst, index, args = operand
+                operand = (dst, builtins.BUILTIN_TABLE[index], args)
+            elif op == RegOp.MATCH:
+                subject, table, targets = operand
+                operand = (subject, constants[table], targets)
+            elif op == RegOp.MAKE_CLOSURE:
+                operand = (operand[0], constants[operand[1]])
+            elif op == RegOp.CALL or op == RegOp.TAIL_CALL:
+                # [last callee seen]
+                operand = operand + ([None],)
+            threaded.append((self._register_handlers[op].__func__, operand))
+        registers.threaded = threaded
+        return threaded
+
+    def execute_frame(self, frame):
+        start_time = None
+        if self.profiler.start_time is not None:
+            start_time = time.time()
+
+        code_obj = frame.code_obj
+        while True:
+            registers = code_obj.registers
+            threaded = registers.threaded if registers is not None else None
+            if threaded is None:
+                threaded = self.thread_registers(code_obj)
+            code_len = len(threaded)
+            regs = frame.registers
+
+            while frame.ip < code_len:
+                handler, operand = threaded[frame.ip]
+                frame.ip += 1
+                handler(self, frame, regs, operand)
+
+            if frame.code_obj is code_obj and frame.registers is regs:
+                break
+            # A tail call switched the frame to another function's code, or a new register file
+            code_obj = frame.code_obj
+            frame.ip = 0
+
+        if start_time is not None and self.profiler.start_time is not None:
+            self.profiler.record_function_time(frame.code_obj.name, time.time() - start_time)
+
+        return frame.return_value
+
+    def _call_code_object(self, func, args, use_memo=True):
+        if use_memo and func.memo is not None:
+            return func.memo.call(lambda args: self._call_code_object(func, args, False), args)
+        if type(func) is Closure:
+            frame = RegisterFrame(func.function, frame_registers(func.function, args, func.parent), self.globals)
+        else:
+            frame = RegisterFrame(func, frame_registers(func, args), self.globals)
+        self.frames.append(frame)
+        try:
+            return self.execute_frame(frame)
+        finally:
+            self.frames.pop()
+
+    # --- Handlers; operands are register numbers laid out as in registers.RegOp ---
+    def _reg_move(self, frame, regs, operand):
+        dst, src = operand
+        regs[dst] = regs[src]
+
+    def _reg_add(self, frame, regs, operand):
+        dst, left, right = operand
+        regs[dst] = regs[left] + regs[right]
+
+    def _reg_subtract(self, frame, regs, operand):
+        dst, left, right = operand
+        regs[dst] = regs[left] - regs[right]
+
+    def _reg_multiply(self, frame, regs, operand):
+        dst, left, right = operand
+        regs[dst] = regs[left] * regs[right]
+
+    def _reg_divide(self, frame, regs, operand):
+        dst, left, right = operand
+        regs[dst] = regs[left] / regs[right]
+
+    def _reg_modulo(self, frame, regs, operand):
+        dst, left, right = operand
+        regs[dst] = regs[left] % regs[right]
+
+    def _reg_power(self, frame, regs, operand):
+        dst, left, right = operand
+        regs[dst] = regs[left] ** regs[right]
+
+    def _reg_and(self, frame, regs, operand):
+        dst, left, right = operand
+        regs[dst] = regs[left] & regs[right]
+
+    def _reg_or(self, frame, regs, operand):
+        dst, left, right = operand
+        regs[dst] = regs[left] | regs[right]
+
+    def _reg_xor(self, frame, regs, operand):
+        dst, left, right = operand
+        regs[dst] = regs[left] ^ regs[right]
+
+    def _reg_lshift(self, frame, regs, operand):
+        dst, left, right = operand
+        regs[dst] = regs[left] << regs[right]
+
+    def _reg_rshift(self, frame, regs, operand):
+        dst, left, right = operand
+        regs[dst] = regs[left] >> regs[right]
+
+    def _reg_negative(self, frame, regs, operand):
+        dst, src = operand
+        regs[dst] = -regs[src]
+
+    def _reg_not(self, frame, regs, operand):
+        dst, src = operand
+        regs[dst] = not regs[src]
+
+    def _reg_compare(self, frame, regs, operand):
+        dst, compare, left, right = operand
+        regs[dst] = compare(regs[left], regs[right])
+
+    def _reg_subscr(self, frame, regs, operand):
+        dst, obj, index = operand
+        regs[dst] = regs[obj][regs[index]]
+
+    def _reg_store_subscr(self, frame, regs, operand):
+        obj, index, value = operand
+        regs[obj][regs[index]] = regs[value]
+
+    def _reg_load_global(self, frame, regs, operand):
+        dst, cache = operand
+        globals = frame.globals
+        if cache[1] == globals.version:
+            regs[dst] = cache[2]
+            return
+        name = cache[0]
+        if name not in globals:
+            raise NameError(f"name '{name}' is not defined")
+        value = globals[name]
+        cache[1] = globals.version
+        cache[2] = value
+        regs[dst] = value
+
+    def _reg_load_deref(self, frame, regs, operand):
+        dst, depth, slot = operand
+        scope = regs
+        for _ in range(depth):
+            # A register file ends with that of the frame enclosing it
+            scope = scope[-1]
+        regs[dst] = scope[slot]
+
+    def _reg_store_deref(self, frame, regs, operand):
+        depth, slot, src = operand
+        scope = regs
+        for _ in range(depth):
+            scope = scope[-1]
+        scope[slot] = regs[src]
+
+    def _reg_make_closure(self, frame, regs, operand):
+        # The nested function sees this call's registers, its locals first
+        dst, code_obj = operand
+        regs[dst] = Closure(code_obj, regs)
+
+    def _reg_store_global(self, frame, regs, operand):
+        name, src = operand
+        globals = frame.globals
+        globals[name] = regs[src]
+        # Invalidate every LOAD_GLOBAL inline cache filled from this table
+        globals.version = next(_globals_versions)
+
+    def _reg_save_global(self, frame, regs, operand):
+        dst, name = operand
+        regs[dst] = frame.globals.get(name)
+
+    def _reg_restore_global(self, frame, regs, operand):
+        name, src = operand
+        globals = frame.globals
+        if regs[src] is not None:
+            globals[name] = regs[src]
+        else:
+            globals.pop(name, None)
+        globals.version = next(_globals_versions)
+
+    def _reg_print(self, frame, regs, operand):
+        print(' '.join(str(regs[src]) for src in operand[0]))
+
+    def _reg_jump(self, frame, regs, operand):
+        frame.ip = operand[0]
+
+    def _reg_match(self, frame, regs, operand):
+        subject, table, targets = operand
+        frame.ip = targets[table.find(regs[subject])]
+
+    def _reg_jump_if_false(self, frame, regs, operand):
+        condition, target = operand
+        if not regs[condition]:
+            frame.ip = target
+
+    def _reg_compare_jump_if_false(self, frame, regs, operand):
+        compare, left, right, target = operand
+        if not compare(regs[left], regs[right]):
+            frame.ip = target
+
+    def _reg_get_iter(self, frame, regs, operand):
+        dst, src = operand
+        iterable = regs[src]
+        # Only lists are iterable, like VM.visit_ForNode
+        if not isinstance(iterable, list):
+            raise Exception(f"Cannot iterate over {type(iterable).__name__}")
+        regs[dst] = iter(iterable)
+
+    def _reg_for_iter(self, frame, regs, operand):
+        dst, iterator, target = operand
+        item = next(regs[iterator], _EXHAUSTED)
+        if item is _EXHAUSTED:
+            frame.ip = target
+        else:
+            regs[dst] = item
+
+    def _reg_return(self, frame, regs, operand):
+        # Store the result and move the ip past the end so execute_frame exits
+        frame.return_value = regs[operand[0]]
+        frame.ip = len(frame.code_obj.registers.threaded)
+
+    def _reg_call(self, frame, regs, operand):
+        # operand[3] is [last callee]; a repeat callee skips the type check
+        dst, function, args, cache = operand
+        func = regs[function]
+        if func is not cache[0]:
+            if not isinstance(func, (CodeObject, Closure)):
+                raise TypeError(f"'{type(func).__name__}' object is not callable")
+            cache[0] = func
+        regs[dst] = self._call_code_object(func, [regs[arg] for arg in args])
+
+    def _reg_tail_call(self, frame, regs, operand):
+        # Like CALL followed by RETURN, but the callee takes over this frame
+        function, args, cache = operand
+        func = regs[function]
+        if func is not cache[0]:
+            if not isinstance(func, (CodeObject, Closure)):
+                raise TypeError(f"'{type(func).__name__}' object is not callable")
+            cache[0] = func
+        args = [regs[arg] for arg in args]
+        if func.memo is not None:
+            # Memoized functions must go through their cache, so call and return instead
+            frame.return_value = self._call_code_object(func, args)
+            frame.ip = len(frame.code_obj.registers.threaded)
+            return
+        if type(func) is Closure:
+            parent = func.parent
+            func = func.function
+        else:
+            parent = None
+
+        if func is frame.code_obj and not func.registers.makes_closures:
+            # Refill this register file in place; execute_frame keeps a reference to it
+            regs[:] = frame_registers(func, args, parent)
+            frame.ip = 0
+        else:
+            # Leave the current code or registers; execute_frame restarts at the callee's first instruction
+            frame.ip = len(frame.code_obj.registers.threaded)
+            frame.registers = frame_registers(func, args, parent)
+            frame.code_obj = func
+
+    def _reg_call_builtin(self, frame, regs, operand):
+        # operand[1] was resolved to the builtin function by thread_registers
+        dst, func, args = operand
+        regs[dst] = func(*[regs[arg] for arg in args])
+
+    def _reg_build_list(self, frame, regs, operand):
+        dst, srcs = operand
+        regs[dst] = [regs[src] for src in srcs]
+
+    def _reg_build_tuple(self, frame, regs, operand):
+        dst, srcs = operand
+        regs[dst] = tuple([regs[src] for src in srcs])
+
+    def _reg_build_map(self, frame, regs, operand):
+        dst, srcs = operand
+        regs[dst] = {regs[srcs[i]]: regs[srcs[i + 1]] for i in range(0, len(srcs), 2)}
+
+    def _reg_map_function(self, frame, regs, operand):
+        dst, function, iterable = operand
+        regs[dst] = self.map_function(regs[function], regs[iterable])
+
+    def _reg_filter_function(self, frame, regs, operand):
+        dst, function, iterable = operand
+        regs[dst] = self.filter_function(regs[function], regs[iterable])
+
+    def _reg_reduce_function(self, frame, regs, operand):
+        dst, function, iterable, initial = operand
+        initial = regs[initial] if initial is not None else None
+        regs[dst] = self.reduce_function(regs[function], regs[iterable], initial)
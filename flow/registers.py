@@ -0,0 +1,422 @@
+from enum import IntEnum
+
+from .bytecode import OpCode, JUMP_OPERANDS
+
+
+class RegOp(IntEnum):
+    """Register instructions; operands are register numbers, result register first"""
+    MOVE = 0                   # dst, src
+    ADD = 1                    # dst, left, right
+    SUBTRACT = 2
+    MULTIPLY = 3
+    DIVIDE = 4
+    MODULO = 5
+    POWER = 6
+    AND = 7
+    OR = 8
+    XOR = 9
+    LSHIFT = 10
+    RSHIFT = 11
+    NEGATIVE = 12              # dst, src
+    NOT = 13
+    COMPARE = 14               # dst, compare op, left, right
+    SUBSCR = 15                # dst, obj, index
+    STORE_SUBSCR = 16          # obj, index, value
+    LOAD_GLOBAL = 17           # dst, constant index of the name
+    STORE_GLOBAL = 18          # constant index of the name, src
+    PRINT = 19                 # (srcs,)
+    JUMP = 20                  # target
+    JUMP_IF_FALSE = 21         # condition, target
+    COMPARE_JUMP_IF_FALSE = 22 # compare op, left, right, target
+    GET_ITER = 23              # dst, iterable
+    FOR_ITER = 24              # dst, iterator, target taken once the iterator is exhausted
+    RETURN = 25                # src
+    CALL = 26                  # dst, function, (args,)
+    TAIL_CALL = 27             # function, (args,)
+    CALL_BUILTIN = 28          # dst, index into builtins.BUILTIN_TABLE, (args,)
+    BUILD_LIST = 29            # dst, (srcs,)
+    BUILD_TUPLE = 30           # dst, (srcs,)
+    BUILD_MAP = 31             # dst, (key, value, key, value, ...)
+    MAP_FUNCTION = 32          # dst, function, iterable
+    FILTER_FUNCTION = 33       # dst, function, iterable
+    REDUCE_FUNCTION = 34       # dst, function, iterable, initial (None if not given)
+    MATCH = 35                 # subject, constant index of the MatchTable, (case targets,)
+    LOAD_DEREF = 36            # dst, depth, slot of a local of an enclosing function
+    STORE_DEREF = 37           # depth, slot, src
+    MAKE_CLOSURE = 38          # dst, constant index of the nested function's code object
+    SAVE_GLOBAL = 39           # dst, constant index of the name; None if it has no value
+    RESTORE_GLOBAL = 40        # constant index of the name, src; deletes the name if src is None
+
+
+# Register instructions that jump, and which of their operands is the target
+REG_JUMP_OPERANDS = {
+    RegOp.JUMP: 0,
+    RegOp.JUMP_IF_FALSE: 1,
+    RegOp.COMPARE_JUMP_IF_FALSE: 3,
+    RegOp.FOR_ITER: 2,
+}
+
+# Stack opcodes that become one register instruction taking two operands
+BINARY_REG_OPS = {
+    OpCode.BINARY_ADD: RegOp.ADD,
+    OpCode.BINARY_SUBTRACT: RegOp.SUBTRACT,
+    OpCode.BINARY_MULTIPLY: RegOp.MULTIPLY,
+    OpCode.BINARY_DIVIDE: RegOp.DIVIDE,
+    OpCode.BINARY_MODULO: RegOp.MODULO,
+    OpCode.BINARY_POWER: RegOp.POWER,
+    OpCode.BINARY_AND: RegOp.AND,
+    OpCode.BINARY_OR: RegOp.OR,
+    OpCode.BINARY_XOR: RegOp.XOR,
+    OpCode.BINARY_LSHIFT: RegOp.LSHIFT,
+    OpCode.BINARY_RSHIFT: RegOp.RSHIFT,
+    OpCode.SUBSCR: RegOp.SUBSCR,
+    OpCode.MAP_FUNCTION: RegOp.MAP_FUNCTION,
+    OpCode.FILTER_FUNCTION: RegOp.FILTER_FUNCTION,
+}
+
+UNARY_REG_OPS = {
+    OpCode.UNARY_NEGATIVE: RegOp.NEGATIVE,
+    OpCode.UNARY_NOT: RegOp.NOT,
+    OpCode.GET_ITER: RegOp.GET_ITER,
+}
+
+_BINARY_STACK_OPS = frozenset(list(BINARY_REG_OPS) + [OpCode.COMPARE_OP])
+_UNARY_STACK_OPS = frozenset(UNARY_REG_OPS)
+_PUSH_STACK_OPS = frozenset([OpCode.LOAD_CONST, OpCode.LOAD_NAME, OpCode.LOAD_GLOBAL, OpCode.LOAD_FAST,
+                             OpCode.BINARY_ADD_FAST_FAST, OpCode.BINARY_ADD_FAST_CONST,
+                             OpCode.BINARY_SUBTRACT_FAST_CONST, OpCode.LOAD_DEREF, OpCode.MAKE_CLOSURE,
+                             OpCode.SAVE_NAME])
+_POP_STACK_OPS = frozenset([OpCode.STORE_NAME, OpCode.STORE_GLOBAL, OpCode.STORE_FAST, OpCode.POP_TOP,
+                            OpCode.JUMP_IF_FALSE, OpCode.RETURN_VALUE, OpCode.STORE_DEREF,
+                            OpCode.RESTORE_NAME])
+
+
+def stack_effect(opcode, operand):
+    """(values popped, values pushed) by a stack instruction that falls through"""
+    if opcode in _BINARY_STACK_OPS:
+        return 2, 1
+    if opcode in _UNARY_STACK_OPS:
+        return 1, 1
+    if opcode in _PUSH_STACK_OPS:
+        return 0, 1
+    if opcode in _POP_STACK_OPS:
+        return 1, 0
+    if opcode == OpCode.CALL_FUNCTION:
+        return operand + 1, 1
+    if opcode == OpCode.TAIL_CALL:
+        return operand + 1, 0
+    if opcode == OpCode.CALL_BUILTIN:
+        return operand[1], 1
+    if opcode == OpCode.PRINT:
+        return operand, 0
+    if opcode in (OpCode.BUILD_LIST, OpCode.BUILD_TUPLE):
+        return operand, 1
+    if opcode == OpCode.BUILD_MAP:
+        return 2 * operand, 1
+    if opcode == OpCode.REDUCE_FUNCTION:
+        return 2 + operand, 1
+    if opcode == OpCode.STORE_SUBSCR:
+        return 3, 0
+    if opcode == OpCode.DUP_TOP:
+        return 1, 2
+    if opcode == OpCode.FOR_ITER:
+        # Leaves the iterator and pushes the next item
+        return 0, 1
+    if opcode == OpCode.COMPARE_JUMP_IF_FALSE:
+        return 2, 0
+    if opcode in (OpCode.JUMP, OpCode.LOAD_CONST_STORE_FAST):
+        return 0, 0
+    raise ValueError(f"No stack effect for {OpCode(opcode).name}")
+
+
+def jump_depth(opcode, depth):
+    """Stack depth at the target of a jump taken from a stack of the given depth"""
+    if opcode == OpCode.JUMP:
+        return depth
+    if opcode == OpCode.FOR_ITER:
+        return depth - 1  # The exhausted iterator is dropped
+    return depth - stack_effect(opcode, None)[0]
+
+
+def stack_depths(instructions):
+    """Stack depth before each instruction (None if unreachable), and the deepest stack"""
+    depths = [None] * (len(instructions) + 1)
+    depths[0] = 0
+    pending = [0]
+    while pending:
+        i = pending.pop()
+        depth = depths[i]
+        if i == len(instructions):
+            continue
+        opcode, operand = instructions[i]
+        successors = []
+        jump_operand = JUMP_OPERANDS.get(opcode)
+        if opcode == OpCode.MATCH:
+            # Falls into one of the branch table's JUMPs with the subject popped
+            successors.extend((i + 1 + k, depth - 1) for k in range(operand[1]))
+        elif jump_operand is not None:
+            target = operand[jump_operand] if isinstance(operand, tuple) else operand
+            successors.append((target, jump_depth(opcode, depth)))
+        if opcode not in (OpCode.JUMP, OpCode.RETURN_VALUE, OpCode.TAIL_CALL, OpCode.MATCH):
+            pops, pushes = stack_effect(opcode, operand)
+            successors.append((i + 1, depth - pops + pushes))
+        for successor, successor_depth in successors:
+            if depths[successor] is None:
+                depths[successor] = successor_depth
+                pending.append(successor)
+            elif depths[successor] != successor_depth:
+                raise ValueError(f"Inconsistent stack depth at instruction {successor}")
+    max_depth = max(depth for depth in depths if depth is not None)
+    return depths[:-1], max_depth
+
+
+class RegisterCode:
+    """Register form of a CodeObject.
+
+    Registers are laid out as the function's locals, then one temporary per
+    stack slot of the original bytecode, then the constants. Parameters are
+    the first locals, so a frame is the arguments followed by ``frame_tail``.
+    The last entry of a frame is the register file of the frame a closure was
+    declared in, like the locals of the stack VM's frames.
+    """
+    __slots__ = ['code_obj', 'instructions', 'num_registers', 'frame_tail', 'makes_closures', 'threaded']
+
+    def __init__(self, code_obj, instructions, num_temps, makes_closures=False):
+        self.code_obj = code_obj
+        self.instructions = instructions
+        self.num_registers = code_obj.num_locals + num_temps + len(code_obj.constants)
+        num_others = code_obj.num_locals - len(code_obj.params) + num_temps
+        self.frame_tail = [None] * num_others + list(code_obj.constants) + [None]
+        # Closures made by this code keep its register file, so it can't be reused by a tail call
+        self.makes_closures = makes_closures
+        # (handler, operand) pairs built by RegisterVM.thread_registers on first execution
+        self.threaded = None
+
+    def __len__(self):
+        return len(self.instructions)
+
+
+class RegisterAllocator:
+    """Translate one code object's stack bytecode into register instructions.
+
+    Stack slot k lives in register num_locals + k. Loads of locals and
+    constants don't emit anything: the abstract stack just remembers which
+    register holds the value, and the instruction that consumes it reads that
+    register directly. A STORE_FAST right after the instruction computing the
+    value retargets that instruction's result register. At jumps and jump
+    targets every slot is moved to its own register so that all paths agree.
+    """
+
+    def __init__(self, code_obj):
+        self.code_obj = code_obj
+        self.stack_instructions = []
+        index_of = {}
+        for index, (offset, opcode, operand) in enumerate(code_obj.instructions()):
+            index_of[offset] = index
+            self.stack_instructions.append((opcode, operand))
+        index_of[len(code_obj.code)] = len(self.stack_instructions)
+        # Jump operands are word offsets in the encoded code; use instruction indices instead
+        for index, (opcode, operand) in enumerate(self.stack_instructions):
+            jump_operand = JUMP_OPERANDS.get(opcode)
+            if jump_operand is None:
+                continue
+            if isinstance(operand, tuple):
+                operand = list(operand)
+                operand[jump_operand] = index_of[operand[jump_operand]]
+                operand = tuple(operand)
+            else:
+                operand = index_of[operand]
+            self.stack_instructions[index] = (opcode, operand)
+
+        self.depths, self.num_temps = stack_depths(self.stack_instructions)
+        self.const_base = code_obj.num_locals + self.num_temps
+        # A call may let a closure change this code's locals, so stack slots can't just point at them
+        self.makes_closures = any(opcode == OpCode.MAKE_CLOSURE for opcode, _ in self.stack_instructions)
+        self.instructions = []
+        self.stack = None        # Register holding each stack slot, None after a terminator
+        self.last_result = None  # Index of the instruction that computed the top slot
+
+    def temp(self, depth):
+        return self.code_obj.num_locals + depth
+
+    def emit(self, op, *operands):
+        self.instructions.append((op, operands))
+
+    def push_result(self, op, *operands):
+        """Emit op with the next stack slot's register as its result"""
+        dst = self.temp(len(self.stack))
+        self.emit(op, dst, *operands)
+        self.stack.append(dst)
+        self.last_result = len(self.instructions) - 1
+
+    def pop(self, count=1):
+        if count == 0:
+            return ()
+        values = tuple(self.stack[-count:])
+        del self.stack[-count:]
+        return values
+
+    def materialize(self, register=None):
+        """Move stack slots into their own registers; only those holding register if given"""
+        for depth, held in enumerate(self.stack):
+            home = self.temp(depth)
+            if held != home and (register is None or held == register):
+                self.emit(RegOp.MOVE, home, held)
+                self.stack[depth] = home
+                self.last_result = None
+
+    def store(self, slot):
+        value = self.stack.pop()
+        if slot in self.stack:
+            # Slots still holding the old value must copy it before it's overwritten
+            self.materialize(slot)
+        last = self.last_result
+        if (last == len(self.instructions) - 1 and value == self.temp(len(self.stack))
+                and self.instructions[last][1][0] == value):
+            op, operands = self.instructions[last]
+            self.instructions[last] = (op, (slot,) + operands[1:])
+        elif value != slot:
+            self.emit(RegOp.MOVE, slot, value)
+        self.last_result = None
+
+    def translate(self):
+        targets = set()
+        for opcode, operand in self.stack_instructions:
+            jump_operand = JUMP_OPERANDS.get(opcode)
+            if jump_operand is not None:
+                targets.add(operand[jump_operand] if isinstance(operand, tuple) else operand)
+
+        index_map = {}
+        for index, (opcode, operand) in enumerate(self.stack_instructions):
+            depth = self.depths[index]
+            if depth is None:
+                continue  # Unreachable
+            if index in targets or self.stack is None:
+                if self.stack is not None:
+                    self.materialize()
+                self.stack = [self.temp(k) for k in range(depth)]
+                self.last_result = None
+            index_map[index] = len(self.instructions)
+            if opcode == OpCode.MATCH:
+                # Jump straight to where the branch table's JUMPs go
+                table, count = operand
+                entries = self.stack_instructions[index + 1:index + 1 + count]
+                operand = (table, tuple([target for _, target in entries]))
+            self.translate_instruction(opcode, operand)
+        index_map[len(self.stack_instructions)] = len(self.instructions)
+
+        instructions = []
+        for op, operands in self.instructions:
+            jump_operand = REG_JUMP_OPERANDS.get(op)
+            if op == RegOp.MATCH:
+                subject, table, targets = operands
+                operands = (subject, table, tuple([index_map[target] for target in targets]))
+            elif jump_operand is not None:
+                operands = list(operands)
+                operands[jump_operand] = index_map[operands[jump_operand]]
+                operands = tuple(operands)
+            instructions.append((op, operands))
+        return RegisterCode(self.code_obj, instructions, self.num_temps, self.makes_closures)
+
+    def translate_instruction(self, opcode, operand):
+        stack = self.stack
+        if opcode == OpCode.LOAD_FAST:
+            if self.makes_closures:
+                self.push_result(RegOp.MOVE, operand)
+            else:
+                stack.append(operand)
+        elif opcode == OpCode.LOAD_CONST:
+            stack.append(self.const_base + operand)
+        elif opcode == OpCode.STORE_FAST:
+            self.store(operand)
+        elif opcode == OpCode.LOAD_CONST_STORE_FAST:
+            const, slot = operand
+            stack.append(self.const_base + const)
+            self.store(slot)
+        elif opcode == OpCode.DUP_TOP:
+            stack.append(stack[-1])
+        elif opcode == OpCode.POP_TOP:
+            stack.pop()
+        elif opcode in BINARY_REG_OPS:
+            self.push_result(BINARY_REG_OPS[opcode], *self.pop(2))
+        elif opcode in UNARY_REG_OPS:
+            self.push_result(UNARY_REG_OPS[opcode], *self.pop())
+        elif opcode == OpCode.COMPARE_OP:
+            self.push_result(RegOp.COMPARE, operand, *self.pop(2))
+        elif opcode == OpCode.BINARY_ADD_FAST_FAST:
+            self.push_result(RegOp.ADD, *operand)
+        elif opcode == OpCode.BINARY_ADD_FAST_CONST:
+            slot, const = operand
+            self.push_result(RegOp.ADD, slot, self.const_base + const)
+        elif opcode == OpCode.BINARY_SUBTRACT_FAST_CONST:
+            slot, const = operand
+            self.push_result(RegOp.SUBTRACT, slot, self.const_base + const)
+        elif opcode in (OpCode.LOAD_NAME, OpCode.LOAD_GLOBAL):
+            self.push_result(RegOp.LOAD_GLOBAL, operand)
+        elif opcode in (OpCode.STORE_NAME, OpCode.STORE_GLOBAL):
+            self.emit(RegOp.STORE_GLOBAL, operand, stack.pop())
+        elif opcode == OpCode.LOAD_DEREF:
+            self.push_result(RegOp.LOAD_DEREF, *operand)
+        elif opcode == OpCode.STORE_DEREF:
+            self.emit(RegOp.STORE_DEREF, *operand, stack.pop())
+        elif opcode == OpCode.MAKE_CLOSURE:
+            self.push_result(RegOp.MAKE_CLOSURE, operand)
+        elif opcode == OpCode.SAVE_NAME:
+            self.push_result(RegOp.SAVE_GLOBAL, operand)
+        elif opcode == OpCode.RESTORE_NAME:
+            self.emit(RegOp.RESTORE_GLOBAL, operand, stack.pop())
+        elif opcode == OpCode.STORE_SUBSCR:
+            self.emit(RegOp.STORE_SUBSCR, *self.pop(3))
+        elif opcode == OpCode.PRINT:
+            self.emit(RegOp.PRINT, self.pop(operand))
+        elif opcode == OpCode.BUILD_LIST:
+            self.push_result(RegOp.BUILD_LIST, self.pop(operand))
+        elif opcode == OpCode.BUILD_TUPLE:
+            self.push_result(RegOp.BUILD_TUPLE, self.pop(operand))
+        elif opcode == OpCode.BUILD_MAP:
+            self.push_result(RegOp.BUILD_MAP, self.pop(2 * operand))
+        elif opcode == OpCode.REDUCE_FUNCTION:
+            initial = stack.pop() if operand else None
+            function, iterable = self.pop(2)
+            self.push_result(RegOp.REDUCE_FUNCTION, function, iterable, initial)
+        elif opcode == OpCode.CALL_FUNCTION:
+            args = self.pop(operand)
+            self.push_result(RegOp.CALL, stack.pop(), args)
+        elif opcode == OpCode.CALL_BUILTIN:
+            index, argc = operand
+            self.push_result(RegOp.CALL_BUILTIN, index, self.pop(argc))
+        elif opcode == OpCode.TAIL_CALL:
+            args = self.pop(operand)
+            self.emit(RegOp.TAIL_CALL, stack.pop(), args)
+            self.stack = None
+        elif opcode == OpCode.RETURN_VALUE:
+            self.emit(RegOp.RETURN, stack.pop())
+            self.stack = None
+        elif opcode == OpCode.JUMP:
+            self.materialize()
+            self.emit(RegOp.JUMP, operand)
+            self.stack = None
+        elif opcode == OpCode.JUMP_IF_FALSE:
+            condition = stack.pop()
+            self.materialize()
+            self.emit(RegOp.JUMP_IF_FALSE, condition, operand)
+        elif opcode == OpCode.COMPARE_JUMP_IF_FALSE:
+            compare_op, target = operand
+            left, right = self.pop(2)
+            self.materialize()
+            self.emit(RegOp.COMPARE_JUMP_IF_FALSE, compare_op, left, right, target)
+        elif opcode == OpCode.FOR_ITER:
+            self.materialize()
+            self.push_result(RegOp.FOR_ITER, stack[-1], operand)
+        elif opcode == OpCode.MATCH:
+            table, targets = operand
+            subject = stack.pop()
+            self.materialize()
+            self.emit(RegOp.MATCH, subject, table, targets)
+        else:
+            raise ValueError(f"Cannot translate {OpCode(opcode).name} to register code")
+
+
+def to_register_code(code_obj):
+    """Register form of a CodeObject's bytecode"""
+    return RegisterAllocator(code_obj).translate()
@@ -0,0 +1,116 @@
+from .parser import (ASTNode, VariableAccessNode, AssignmentNode, VariableDeclarationNode,
+                     MutableDeclarationNode, ImmutableDeclarationNode, AssignmentExpressionNode,
+                     ForNode, ReceiveStatementNode, ChannelDeclarationNode, FunctionCallNode,
+                     FunctionDeclarationNode, AsyncFunctionDeclarationNode,
+                     GenericFunctionDeclarationNode)
+
+# Function declarations open a new scope of slot-indexed locals
+FUNCTION_NODES = (FunctionDeclarationNode, AsyncFunctionDeclarationNode, GenericFunctionDeclarationNode)
+
+# Nodes that bind a variable, and the attribute holding its name
+BINDING_ATTRIBUTES = {
+    AssignmentNode: 'identifier',
+    VariableDeclarationNode: 'identifier',
+    MutableDeclarationNode: 'identifier',
+    ImmutableDeclarationNode: 'identifier',
+    AssignmentExpressionNode: 'identifier',
+    ChannelDeclarationNode: 'identifier',
+    ForNode: 'target',
+    ReceiveStatementNode: 'variable',
+}
+
+# Nodes that declare a variable in the innermost function, and the attribute holding its name.
+# Plain assignment is not one of them: it updates the variable a name already resolves to.
+DECLARATION_ATTRIBUTES = dict(BINDING_ATTRIBUTES)
+del DECLARATION_ATTRIBUTES[AssignmentNode]
+
+# Nodes that refer to a variable by name, and the attribute holding it
+NAME_ATTRIBUTES = dict(BINDING_ATTRIBUTES)
+NAME_ATTRIBUTES[VariableAccessNode] = 'identifier'
+NAME_ATTRIBUTES[FunctionCallNode] = 'name'
+
+
+def function_locals(node):
+    """Names of a function's locals in slot order: parameters, then the names its body declares"""
+    scope = {}
+    for param in node.params:
+        scope.setdefault(param, len(scope))
+    _collect_bindings(node.body, scope)
+    return list(scope)
+
+
+def _collect_bindings(node, scope):
+    # A nested function's name is a local; its body declares its own
+    if isinstance(node, FUNCTION_NODES):
+        scope.setdefault(node.name, len(scope))
+        return
+    attribute = DECLARATION_ATTRIBUTES.get(type(node))
+    if attribute is not None:
+        scope.setdefault(getattr(node, attribute), len(scope))
+    for child in child_nodes(node):
+        _collect_bindings(child, scope)
+
+
+def child_nodes(node):
+    """Yield the AST nodes directly below node"""
+    for value in vars(node).values():
+        if isinstance(value, ASTNode):
+            yield value
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, ASTNode):
+                    yield item
+
+
+class Resolver:
+    """Gives every variable reference a (depth, slot) pair, or marks it global.
+
+    Parameters take a function's first slots, followed by every name its
+    body declares: with let, mut, const, :=, a for loop, a channel or a
+    nested function. Plain assignment declares nothing. A name is looked up
+    in the innermost function declaring it: ``slot`` is its index in that
+    function's locals and ``depth`` how many functions out that is, 0 being
+    the current one. Names that no enclosing function declares are globals,
+    with ``slot`` None. Function declarations get ``num_locals`` and
+    ``local_names``, and are resolved by their own name like a variable.
+    """
+
+    def resolve(self, node):
+        if isinstance(node, list):
+            for statement in node:
+                self._walk(statement, [])
+        else:
+            self._walk(node, [])
+        return node
+
+    def _walk(self, node, scopes):
+        if isinstance(node, FUNCTION_NODES):
+            self._resolve_name(node, node.name, scopes)
+            self._resolve_function(node, scopes)
+            return
+
+        attribute = NAME_ATTRIBUTES.get(type(node))
+        if attribute is not None:
+            self._resolve_name(node, getattr(node, attribute), scopes)
+
+        for child in child_nodes(node):
+            self._walk(child, scopes)
+
+    def _resolve_name(self, node, name, scopes):
+        # Innermost scope first
+        for depth in range(len(scopes)):
+            slot = scopes[-1 - depth].get(name)
+            if slot is not None:
+                node.slot = slot
+                node.depth = depth
+                return
+        node.slot = None
+        node.depth = 0
+
+    def _resolve_function(self, node, scopes):
+        local_names = function_locals(node)
+        node.num_locals = len(local_names)
+        node.local_names = local_names
+
+        scope = {name: index for index, name in enumerate(local_names)}
+        self._walk(node.body, scopes + [scope])
@@ -1,8 +1,10 @@
-from .bytecode import OpCode, CompareOp
+from .bytecode import OpCode, CompareOp, CodeObject, Closure, JUMP_OPERANDS
 from . import builtins
 from .profiler import global_profiler, profile_block
 import time
 from functools import lru_cache
+from itertools import count
+import operator
 
 # Import AST nodes
 from .parser import (
@@ -13,26 +15,79 @@ from .parser import (
     ListNode, IndexAccessNode, IndexAssignmentNode, UnaryOpNode,
     AsyncFunctionDeclarationNode, AwaitExpressionNode, SpawnExpressionNode,
     ChannelDeclarationNode, SendStatementNode, ReceiveStatementNode,
-    LambdaExpressionNode, MapFunctionNode, FilterFunctionNode, ReduceFunctionNode
+    LambdaExpressionNode, MapFunctionNode, FilterFunctionNode, ReduceFunctionNode,
+    PipelineNode, ASTNode
 )
 from .lexer import TokenType
+from .resolver import Resolver
+from .memo import memo_cache
+from .patterns import MatchTable
+
+# Comparison implementations indexed by CompareOp
+COMPARE_FUNCTIONS = {
+    CompareOp.LESS_THAN: operator.lt,
+    CompareOp.LESS_EQUAL: operator.le,
+    CompareOp.EQUAL: operator.eq,
+    CompareOp.NOT_EQUAL: operator.ne,
+    CompareOp.GREATER_THAN: operator.gt,
+    CompareOp.GREATER_EQUAL: operator.ge,
+    CompareOp.GREATER_THAN_OR_EQUAL: operator.ge,
+    CompareOp.LESS_THAN_OR_EQUAL: operator.le,
+}
+
+# Marks an exhausted iterator in FOR_ITER
+_EXHAUSTED = object()
+
+# Returned by statement visitors once a 'return' ran; the value is in VM._return_value
+_RETURN = object()
+
+# VM._return_value of a 'return f(...)'; the callee and arguments are in VM._tail_call
+_TAIL_CALL = object()
+
+# Values the AST walker calls as Flow functions
+FLOW_FUNCTIONS = (FunctionDeclarationNode, AsyncFunctionDeclarationNode, Closure)
+
+# Source of GlobalsTable versions; unique across tables so a cached version
+# can never match a different table
+_globals_versions = count()
+
+class GlobalsTable(dict):
+    """Global variables plus a version that changes on every STORE_NAME.
+
+    Inline caches in the threaded bytecode remember the version they were
+    filled at and are only trusted while it is unchanged.
+    """
+    __slots__ = ['version']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.version = next(_globals_versions)
 
 class Frame:
-    __slots__ = ['code_obj', 'ip', 'stack', 'locals', 'globals']
+    __slots__ = ['code_obj', 'ip', 'stack', 'locals', 'globals', 'return_value']
     
-    def __init__(self, code_obj, globals):
+    def __init__(self, code_obj, globals, parent=None):
         self.code_obj = code_obj
         self.ip = 0
         self.stack = []
-        self.locals = [None] * code_obj.get('num_locals', 0) # Initialize locals as a list
+        # Slot-indexed locals, then the locals of the frame a closure was declared in
+        self.locals = [None] * code_obj.num_locals + [parent]
         self.globals = globals
+        self.return_value = None
 
 class VM:
     def __init__(self):
         self.frames = []
-        self.globals = {}
+        self.globals = GlobalsTable()
+        # Slot-indexed locals of the Flow function the AST walker is executing
+        self.locals = None
+        # Value of the last executed 'return', paired with the _RETURN status
+        self._return_value = None
+        # (function, args) of a pending tail call, see visit_ReturnNode
+        self._tail_call = None
         # Pre-compile instruction handlers for better performance
         self._instruction_handlers = self._build_instruction_handlers()
+        self._compare_handlers, self._compare_jump_handlers = self._build_compare_handlers()
         self.profiler = global_profiler
         self._method_cache = {}  # Cache for visitor methods
         # Cache for parsed AST nodes to avoid re-parsing
@@ -49,9 +104,10 @@ class VM:
             OpCode.LOAD_CONST: self._handle_load_const,
             OpCode.STORE_NAME: self._handle_store_name,
             OpCode.LOAD_NAME: self._handle_load_name,
+            OpCode.LOAD_GLOBAL: self._handle_load_name,
             OpCode.LOAD_FAST: self._handle_load_fast,
             OpCode.STORE_FAST: self._handle_store_fast,
-            OpCode.BINARY_ADD: self._handle_binary_add,
+            OpCode.BINARY_ADD: self._handle_binary_add_adaptive,
             OpCode.BINARY_SUBTRACT: self._handle_binary_subtract,
             OpCode.BINARY_MULTIPLY: self._handle_binary_multiply,
             OpCode.BINARY_DIVIDE: self._handle_binary_divide,
@@ -60,11 +116,14 @@ class VM:
             OpCode.BINARY_AND: self._handle_binary_and,
             OpCode.BINARY_OR: self._handle_binary_or,
             OpCode.BINARY_XOR: self._handle_binary_xor,
+            OpCode.BINARY_LSHIFT: self._handle_binary_lshift,
+            OpCode.BINARY_RSHIFT: self._handle_binary_rshift,
             OpCode.PRINT: self._handle_print,
             OpCode.JUMP_IF_FALSE: self._handle_jump_if_false,
             OpCode.JUMP: self._handle_jump,
             OpCode.RETURN_VALUE: self._handle_return_value,
             OpCode.CALL_FUNCTION: self._handle_call_function,
+            OpCode.TAIL_CALL: self._handle_tail_call,
             OpCode.CALL_BUILTIN: self._handle_call_builtin,
             OpCode.COMPARE_OP: self._handle_compare_op,
             OpCode.UNARY_NEGATIVE: self._handle_unary_negative,
@@ -74,55 +133,165 @@ class VM:
             OpCode.SUBSCR: self._handle_subscr,
             OpCode.STORE_SUBSCR: self._handle_store_subscr,
             OpCode.DUP_TOP: self._handle_dup_top,
+            OpCode.POP_TOP: self._handle_pop_top,
+            OpCode.GET_ITER: self._handle_get_iter,
+            OpCode.FOR_ITER: self._handle_for_iter,
+            OpCode.BUILD_MAP: self._handle_build_map,
+            OpCode.MAP_FUNCTION: self._handle_map_function,
+            OpCode.FILTER_FUNCTION: self._handle_filter_function,
+            OpCode.REDUCE_FUNCTION: self._handle_reduce_function,
+            OpCode.MATCH: self._handle_match,
+            OpCode.LOAD_DEREF: self._handle_load_deref,
+            OpCode.STORE_DEREF: self._handle_store_deref,
+            OpCode.MAKE_CLOSURE: self._handle_make_closure,
+            OpCode.SAVE_NAME: self._handle_save_name,
+            OpCode.RESTORE_NAME: self._handle_restore_name,
+            # Superinstructions
+            OpCode.BINARY_ADD_FAST_FAST: self._handle_binary_add_fast_fast,
+            OpCode.BINARY_ADD_FAST_CONST: self._handle_binary_add_fast_const,
+            OpCode.BINARY_SUBTRACT_FAST_CONST: self._handle_binary_subtract_fast_const,
+            OpCode.COMPARE_JUMP_IF_FALSE: self._handle_compare_jump_if_false,
+            OpCode.LOAD_CONST_STORE_FAST: self._handle_load_const_store_fast,
         }
 
-    def run(self, bytecode, constants):
+    def run(self, bytecode, constants=None, num_locals=0):
         # For AST nodes, we'll directly interpret them
-        if hasattr(bytecode, '__iter__') and not isinstance(bytecode, (str, bytes)):
-            # This is a list of AST nodes
+        if isinstance(bytecode, list) and bytecode and isinstance(bytecode[0], ASTNode):
+            # This is a list of AST nodes; give function locals their slots first
+            Resolver().resolve(bytecode)
             for node in bytecode:
-                self.visit(node)
+                # A top-level 'return' ends the program
+                if self.visit(node) is _RETURN:
+                    break
         else:
-            # Original bytecode execution
-            code_obj = {'bytecode': bytecode, 'constants': constants, 'params': [], 'num_locals': 0}
+            # Bytecode execution of a compiled top-level program
+            if isinstance(bytecode, CodeObject):
+                code_obj = bytecode
+            else:
+                code_obj = CodeObject.from_instructions('<program>', bytecode, constants, num_locals=num_locals)
             frame = Frame(code_obj, self.globals)
             self.frames.append(frame)
-            return self.execute_frame(frame)
+            try:
+                return self.execute_frame(frame)
+            finally:
+                self.frames.pop()
+
+    def _build_compare_handlers(self):
+        """Handlers for COMPARE_OP and COMPARE_JUMP_IF_FALSE specialized by comparison operator"""
+        compare = {
+            CompareOp.LESS_THAN: self._handle_compare_lt,
+            CompareOp.LESS_EQUAL: self._handle_compare_le,
+            CompareOp.EQUAL: self._handle_compare_eq,
+            CompareOp.NOT_EQUAL: self._handle_compare_ne,
+            CompareOp.GREATER_THAN: self._handle_compare_gt,
+            CompareOp.GREATER_EQUAL: self._handle_compare_ge,
+            CompareOp.GREATER_THAN_OR_EQUAL: self._handle_compare_ge,
+            CompareOp.LESS_THAN_OR_EQUAL: self._handle_compare_le,
+        }
+        compare_jump = {
+            CompareOp.LESS_THAN: self._handle_compare_lt_jump_if_false,
+            CompareOp.LESS_EQUAL: self._handle_compare_le_jump_if_false,
+            CompareOp.EQUAL: self._handle_compare_eq_jump_if_false,
+            CompareOp.NOT_EQUAL: self._handle_compare_ne_jump_if_false,
+            CompareOp.GREATER_THAN: self._handle_compare_gt_jump_if_false,
+            CompareOp.GREATER_EQUAL: self._handle_compare_ge_jump_if_false,
+            CompareOp.GREATER_THAN_OR_EQUAL: self._handle_compare_ge_jump_if_false,
+            CompareOp.LESS_THAN_OR_EQUAL: self._handle_compare_le_jump_if_false,
+        }
+        return compare, compare_jump
+
+    def thread_code(self, code_obj):
+        """Decode a code object once into a list of (handler, operand) pairs.
+
+        Handlers are the plain functions behind the VM's _handle_* methods, so
+        the threaded form can be shared by every VM. Jump operands are turned
+        from word offsets into indices of the threaded list, and name loads
+        and calls get a mutable inline cache as their operand.
+
+        Instructions are also specialized on what is known once the code
+        object exists: comparisons get one handler per operator, and fused
+        local/constant arithmetic gets the constant's value as its operand.
+        BINARY_ADD is quickened while the code runs instead: see
+        _handle_binary_add_adaptive.
+        """
+        instructions = code_obj.instructions()
+        index_of = {offset: index for index, (offset, _, _) in enumerate(instructions)}
+        index_of[len(code_obj.code)] = len(instructions)
+
+        threaded = []
+        for index, (offset, opcode, operand) in enumerate(instructions):
+            handler = self._instruction_handlers.get(opcode)
+            if handler is None:
+                raise Exception(f"Unknown opcode: {opcode}")
+            jump_operand = JUMP_OPERANDS.get(opcode)
+            if jump_operand is not None:
+                if isinstance(operand, tuple):
+                    operand = list(operand)
+                    operand[jump_operand] = index_of[operand[jump_operand]]
+                    operand = tuple(operand)
+                else:
+                    operand = index_of[operand]
+            elif opcode == OpCode.LOAD_NAME or opcode == OpCode.LOAD_GLOBAL:
+                # [name, globals version, value]
+                operand = [code_obj.constants[operand], None, None]
+            elif opcode == OpCode.CALL_BUILTIN:
+                # (function, argument count)
+                operand = (builtins.BUILTIN_TABLE[operand[0]], operand[1])
+            elif opcode == OpCode.CALL_FUNCTION or opcode == OpCode.TAIL_CALL:
+                # [argument count, last callee seen]
+                operand = [operand, None]
+            elif opcode == OpCode.MATCH:
+                # (table, case targets): jump past the branch table straight to the case
+                table, count = operand
+                entries = instructions[index + 1:index + 1 + count]
+                operand = (code_obj.constants[table], tuple([index_of[target] for _, _, target in entries]))
+
+            if opcode == OpCode.COMPARE_OP:
+                handler = self._compare_handlers[operand]
+            elif opcode == OpCode.COMPARE_JUMP_IF_FALSE:
+                # Only the (already remapped) target is left in the operand
+                handler = self._compare_jump_handlers[operand[0]]
+                operand = operand[1]
+            elif opcode == OpCode.BINARY_ADD_FAST_CONST or opcode == OpCode.BINARY_SUBTRACT_FAST_CONST:
+                # (slot, constant value)
+                operand = (operand[0], code_obj.constants[operand[1]])
+            threaded.append((handler.__func__, operand))
+        code_obj.threaded = threaded
+        return threaded
 
     def execute_frame(self, frame):
-        bytecode = frame.code_obj['bytecode']
-        constants = frame.code_obj['constants']
-        bytecode_len = len(bytecode)
-        
         # Profile the execution if profiler is active
         start_time = None
         if self.profiler.start_time is not None:
             start_time = time.time()
-            
-        while frame.ip < bytecode_len:
-            instruction = bytecode[frame.ip]
-            opcode = instruction[0]
-            operand = instruction[1] if len(instruction) > 1 else None
-            frame.ip += 1
 
-            # Use dispatch table for better performance
-            handler = self._instruction_handlers.get(opcode)
-            if handler:
-                handler(frame, operand, constants)
-            else:
-                raise Exception(f"Unknown opcode: {opcode}")
+        code_obj = frame.code_obj
+        while True:
+            constants = code_obj.constants
+            threaded = code_obj.threaded
+            if threaded is None:
+                threaded = self.thread_code(code_obj)
+            code_len = len(threaded)
+
+            while frame.ip < code_len:
+                handler, operand = threaded[frame.ip]
+                frame.ip += 1
+                handler(self, frame, operand, constants)
+
+            if frame.code_obj is code_obj:
+                break
+            # A tail call switched the frame to another function's code
+            code_obj = frame.code_obj
+            frame.ip = 0
         
         # Record execution time if profiler is active
         if start_time is not None and self.profiler.start_time is not None:
             elapsed_time = time.time() - start_time
             # Try to get function name for more meaningful profiling
-            func_name = "unknown_function"
-            if 'constants' in frame.code_obj and len(frame.code_obj['constants']) > 0:
-                # This is a heuristic - in real implementation we'd need better tracking
-                func_name = f"function_at_ip_{frame.ip}"
+            func_name = frame.code_obj.name
             self.profiler.record_function_time(func_name, elapsed_time)
         
-        return None
+        return frame.return_value
 
     def visit(self, node):
         # Use cached method lookup for better performance
@@ -139,7 +308,8 @@ class VM:
 
     def visit_ProgramNode(self, node):
         for statement in node.statements:
-            self.visit(statement)
+            if self.visit(statement) is _RETURN:
+                break
 
     def visit_PrintNode(self, node):
         values = []
@@ -206,11 +376,32 @@ class VM:
         else:
             raise Exception(f"Unsupported binary operation: {op}")
 
+    def enclosing_locals(self, depth):
+        """Locals of the function depth levels out from the running one"""
+        scope = self.locals
+        for _ in range(depth):
+            # A frame's locals end with those of the frame enclosing it
+            scope = scope[-1]
+        return scope
+
+    def store_variable(self, node, name, value):
+        """Store into the node's resolved slot for locals, or into globals"""
+        if node.slot is None:
+            self.globals[name] = value
+        elif node.depth:
+            self.enclosing_locals(node.depth)[node.slot] = value
+        else:
+            self.locals[node.slot] = value
+
     def visit_VariableDeclarationNode(self, node):
         value = self.visit(node.value)
-        self.globals[node.identifier] = value
+        self.store_variable(node, node.identifier, value)
 
     def visit_VariableAccessNode(self, node):
+        if node.slot is not None:
+            if node.depth:
+                return self.enclosing_locals(node.depth)[node.slot]
+            return self.locals[node.slot]
         if node.identifier in self.globals:
             return self.globals[node.identifier]
         else:
@@ -218,35 +409,45 @@ class VM:
 
     def visit_AssignmentNode(self, node):
         value = self.visit(node.value)
-        self.globals[node.identifier] = value
+        self.store_variable(node, node.identifier, value)
 
     def visit_IfNode(self, node):
         condition = self.visit(node.condition)
         if condition:
-            self.visit(node.if_block)
+            return self.visit(node.if_block)
         elif node.else_block:
-            self.visit(node.else_block)
+            return self.visit(node.else_block)
 
     def visit_WhileNode(self, node):
         # Optimize while loops by caching condition evaluation when possible
         while self.visit(node.condition):
-            self.visit(node.block)
+            if self.visit(node.block) is _RETURN:
+                return _RETURN
 
     def visit_ForNode(self, node):
         """Handle for loops like 'for item in iterable { ... }'"""
         iterable = self.visit(node.iterable)
         
         # Check if iterable is a list
-        if isinstance(iterable, list):
+        if isinstance(iterable, list) and node.slot is not None:
+            # Function-local loop variable lives in the frame
+            for item in iterable:
+                self.locals[node.slot] = item
+                if self.visit(node.block) is _RETURN:
+                    return _RETURN
+        elif isinstance(iterable, list):
             # Save the current value of the target variable if it exists
             old_value = self.globals.get(node.target, None)
             
             # Iterate over the list
+            status = None
             for item in iterable:
                 # Set the target variable to the current item
                 self.globals[node.target] = item
                 # Execute the block
-                self.visit(node.block)
+                if self.visit(node.block) is _RETURN:
+                    status = _RETURN
+                    break
                 
             # Restore the old value of the target variable
             if old_value is not None:
@@ -255,28 +456,25 @@ class VM:
                 # Remove the target variable if it didn't exist before
                 if node.target in self.globals:
                     del self.globals[node.target]
+            return status
         else:
             raise Exception(f"Cannot iterate over {type(iterable).__name__}")
 
     def visit_MatchNode(self, node):
         """Handle match statements"""
-        # Evaluate the expression to match against
-        expression_value = self.visit(node.expression)
-        
-        # Try to match against each case
-        for case in node.cases:
-            # For simplicity, we'll do exact value matching
-            # In a more sophisticated implementation, we'd support pattern matching
-            pattern_value = self.visit(case.pattern)
-            
-            if expression_value == pattern_value:
-                # Execute the matching case block
-                self.visit(case.block)
-                return
-                
+        # The patterns are turned into a lookup table once, on first execution
+        table = node.table
+        if table is None:
+            table = node.table = MatchTable([self.visit(case.pattern) for case in node.cases])
+
+        index = table.find(self.visit(node.expression))
+        if index < table.default:
+            # Execute the matching case block
+            return self.visit(node.cases[index].block)
+
         # If no case matched and there's a default case, execute it
         if node.default_case:
-            self.visit(node.default_case)
+            return self.visit(node.default_case)
 
     def visit_ExternFunctionDeclarationNode(self, node):
         """Handle extern function declarations"""
@@ -288,45 +486,49 @@ class VM:
         """Handle assignment expressions (walrus operator)"""
         # Evaluate the value
         value = self.visit(node.value)
-        # Store it in the globals
-        self.globals[node.identifier] = value
+        self.store_variable(node, node.identifier, value)
         # Return the value (assignment expressions evaluate to the assigned value)
         return value
 
+    def declare_function(self, node):
+        if self.locals is None:
+            # Store the function definition in globals
+            self.globals[node.name] = node
+        else:
+            # A nested function is a local, and sees the locals of the call that declared it
+            self.locals[node.slot] = Closure(node, self.locals)
+
     def visit_FunctionDeclarationNode(self, node):
-        # Store the function definition in globals
-        self.globals[node.name] = node
+        self.declare_function(node)
+
+    def flow_function_for_call(self, node):
+        """The Flow function a call node names, or None if it isn't one"""
+        # Functions passed as arguments live in the caller's frame
+        if node.slot is not None:
+            func_def = self.enclosing_locals(node.depth)[node.slot]
+            if not isinstance(func_def, FLOW_FUNCTIONS):
+                raise TypeError(f"'{node.name}' is not a function")
+            return func_def
+
+        func_def = self.globals.get(node.name)
+        # Handle both regular and async functions the same way for now
+        if isinstance(func_def, FLOW_FUNCTIONS):
+            return func_def
+        return None
 
     def visit_FunctionCallNode(self, node):
-        # Check if this is an async function call
-        if node.name in self.globals:
-            func_def = self.globals[node.name]
-            # Handle both regular and async functions the same way for now
-            if isinstance(func_def, (FunctionDeclarationNode, AsyncFunctionDeclarationNode)):
-                # Evaluate arguments
-                args = [self.visit(arg) for arg in node.args]
-                
-                # Create new frame for function execution
-                # For simplicity, we'll just add the arguments to globals
-                # A full implementation would use proper scoping
-                old_globals = self.globals.copy()
-                for i, param in enumerate(func_def.params):
-                    if i < len(args):
-                        self.globals[param] = args[i]
-                    else:
-                        self.globals[param] = None
-                        
-                # Execute function body
-                result = None
-                try:
-                    self.visit(func_def.body)
-                except ReturnException as e:
-                    result = e.value
-                    
-                # Restore globals
-                self.globals = old_globals
-                return result
-        
+        if node.slot is None:
+            # Global functions are the common case; skip the helper call
+            func_def = self.globals.get(node.name)
+            if not isinstance(func_def, FLOW_FUNCTIONS):
+                func_def = None
+        else:
+            func_def = self.flow_function_for_call(node)
+        if func_def is not None:
+            # Evaluate arguments
+            args = [self.visit(arg) for arg in node.args]
+            return self.call_flow_function(func_def, args)
+
         # Check if this is an extern function call
         extern_key = f"_extern_{node.name}"
         if extern_key in self.globals and isinstance(self.globals[extern_key], ExternFunctionDeclarationNode):
@@ -345,48 +547,74 @@ class VM:
         if node.name not in self.globals:
             raise NameError(f"Function '{node.name}' is not defined")
             
-        func_def = self.globals[node.name]
-        if not isinstance(func_def, FunctionDeclarationNode):
-            raise TypeError(f"'{node.name}' is not a function")
-            
-        # Evaluate arguments
-        args = [self.visit(arg) for arg in node.args]
-        
-        # Create new frame for function execution
-        # For simplicity, we'll just add the arguments to globals
-        # A full implementation would use proper scoping
-        old_globals = self.globals.copy()
-        for i, param in enumerate(func_def.params):
-            if i < len(args):
-                self.globals[param] = args[i]
-            else:
-                self.globals[param] = None
-                
-        # Execute function body
+        raise TypeError(f"'{node.name}' is not a function")
+
+    def call_flow_function(self, function, args, use_memo=True):
+        """Execute a Flow function or closure in a new frame of slot-indexed locals"""
+        if use_memo and function.memo is not None:
+            return function.memo.call(lambda args: self.call_flow_function(function, args, False), args)
+        caller_locals = self.locals
         result = None
         try:
-            self.visit(func_def.body)
-        except ReturnException as e:
-            result = e.value
-            
-        # Restore globals
-        self.globals = old_globals
+            while True:
+                if type(function) is Closure:
+                    func_def = function.function
+                    parent = function.parent
+                else:
+                    func_def = function
+                    parent = None
+                if not hasattr(func_def, 'num_locals'):
+                    # Declarations built outside VM.run haven't been resolved yet
+                    Resolver().resolve(func_def)
+                # Parameters occupy the first slots, the enclosing frame's locals the last
+                frame_locals = [None] * (func_def.num_locals + 1)
+                for i in range(min(len(args), len(func_def.params))):
+                    frame_locals[i] = args[i]
+                frame_locals[-1] = parent
+                self.locals = frame_locals
+
+                if self.visit(func_def.body) is not _RETURN:
+                    break
+                result = self._return_value
+                if result is not _TAIL_CALL:
+                    break
+                # 'return g(...)': run g here instead of nesting another Python call
+                function, args = self._tail_call
+                self._tail_call = None
+                result = None
+        finally:
+            self.locals = caller_locals
         return result
 
     def visit_ReturnNode(self, node):
-        value = self.visit(node.value)
-        raise ReturnException(value)
+        value = node.value
+        # Inside a function, 'return f(...)' is handed to call_flow_function as a tail call
+        if self.locals is not None and type(value) is FunctionCallNode:
+            func_def = self.flow_function_for_call(value)
+            # Memoized callees run as normal calls so that they go through their cache
+            if func_def is not None and func_def.memo is None:
+                self._tail_call = (func_def, [self.visit(arg) for arg in value.args])
+                self._return_value = _TAIL_CALL
+                return _RETURN
+        # Hand the value back through the block executor rather than raising
+        self._return_value = self.visit(value)
+        return _RETURN
 
     def visit_BlockNode(self, node):
+        # Stop at the first statement that returned, and propagate the status
         for statement in node.statements:
-            self.visit(statement)
+            if self.visit(statement) is _RETURN:
+                return _RETURN
 
     def visit_BuiltinFunctionCallNode(self, node):
-        # Get the function from builtins module
-        func = getattr(builtins, node.name, None)
+        # Look the function up in the builtins module once per call site
+        func = node.function
         if func is None:
-            raise NameError(f"Built-in function '{node.name}' is not defined")
-            
+            func = getattr(builtins, node.name, None)
+            if func is None:
+                raise NameError(f"Built-in function '{node.name}' is not defined")
+            node.function = func
+
         # Evaluate arguments
         args = [self.visit(arg) for arg in node.args]
         
@@ -416,26 +644,10 @@ class VM:
         iterable = self.visit(node.iterable)
         
         # Check if func is a Flow function
-        if isinstance(func, FunctionDeclarationNode):
+        if isinstance(func, (FunctionDeclarationNode, Closure)):
             # Create a Python callable that wraps the Flow function
             def flow_func_wrapper(item):
-                # Save current globals
-                old_globals = self.globals.copy()
-                
-                # Set the parameter
-                if func.params:
-                    self.globals[func.params[0]] = item
-                
-                # Execute function body
-                result = None
-                try:
-                    self.visit(func.body)
-                except ReturnException as e:
-                    result = e.value
-                
-                # Restore globals
-                self.globals = old_globals
-                return result
+                return self.call_flow_function(func, [item])
             
             # Apply the function to each element
             return [flow_func_wrapper(item) for item in iterable]
@@ -451,26 +663,10 @@ class VM:
         iterable = self.visit(node.iterable)
         
         # Check if func is a Flow function
-        if isinstance(func, FunctionDeclarationNode):
+        if isinstance(func, (FunctionDeclarationNode, Closure)):
             # Create a Python callable that wraps the Flow function
             def flow_func_wrapper(item):
-                # Save current globals
-                old_globals = self.globals.copy()
-                
-                # Set the parameter
-                if func.params:
-                    self.globals[func.params[0]] = item
-                
-                # Execute function body
-                result = None
-                try:
-                    self.visit(func.body)
-                except ReturnException as e:
-                    result = e.value
-                
-                # Restore globals
-                self.globals = old_globals
-                return result
+                return self.call_flow_function(func, [item])
             
             # Filter the elements
             return [item for item in iterable if flow_func_wrapper(item)]
@@ -487,27 +683,10 @@ class VM:
         initial = self.visit(node.initial) if node.initial else None
         
         # Check if func is a Flow function
-        if isinstance(func, FunctionDeclarationNode):
+        if isinstance(func, (FunctionDeclarationNode, Closure)):
             # Create a Python callable that wraps the Flow function
             def flow_func_wrapper(acc, item):
-                # Save current globals
-                old_globals = self.globals.copy()
-                
-                # Set the parameters
-                if len(func.params) >= 2:
-                    self.globals[func.params[0]] = acc
-                    self.globals[func.params[1]] = item
-                
-                # Execute function body
-                result = None
-                try:
-                    self.visit(func.body)
-                except ReturnException as e:
-                    result = e.value
-                
-                # Restore globals
-                self.globals = old_globals
-                return result
+                return self.call_flow_function(func, [acc, item])
             
             # Reduce the elements
             if not iterable:
@@ -531,8 +710,8 @@ class VM:
 
     def visit_AsyncFunctionDeclarationNode(self, node):
         """Handle async function declarations"""
-        # Store the async function definition in globals
-        self.globals[node.name] = node
+        # Async functions are declared like regular ones for now
+        self.declare_function(node)
 
     def visit_AwaitExpressionNode(self, node):
         """Handle await expressions"""
@@ -551,7 +730,7 @@ class VM:
         # For now, we'll just create a placeholder
         # In a full implementation, we would create a proper channel
         channel = {"type": "channel", "data": []}
-        self.globals[node.identifier] = channel
+        self.store_variable(node, node.identifier, channel)
 
     def visit_SendStatementNode(self, node):
         """Handle send statements"""
@@ -568,7 +747,7 @@ class VM:
         channel_name = node.channel.identifier
         variable_name = node.variable
         print(f"Receiving from channel {channel_name} into {variable_name}")
-        self.globals[variable_name] = None  # Placeholder value
+        self.store_variable(node, variable_name, None)  # Placeholder value
 
     def visit_IndexAccessNode(self, node):
         """Handle index access like arr[0]"""
@@ -593,6 +772,28 @@ class VM:
         # Add more unary operations as needed
         raise Exception(f"Unsupported unary operation: {node.op}")
 
+    def visit_AnnotatedNode(self, node):
+        memo = memo_cache(node)
+        if memo is not None:
+            node.node.memo = memo
+        return self.visit(node.node)
+
+    def visit_PipelineNode(self, node):
+        # 'x |> f' calls f(x); 'x |> f(a, b)' calls f(x, a, b)
+        right = node.right
+        if isinstance(right, VariableAccessNode):
+            call = FunctionCallNode(right.identifier, [node.left])
+        elif isinstance(right, FunctionCallNode):
+            call = FunctionCallNode(right.name, [node.left] + right.args)
+        elif isinstance(right, BuiltinFunctionCallNode):
+            return self.visit(BuiltinFunctionCallNode(right.name, [node.left] + right.args))
+        else:
+            raise Exception(f"Cannot pipe into {type(right).__name__}")
+        # The new call refers to the same variable as the piped-into name
+        call.slot = right.slot
+        call.depth = right.depth
+        return self.visit(call)
+
     def visit_PatternNode(self, node):
         """Base pattern node - should not be instantiated directly"""
         raise Exception("PatternNode should not be visited directly")
@@ -619,20 +820,14 @@ class VM:
     def visit_ImmutableDeclarationNode(self, node):
         """Handle immutable variable declarations"""
         value = self.visit(node.value)
-        # Store in current scope or globals
-        if hasattr(self, '_current_scope'):
-            self._current_scope[node.identifier] = value
-        else:
-            self.globals[node.identifier] = value
+        # Store in the current frame or globals
+        self.store_variable(node, node.identifier, value)
 
     def visit_MutableDeclarationNode(self, node):
         """Handle mutable variable declarations"""
         value = self.visit(node.value)
-        # Store in current scope or globals
-        if hasattr(self, '_current_scope'):
-            self._current_scope[node.identifier] = value
-        else:
-            self.globals[node.identifier] = value
+        # Store in the current frame or globals
+        self.store_variable(node, node.identifier, value)
 
     # Bytecode execution handlers (kept for backward compatibility)
     def _handle_load_const(self, frame, operand, constants):
@@ -641,12 +836,36 @@ class VM:
     def _handle_store_name(self, frame, operand, constants):
         name = constants[operand]
         value = frame.stack.pop()
-        self.globals[name] = value
+        globals = frame.globals
+        globals[name] = value
+        # Invalidate every LOAD_NAME inline cache filled from this table
+        globals.version = next(_globals_versions)
 
-    def _handle_load_name(self, frame, operand, constants):
+    def _handle_save_name(self, frame, operand, constants):
+        frame.stack.append(frame.globals.get(constants[operand]))
+
+    def _handle_restore_name(self, frame, operand, constants):
         name = constants[operand]
-        if name in frame.globals:
-            frame.stack.append(frame.globals[name])
+        value = frame.stack.pop()
+        globals = frame.globals
+        if value is not None:
+            globals[name] = value
+        else:
+            globals.pop(name, None)
+        globals.version = next(_globals_versions)
+
+    def _handle_load_name(self, frame, cache, constants):
+        # cache is [name, globals version, value]; see thread_code
+        globals = frame.globals
+        if cache[1] == globals.version:
+            frame.stack.append(cache[2])
+            return
+        name = cache[0]
+        if name in globals:
+            value = globals[name]
+            cache[1] = globals.version
+            cache[2] = value
+            frame.stack.append(value)
         else:
             raise NameError(f"name '{name}' is not defined")
 
@@ -657,11 +876,72 @@ class VM:
         value = frame.stack.pop()
         frame.locals[operand] = value
 
+    def _handle_load_deref(self, frame, operand, constants):
+        depth, slot = operand
+        scope = frame.locals
+        for _ in range(depth):
+            # A frame's locals end with those of the frame enclosing it
+            scope = scope[-1]
+        frame.stack.append(scope[slot])
+
+    def _handle_store_deref(self, frame, operand, constants):
+        depth, slot = operand
+        scope = frame.locals
+        for _ in range(depth):
+            scope = scope[-1]
+        scope[slot] = frame.stack.pop()
+
+    def _handle_make_closure(self, frame, operand, constants):
+        # The nested function sees this call's locals
+        frame.stack.append(Closure(constants[operand], frame.locals))
+
     def _handle_binary_add(self, frame, operand, constants):
         right = frame.stack.pop()
         left = frame.stack.pop()
         frame.stack.append(left + right)
 
+    # BINARY_ADD starts out adaptive. Once it has seen two operands of the same
+    # type in QUICKENED_BINARY_ADD, it rewrites its threaded entry in place into
+    # the form for that type. That form guards on the operand types, and when
+    # the guard fails it deoptimizes its entry back to the generic handler for good.
+    def _handle_binary_add_adaptive(self, frame, operand, constants):
+        right = frame.stack.pop()
+        left = frame.stack.pop()
+        frame.stack.append(left + right)
+        kind = type(left)
+        if type(right) is kind:
+            quickened = QUICKENED_BINARY_ADD.get(kind)
+            if quickened is not None:
+                frame.code_obj.threaded[frame.ip - 1] = (quickened, operand)
+
+    def _deoptimize_binary_add(self, frame, operand):
+        frame.code_obj.threaded[frame.ip - 1] = (VM._handle_binary_add, operand)
+        self._handle_binary_add(frame, operand, None)
+
+    def _handle_binary_add_int(self, frame, operand, constants):
+        stack = frame.stack
+        if type(stack[-1]) is int and type(stack[-2]) is int:
+            right = stack.pop()
+            stack[-1] += right
+        else:
+            self._deoptimize_binary_add(frame, operand)
+
+    def _handle_binary_add_float(self, frame, operand, constants):
+        stack = frame.stack
+        if type(stack[-1]) is float and type(stack[-2]) is float:
+            right = stack.pop()
+            stack[-1] += right
+        else:
+            self._deoptimize_binary_add(frame, operand)
+
+    def _handle_binary_add_str(self, frame, operand, constants):
+        stack = frame.stack
+        if type(stack[-1]) is str and type(stack[-2]) is str:
+            right = stack.pop()
+            stack[-1] += right
+        else:
+            self._deoptimize_binary_add(frame, operand)
+
     def _handle_binary_subtract(self, frame, operand, constants):
         right = frame.stack.pop()
         left = frame.stack.pop()
@@ -702,6 +982,16 @@ class VM:
         left = frame.stack.pop()
         frame.stack.append(left ^ right)
 
+    def _handle_binary_lshift(self, frame, operand, constants):
+        right = frame.stack.pop()
+        left = frame.stack.pop()
+        frame.stack.append(left << right)
+
+    def _handle_binary_rshift(self, frame, operand, constants):
+        right = frame.stack.pop()
+        left = frame.stack.pop()
+        frame.stack.append(left >> right)
+
     def _handle_unary_negative(self, frame, operand, constants):
         value = frame.stack.pop()
         frame.stack.append(-value)
@@ -720,16 +1010,20 @@ class VM:
         index = frame.stack.pop()
         obj = frame.stack.pop()
         obj[index] = value
-        frame.stack.append(value)
 
     def _handle_dup_top(self, frame, operand, constants):
         # Duplicate the top item on the stack
         if frame.stack:
             frame.stack.append(frame.stack[-1])
 
+    def _handle_pop_top(self, frame, operand, constants):
+        frame.stack.pop()
+
     def _handle_print(self, frame, operand, constants):
-        value = frame.stack.pop()
-        print(value)
+        # Operand is the number of values printed on one line
+        values = frame.stack[-operand:]
+        del frame.stack[-operand:]
+        print(' '.join(str(value) for value in values))
 
     def _handle_jump_if_false(self, frame, operand, constants):
         condition = frame.stack.pop()
@@ -739,47 +1033,182 @@ class VM:
     def _handle_jump(self, frame, operand, constants):
         frame.ip = operand
 
-    def _handle_return_value(self, frame, operand, constants):
-        return frame.stack.pop()
+    def _handle_match(self, frame, operand, constants):
+        table, targets = operand
+        frame.ip = targets[table.find(frame.stack.pop())]
 
-    def _handle_call_function(self, frame, operand, constants):
-        num_args = operand
-        args = [frame.stack.pop() for _ in range(num_args)]
-        args.reverse()
-        func = frame.stack.pop()
+    def _handle_get_iter(self, frame, operand, constants):
+        iterable = frame.stack.pop()
+        # Only lists are iterable, like VM.visit_ForNode
+        if not isinstance(iterable, list):
+            raise Exception(f"Cannot iterate over {type(iterable).__name__}")
+        frame.stack.append(iter(iterable))
 
-        if isinstance(func, dict) and 'bytecode' in func:
+    def _handle_for_iter(self, frame, operand, constants):
+        # Push the next item, or drop the exhausted iterator and leave the loop
+        item = next(frame.stack[-1], _EXHAUSTED)
+        if item is _EXHAUSTED:
+            frame.stack.pop()
+            frame.ip = operand
+        else:
+            frame.stack.append(item)
+
+    def _handle_return_value(self, frame, operand, constants):
+        # Store the result and move the ip past the end so execute_frame exits
+        frame.return_value = frame.stack.pop()
+        frame.ip = len(frame.code_obj.threaded)
+
+    def _handle_call_function(self, frame, cache, constants):
+        # cache is [argument count, last callee]; a repeat callee skips the type check
+        num_args = cache[0]
+        stack = frame.stack
+        if num_args:
+            args = stack[-num_args:]
+            del stack[-num_args:]
+        else:
+            args = []
+        func = stack.pop()
+        if func is not cache[1]:
+            if not self._is_code_object(func):
+                raise TypeError(f"'{type(func).__name__}' object is not callable")
+            cache[1] = func
+        stack.append(self._call_code_object(func, args))
+
+    def _handle_tail_call(self, frame, cache, constants):
+        # Like CALL_FUNCTION followed by RETURN_VALUE, but the callee takes over this frame
+        num_args = cache[0]
+        stack = frame.stack
+        if num_args:
+            args = stack[-num_args:]
+            del stack[-num_args:]
+        else:
+            args = []
+        func = stack.pop()
+        if func is not cache[1]:
+            if not self._is_code_object(func):
+                raise TypeError(f"'{type(func).__name__}' object is not callable")
+            cache[1] = func
+        if func.memo is not None:
+            # Memoized functions must go through their cache, so call and return instead
+            frame.return_value = self._call_code_object(func, args)
+            frame.ip = len(frame.code_obj.threaded)
+            return
+        if type(func) is Closure:
+            parent = func.parent
+            func = func.function
+        else:
+            parent = None
+
+        # Parameters take the first slots, missing arguments are None
+        num_params = len(func.params)
+        if num_args != num_params:
+            args = args[:num_params] + [None] * (num_params - num_args)
+        if func.num_locals > num_params:
+            args.extend([None] * (func.num_locals - num_params))
+        args.append(parent)
+        frame.locals = args
+        # Drop anything the caller left behind, such as for-loop iterators
+        stack.clear()
+
+        if func is frame.code_obj:
+            frame.ip = 0
+        else:
+            # Leave the current code; execute_frame restarts at the callee's first instruction
+            frame.ip = len(frame.code_obj.threaded)
+            frame.code_obj = func
+
+    def call_function(self, func, args):
+        """Run a compiled Flow function in a new frame and return its result"""
+        if not self._is_code_object(func):
+            raise TypeError(f"'{type(func).__name__}' object is not callable")
+        return self._call_code_object(func, args)
+
+    def _call_code_object(self, func, args, use_memo=True):
+        if use_memo and func.memo is not None:
+            return func.memo.call(lambda args: self._call_code_object(func, args, False), args)
+        if type(func) is Closure:
+            new_frame = Frame(func.function, self.globals, func.parent)
+            func = func.function
+        else:
             new_frame = Frame(func, self.globals)
-            # Initialize locals for the new frame
-            new_frame.locals = [None] * func['num_locals']
-            # Assign parameters to locals using their indices
-            for i, param_name in enumerate(func['params']):
-                # The compiler ensures that parameters are assigned to local slots
-                # in the order they appear in func['params'].
-                # Therefore, the i-th parameter corresponds to the i-th local slot.
-                new_frame.locals[i] = args[i]
-            
-            # Push the new frame onto the call stack
-            self.frames.append(new_frame)
-            result = self.execute_frame(new_frame)
+        # Assign parameters to locals using their indices
+        for i, param_name in enumerate(func.params):
+            # The compiler ensures that parameters are assigned to local slots
+            # in the order they appear in func.params.
+            # Therefore, the i-th parameter corresponds to the i-th local slot.
+            new_frame.locals[i] = args[i] if i < len(args) else None
+
+        # Push the new frame onto the call stack
+        self.frames.append(new_frame)
+        try:
+            return self.execute_frame(new_frame)
+        finally:
             self.frames.pop()
-            frame.stack.append(result)
+
+    def _is_code_object(self, func):
+        return isinstance(func, (CodeObject, Closure))
+
+    def map_function(self, func, iterable):
+        if self._is_code_object(func):
+            return [self.call_function(func, [item]) for item in iterable]
+        # Same placeholder behaviour as VM.visit_MapFunctionNode
+        print(f"Mapping {func} over {iterable}")
+        return [item for item in iterable] if isinstance(iterable, list) else []
+
+    def filter_function(self, func, iterable):
+        if self._is_code_object(func):
+            return [item for item in iterable if self.call_function(func, [item])]
+        # Same placeholder behaviour as VM.visit_FilterFunctionNode
+        print(f"Filtering {iterable} with {func}")
+        return [item for item in iterable] if isinstance(iterable, list) else []
+
+    def reduce_function(self, func, iterable, initial=None):
+        if not self._is_code_object(func):
+            # Same placeholder behaviour as VM.visit_ReduceFunctionNode
+            print(f"Reducing {iterable} with {func}")
+            return initial if initial is not None else (iterable[0] if isinstance(iterable, list) and iterable else None)
+        if not iterable:
+            return initial
+
+        if initial is None:
+            result = iterable[0]
+            items = iterable[1:]
         else:
-            raise TypeError(f"'{type(func).__name__}' object is not callable")
+            result = initial
+            items = iterable
+
+        for item in items:
+            result = self.call_function(func, [result, item])
+        return result
+
+    def _handle_map_function(self, frame, operand, constants):
+        iterable = frame.stack.pop()
+        func = frame.stack.pop()
+        frame.stack.append(self.map_function(func, iterable))
+
+    def _handle_filter_function(self, frame, operand, constants):
+        iterable = frame.stack.pop()
+        func = frame.stack.pop()
+        frame.stack.append(self.filter_function(func, iterable))
+
+    def _handle_reduce_function(self, frame, operand, constants):
+        # Operand is 1 when an initial value was pushed
+        initial = frame.stack.pop() if operand else None
+        iterable = frame.stack.pop()
+        func = frame.stack.pop()
+        frame.stack.append(self.reduce_function(func, iterable, initial))
 
     def _handle_call_builtin(self, frame, operand, constants):
-        func_name = constants[operand]
-        num_args = frame.stack.pop()
-        args = [frame.stack.pop() for _ in range(num_args)]
-        args.reverse()
-
-        builtin_func = getattr(builtins, func_name, None)
-        if builtin_func:
-            result = builtin_func(*args)
-            if result is not None:
-                frame.stack.append(result)
+        # Operand was resolved to (function, argument count) by thread_code
+        func, num_args = operand
+        stack = frame.stack
+        # Always push the result so expression statements can POP_TOP it
+        if num_args:
+            args = stack[-num_args:]
+            del stack[-num_args:]
+            stack.append(func(*args))
         else:
-            raise Exception(f"Built-in function '{func_name}' not found")
+            stack.append(func())
 
     def _handle_build_list(self, frame, operand, constants):
         # Pop 'operand' elements from the stack and create a list
@@ -799,28 +1228,115 @@ class VM:
         elements.reverse()
         frame.stack.append(tuple(elements))
 
+    def _handle_build_map(self, frame, operand, constants):
+        # Pop 'operand' key/value pairs from the stack and create a dictionary
+        items = frame.stack[-2 * operand:] if operand else []
+        if operand:
+            del frame.stack[-2 * operand:]
+        frame.stack.append({items[i]: items[i + 1] for i in range(0, len(items), 2)})
+
     def _handle_compare_op(self, frame, operand, constants):
         right = frame.stack.pop()
         left = frame.stack.pop()
-        if operand == CompareOp.LESS_THAN:
-            frame.stack.append(left < right)
-        elif operand == CompareOp.LESS_EQUAL:
-            frame.stack.append(left <= right)
-        elif operand == CompareOp.EQUAL:
-            frame.stack.append(left == right)
-        elif operand == CompareOp.NOT_EQUAL:
-            frame.stack.append(left != right)
-        elif operand == CompareOp.GREATER_THAN:
-            frame.stack.append(left > right)
-        elif operand == CompareOp.GREATER_EQUAL:
-            frame.stack.append(left >= right)
-        elif operand == CompareOp.GREATER_THAN_OR_EQUAL:
-            frame.stack.append(left >= right)
-        elif operand == CompareOp.LESS_THAN_OR_EQUAL:
-            frame.stack.append(left <= right)
-
-# Exception for handling return statements
-class ReturnException(Exception):
-    def __init__(self, value):
-        self.value = value
-        super().__init__()
\ No newline at end of file
+        frame.stack.append(COMPARE_FUNCTIONS[operand](left, right))
+
+    # COMPARE_OP specialized by operator; see _build_compare_handlers
+    def _handle_compare_lt(self, frame, operand, constants):
+        stack = frame.stack
+        right = stack.pop()
+        stack[-1] = stack[-1] < right
+
+    def _handle_compare_le(self, frame, operand, constants):
+        stack = frame.stack
+        right = stack.pop()
+        stack[-1] = stack[-1] <= right
+
+    def _handle_compare_eq(self, frame, operand, constants):
+        stack = frame.stack
+        right = stack.pop()
+        stack[-1] = stack[-1] == right
+
+    def _handle_compare_ne(self, frame, operand, constants):
+        stack = frame.stack
+        right = stack.pop()
+        stack[-1] = stack[-1] != right
+
+    def _handle_compare_gt(self, frame, operand, constants):
+        stack = frame.stack
+        right = stack.pop()
+        stack[-1] = stack[-1] > right
+
+    def _handle_compare_ge(self, frame, operand, constants):
+        stack = frame.stack
+        right = stack.pop()
+        stack[-1] = stack[-1] >= right
+
+    # Superinstruction handlers; operands are tuples built by peephole.fuse
+    def _handle_binary_add_fast_fast(self, frame, operand, constants):
+        left_slot, right_slot = operand
+        frame.stack.append(frame.locals[left_slot] + frame.locals[right_slot])
+
+    def _handle_binary_add_fast_const(self, frame, operand, constants):
+        # thread_code replaced the constant index with its value
+        slot, value = operand
+        frame.stack.append(frame.locals[slot] + value)
+
+    def _handle_binary_subtract_fast_const(self, frame, operand, constants):
+        slot, value = operand
+        frame.stack.append(frame.locals[slot] - value)
+
+    def _handle_compare_jump_if_false(self, frame, operand, constants):
+        compare_op, target = operand
+        right = frame.stack.pop()
+        left = frame.stack.pop()
+        if not COMPARE_FUNCTIONS[compare_op](left, right):
+            frame.ip = target
+
+    # COMPARE_JUMP_IF_FALSE specialized by operator; the operand is just the target
+    def _handle_compare_lt_jump_if_false(self, frame, target, constants):
+        stack = frame.stack
+        right = stack.pop()
+        if not stack.pop() < right:
+            frame.ip = target
+
+    def _handle_compare_le_jump_if_false(self, frame, target, constants):
+        stack = frame.stack
+        right = stack.pop()
+        if not stack.pop() <= right:
+            frame.ip = target
+
+    def _handle_compare_eq_jump_if_false(self, frame, target, constants):
+        stack = frame.stack
+        right = stack.pop()
+        if not stack.pop() == right:
+            frame.ip = target
+
+    def _handle_compare_ne_jump_if_false(self, frame, target, constants):
+        stack = frame.stack
+        right = stack.pop()
+        if not stack.pop() != right:
+            frame.ip = target
+
+    def _handle_compare_gt_jump_if_false(self, frame, target, constants):
+        stack = frame.stack
+        right = stack.pop()
+        if not stack.pop() > right:
+            frame.ip = target
+
+    def _handle_compare_ge_jump_if_false(self, frame, target, constants):
+        stack = frame.stack
+        right = stack.pop()
+        if not stack.pop() >= right:
+            frame.ip = target
+
+    def _handle_load_const_store_fast(self, frame, operand, constants):
+        const, slot = operand
+        frame.locals[slot] = constants[const]
+
+
+# Quickened forms of BINARY_ADD by the type of both operands; see VM._handle_binary_add_adaptive
+QUICKENED_BINARY_ADD = {
+    int: VM._handle_binary_add_int,
+    float: VM._handle_binary_add_float,
+    str: VM._handle_binary_add_str,
+}
@@ -0,0 +1,17 @@
+import pytest
+
+from flow.flow_cli import ENGINES, run_code
+
+
+@pytest.fixture(params=ENGINES)
+def engine(request):
+    return request.param
+
+
+@pytest.fixture
+def run(capsys, engine):
+    """Run a Flow program on each engine and return the lines it printed"""
+    def run(code):
+        run_code(code, engine=engine, use_cache=False)
+        return capsys.readouterr().out.split('\n')[:-1]
+    return run
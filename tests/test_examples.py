@@ -0,0 +1,20 @@
+from pathlib import Path
+
+import pytest
+
+from flow.flow_cli import run_code
+
+EXAMPLES = Path(__file__).parent.parent / 'examples'
+
+# Examples whose output depends on random numbers or the file system
+NONDETERMINISTIC = {'enhanced', 'fileio'}
+
+
+@pytest.mark.parametrize('name', sorted(path.stem for path in EXAMPLES.glob('*.flow')
+                                        if path.stem not in NONDETERMINISTIC))
+def test_example_prints_the_same_on_every_engine(name, engine, capsys):
+    source = (EXAMPLES / f'{name}.flow').read_text()
+    run_code(source, engine='ast', use_cache=False)
+    expected = capsys.readouterr().out
+    run_code(source, engine=engine, use_cache=False)
+    assert capsys.readouterr().out == expected
@@ -0,0 +1,15 @@
+from flow import flowc
+from flow.flowc import BytecodeCache
+
+
+def test_key_changes_with_compiler_source(tmp_path, monkeypatch):
+    cache = BytecodeCache(tmp_path)
+    key = cache.key('print 1', 16)
+    assert cache.key('print 1', 16) == key
+    monkeypatch.setattr(flowc, 'codegen_fingerprint', lambda: 'edited compiler')
+    assert cache.key('print 1', 16) != key
+
+
+def test_fingerprint_covers_compiler_and_optimizer():
+    names = {module.__name__ for module in flowc.CODEGEN_MODULES}
+    assert {'flow.compiler', 'flow.optimizer', 'flow.peephole'} <= names
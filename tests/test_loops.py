@@ -0,0 +1,19 @@
+import pytest
+
+
+def test_global_loop_variable_is_removed_after_loop(run):
+    code = '''
+    for i in [1, 2, 3] {}
+    print i
+    '''
+    with pytest.raises(NameError):
+        run(code)
+
+
+def test_global_loop_variable_gets_old_value_back(run):
+    code = '''
+    let i = 7
+    for i in [1, 2, 3] { print i }
+    print i
+    '''
+    assert run(code) == ['1', '2', '3', '7']
@@ -0,0 +1,37 @@
+def test_memo_function_caches_results(run):
+    code = '''
+    @memo
+    func fib(n) {
+        if n < 2 { return n }
+        return fib(n - 1) + fib(n - 2)
+    }
+    print fib(60)
+    '''
+    assert run(code) == ['1548008755920']
+
+
+def test_nested_memo_function_is_cached_per_call(run):
+    code = '''
+    func outer(n) {
+        @memo
+        func add(k) { return k + n }
+        return add(1)
+    }
+    print outer(1)
+    print outer(2)
+    '''
+    assert run(code) == ['2', '3']
+
+
+def test_each_closure_of_memo_function_has_its_own_cache(run):
+    code = '''
+    func adder(n) {
+        @memo
+        func add(k) { return k + n }
+        return add
+    }
+    let add10 = adder(10)
+    let add20 = adder(20)
+    print add10(1), add20(1), add10(1)
+    '''
+    assert run(code) == ['11 21 11']
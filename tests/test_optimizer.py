@@ -0,0 +1,92 @@
+import pytest
+
+from flow import optimizer
+from flow.flow_cli import parse_code
+from flow.lexer import TokenType
+from flow.optimizer import walk
+from flow.parser import BinOpNode, VariableDeclarationNode
+
+
+def hoisted_names(code):
+    return [node.identifier for node in walk(parse_code(code))
+            if isinstance(node, VariableDeclarationNode) and node.identifier.startswith('$')]
+
+
+def test_invariant_is_hoisted_out_of_for_loop():
+    code = '''
+    mut k = 3
+    for x in [1, 2] { print x * (k * 2) }
+    '''
+    assert hoisted_names(code) == ['$loop0', '$loop1']
+
+
+def test_raising_invariant_stays_after_earlier_print(run, capsys):
+    code = '''
+    mut d = 0
+    mut i = 0
+    while i < 2 {
+        print "before"
+        print 10 / d
+        i = i + 1
+    }
+    '''
+    with pytest.raises(ZeroDivisionError):
+        run(code)
+    assert capsys.readouterr().out == 'before\n'
+
+
+def test_hoisting_keeps_error_for_non_list_iterable(run):
+    code = '''
+    mut k = 3
+    for x in 5 { print x * (k * 2) }
+    '''
+    with pytest.raises(Exception, match='Cannot iterate over int'):
+        run(code)
+
+
+def folded(code):
+    return parse_code(code).statements[0].values[0]
+
+
+def test_small_results_are_folded():
+    assert folded('print "ab" * 3').value == 'ababab'
+    assert folded('print 6 * 7').value == 42
+
+
+def test_oversized_results_are_not_folded(monkeypatch):
+    def multiply(left, right):
+        raise AssertionError('folding built the value')
+    monkeypatch.setitem(optimizer.FOLDABLE_BINARY_OPS, TokenType.MULTIPLY, multiply)
+    assert isinstance(folded('print "x" * 100000000'), BinOpNode)
+    big = 2 ** 4000
+    assert isinstance(folded(f'print {big} * {big}'), BinOpNode)
+    assert isinstance(folded('print "%0100000000d" % 5'), BinOpNode)
+
+
+def test_list_expression_is_not_hoisted_when_loop_modifies_lists(run):
+    code = '''
+    let xs = [1]
+    let ys = [2]
+    mut i = 0
+    while i < 3 {
+        let y = xs + ys
+        print y
+        append(xs, i)
+        i = i + 1
+    }
+    '''
+    assert run(code) == ['[1, 2]', '[1, 0, 2]', '[1, 0, 1, 2]']
+
+
+def test_list_comparison_in_condition_sees_loop_changes(run):
+    code = '''
+    let a = []
+    let b = [0, 1]
+    mut n = 0
+    while a != b and n < 10 {
+        append(a, n % 2)
+        n = n + 1
+    }
+    print n
+    '''
+    assert run(code) == ['2']
@@ -0,0 +1,51 @@
+from flow.bytecode import CodeObject
+from flow.flow_cli import compile_program
+from flow.vm import VM
+
+
+def add_handlers(code_obj):
+    return [handler.__name__ for handler, _ in code_obj.threaded if 'binary_add' in handler.__name__]
+
+
+def run_bytecode(capsys, code):
+    # Nothing is inlined, so add keeps its own generic BINARY_ADD
+    code_obj, _ = compile_program(code, inline_threshold=0, use_cache=False)
+    VM().run(code_obj)
+    function = next(c for c in code_obj.constants if isinstance(c, CodeObject) and c.name == 'add')
+    return capsys.readouterr().out.split('\n')[:-1], add_handlers(function)
+
+
+def test_add_is_quickened_for_the_types_it_sees(capsys):
+    code = '''
+    func same(x) { return x }
+    func add(a, b) { return a + same(b) }
+    print add(1, 2), add(3, 4)
+    '''
+    output, handlers = run_bytecode(capsys, code)
+    assert output == ['3 7']
+    assert handlers == ['_handle_binary_add_int']
+
+
+def test_failed_guard_falls_back_to_generic_add(capsys):
+    code = '''
+    func same(x) { return x }
+    func add(a, b) { return a + same(b) }
+    print add(1, 2), add("a", "b"), add(1.5, 1), add([1], [2])
+    '''
+    output, handlers = run_bytecode(capsys, code)
+    assert output == ['3 ab 2.5 [1, 2]']
+    assert handlers == ['_handle_binary_add']
+
+
+def test_quickened_add_across_engines(run):
+    code = '''
+    func add(a, b) { return a + b }
+    mut total = 0
+    mut i = 0
+    while i < 3 {
+        total = add(total, i)
+        i = i + 1
+    }
+    print total, add(true, 1), add("x", "y"), add(0.5, 0.25)
+    '''
+    assert run(code) == ['3 2 xy 0.75']
@@ -0,0 +1,111 @@
+import pytest
+
+
+def test_nested_function_reads_enclosing_locals(run):
+    code = '''
+    func outer(n) {
+        func helper(k) { return k + n }
+        return helper(10)
+    }
+    print outer(5)
+    '''
+    assert run(code) == ['15']
+
+
+def test_nested_functions_reach_every_enclosing_function(run):
+    code = '''
+    func a(x) {
+        let y = x * 2
+        func b(z) {
+            func c(w) { return w + y + x + z }
+            return c(1)
+        }
+        return b(100)
+    }
+    print a(3)
+    func count(n) {
+        func loop(i, total) {
+            if i > n { return total }
+            return loop(i + 1, total + i)
+        }
+        return loop(1, 0)
+    }
+    print count(10)
+    '''
+    assert run(code) == ['110', '55']
+
+
+def test_returned_function_keeps_its_enclosing_locals(run):
+    code = '''
+    func adder(k) {
+        func add(v) { return v + k }
+        return add
+    }
+    let add7 = adder(7)
+    let add1 = adder(1)
+    print add7(1), add1(1)
+    '''
+    assert run(code) == ['8 2']
+
+
+def test_assignment_in_function_updates_global(run):
+    code = '''
+    let total = 0
+    func bump() {
+        total = total + 1
+        return total
+    }
+    print bump()
+    print bump()
+    print total
+    '''
+    assert run(code) == ['1', '2', '2']
+
+
+def test_let_in_function_shadows_global(run):
+    code = '''
+    let total = 0
+    func shadow() {
+        let total = 5
+        total = total + 1
+        return total
+    }
+    print shadow(), total
+    '''
+    assert run(code) == ['6 0']
+
+
+def test_nested_function_assigns_enclosing_local(run):
+    code = '''
+    func outer() {
+        let seen = 1
+        func bump() {
+            seen = seen + 1
+            return 0
+        }
+        let before = seen + bump()
+        let i = 0
+        while i < 2 {
+            bump()
+            print seen * 100
+            i = i + 1
+        }
+        return before
+    }
+    print outer()
+    '''
+    assert run(code) == ['300', '400', '1']
+
+
+def test_nested_function_is_not_global(run, capsys):
+    code = '''
+    func outerFunction() {
+        func innerFunction() { print "inner" }
+        innerFunction()
+    }
+    outerFunction()
+    innerFunction()
+    '''
+    with pytest.raises(NameError):
+        run(code)
+    assert capsys.readouterr().out == 'inner\n'